@@ -0,0 +1,62 @@
+// Stream the analog inputs as binary frames, see thermodog/framing.py:
+//
+//   0xA5 0x5A | seq (uint16) | n (uint8) | n x uint16 counts | CRC-16
+//
+// little-endian, the CRC-16/CCITT-FALSE of seq, n and the counts. At
+// 115200 baud a 5 channel frame (17 bytes) fits ~670 times a second;
+// frames are sent every SAMPLE_MICROS and averaged down on the host.
+
+const int npins = 5;
+const int apins[] = {A0, A1, A2, A3, A4};
+
+const unsigned long SAMPLE_MICROS = 2500;   // 400 Hz
+
+const int FRAME_SIZE = 5 + 2*npins + 2;
+
+uint8_t frame[FRAME_SIZE];
+uint16_t seq = 0;
+unsigned long next = 0;
+
+uint16_t crc16(const uint8_t *data, int len) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < len; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
+void setup() {
+  Serial.begin(115200);
+  frame[0] = 0xA5;
+  frame[1] = 0x5A;
+  frame[4] = npins;
+  next = micros();
+}
+
+void loop() {
+  // wait for the next sample time; micros() wraps, the difference doesn't.
+  while ((long)(micros() - next) < 0) {
+  }
+  next += SAMPLE_MICROS;
+
+  frame[2] = seq & 0xFF;
+  frame[3] = seq >> 8;
+  for (int i = 0; i < npins; i++) {
+    uint16_t v = analogRead(apins[i]);
+    frame[5 + 2*i] = v & 0xFF;
+    frame[6 + 2*i] = v >> 8;
+  }
+  uint16_t crc = crc16(frame + 2, FRAME_SIZE - 4);
+  frame[FRAME_SIZE - 2] = crc & 0xFF;
+  frame[FRAME_SIZE - 1] = crc >> 8;
+
+  // drop the frame rather than block if the host falls behind; the
+  // sequence number tells it so.
+  if (Serial.availableForWrite() >= FRAME_SIZE) {
+    Serial.write(frame, FRAME_SIZE);
+  }
+  seq++;
+}
@@ -20,7 +20,8 @@ setuptools.setup(
     license="LICENSE.txt",
     install_requires=["docopt"],
     tests_require=["coverage", "flake8"],
-    scripts=["bin/thermodog", "bin/gasdog"],
+    scripts=["bin/thermodog", "bin/gasdog", "bin/thermodog-query",
+             "bin/thermodog-aggregator"],
     packages=["thermodog"],
     platforms=["MacOS X", "Posix"]
 )
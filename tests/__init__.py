@@ -0,0 +1,44 @@
+##
+## The simulated board is process-wide, and `ThermoDog` a singleton:
+## every test module shares one dog, alerting to `ALERTER`.
+##
+import time
+
+class RecordingAlerter(object):
+    def __init__(self):
+        self.alerts = []
+
+    def alertSys(self, msg):
+        self.alerts.append(("sys", msg))
+
+    def alertMon(self, msg):
+        self.alerts.append(("mon", msg))
+
+    def alertAll(self, msg):
+        self.alerts.append(("all", msg))
+
+ALERTER = RecordingAlerter()
+
+def simDog():
+    from thermodog import ThermoDog
+    return ThermoDog(name="sim", alerter=ALERTER)
+
+def resetSim(dog):
+    """Stop every hub and sensor and return the chips to 20C."""
+    from thermodog import sim
+    from thermodog.monitor import SensorHub
+    for h in SensorHub.hubs():
+        h.stop()
+    for d in list(SensorHub._drivers):
+        d.stop()
+    dog.stopSensors()
+    for c in sim.chips:
+        c.clear()
+        c.script(celsius=20.0, internal=25.0)
+    del ALERTER.alerts[:]
+
+def waitFor(fx, timeout=5):
+    deadline = time.time() + timeout
+    while not fx() and time.time() < deadline:
+        time.sleep(.02)
+    return fx()
@@ -0,0 +1,106 @@
+import os
+import unittest
+
+from threading import Thread
+
+from botocore.stub import Stubber
+
+from thermodog import aws
+from thermodog.aws import ClientRegistry
+
+IDENTITY = {"Account": "123456789012", "Arn": "arn:aws:iam::123456789012:root",
+            "UserId": "AIDEXAMPLE"}
+
+class ClientRegistryTest(unittest.TestCase):
+    ENV = {"AWS_ACCESS_KEY_ID": "AKIDEXAMPLE",
+           "AWS_SECRET_ACCESS_KEY": "secret",
+           "AWS_CONFIG_FILE": "/nonexistent",
+           "AWS_SHARED_CREDENTIALS_FILE": "/nonexistent"}
+
+    def setUp(self):
+        self.saved = dict((k, os.environ.get(k)) for k in self.ENV)
+        os.environ.update(self.ENV)
+        self.registry = ClientRegistry(region="us-west-2", retries=0)
+        self.calls = []
+        self.registry.addListener(lambda *args: self.calls.append(args))
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def test_shared_per_service_and_region(self):
+        r = self.registry
+        sts = r.client("sts")
+        self.assertTrue(r.client("sts") is sts)
+        self.assertTrue(r.client("sts", "us-west-2") is sts)
+        self.assertEqual(sts.meta.region_name, "us-west-2")
+        east = r.client("sts", "us-east-1")
+        self.assertFalse(east is sts)
+        self.assertEqual(east.meta.region_name, "us-east-1")
+        self.assertFalse(r.client("sns") is sts)
+        self.assertEqual(sts.meta.config.connect_timeout, 5)
+        ## a new configuration makes new clients.
+        r.configure(readTimeout=2)
+        self.assertFalse(r.client("sts") is sts)
+        self.assertEqual(r.client("sts").meta.config.read_timeout, 2)
+
+    def test_created_once_across_threads(self):
+        got = []
+        threads = [Thread(target=lambda: got.append(
+            self.registry.client("cloudwatch"))) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(got), 8)
+        self.assertTrue(all(c is got[0] for c in got))
+
+    def test_timings(self):
+        sts = self.registry.client("sts")
+        with Stubber(sts) as stub:
+            stub.add_response("get_caller_identity", IDENTITY)
+            stub.add_client_error("get_caller_identity", "Throttling",
+                                  http_status_code=400)
+            self.assertEqual(sts.get_caller_identity()["Account"],
+                             IDENTITY["Account"])
+            self.assertRaises(Exception, sts.get_caller_identity)
+            stub.assert_no_pending_responses()
+        self.assertEqual([c[:2] + c[3:] for c in self.calls],
+                         [("sts", "GetCallerIdentity", True),
+                          ("sts", "GetCallerIdentity", False)])
+        self.assertTrue(all(0 <= c[2] < 1 for c in self.calls))
+        s = self.registry.stats()["sts.GetCallerIdentity"]
+        self.assertEqual((s["calls"], s["errors"]), (2, 1))
+        self.assertAlmostEqual(s["seconds"], sum(c[2] for c in self.calls))
+        self.assertEqual(s["maxSeconds"], max(c[2] for c in self.calls))
+
+    def test_connection_error(self):
+        sns = self.registry.client("sns")
+        def unreachable(**args):
+            raise IOError("unreachable")
+        sns.meta.events.register("before-send", unreachable)
+        self.assertRaises(IOError, sns.publish, TopicArn="arn", Message="x")
+        self.assertEqual([c[:2] + c[3:] for c in self.calls],
+                         [("sns", "Publish", False)])
+        self.assertEqual(self.registry.stats()["sns.Publish"]["errors"], 1)
+
+    def test_failing_listener(self):
+        def broken(*args):
+            raise ValueError("listener bug")
+        self.registry.addListener(broken)
+        sts = self.registry.client("sts")
+        with Stubber(sts) as stub:
+            stub.add_response("get_caller_identity", IDENTITY)
+            ## a failing listener doesn't fail the call, or the others.
+            sts.get_caller_identity()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_module_registry(self):
+        self.assertTrue(aws.client("sts", "us-west-2") is
+                        aws.registry.client("sts", "us-west-2"))
+
+if __name__ == "__main__":
+    unittest.main()
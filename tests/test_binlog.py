@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import datetime
+import unittest
+
+import numpy
+import pytz
+
+from thermodog.binlog import BinaryLog, readSegment, segmentName, \
+    formatTsv, HEADER_SIZE, RECORD, _header
+
+T0 = datetime.datetime(2020, 3, 1, 23, 58, 0, 250000, tzinfo=pytz.utc)
+
+def reading(i, seconds=30):
+    return {"timestamp": T0 + datetime.timedelta(seconds=seconds*i),
+            "celsius": 20.0 + i, "internal": 25.0, "channel": 1}
+
+class BinaryLogTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def log(self, **args):
+        return BinaryLog(self.dir, "walk-in-1", **args)
+
+    def test_round_trip(self):
+        b = self.log(blockRecords=4, flushSeconds=1e9)
+        for i in range(10):
+            b.write(reading(i))
+        b.close()
+        segs = b.segments()
+        self.assertEqual([os.path.basename(p) for p in segs],
+                         ["walk-in-1-20200301-000.tdl.gz",
+                          "walk-in-1-20200302-000.tdl.gz"])
+        self.assertEqual(segmentName(segs[0]), "walk-in-1")
+        recs = numpy.concatenate([readSegment(p) for p in segs])
+        self.assertEqual(list(recs["celsius"]), [20.0 + i for i in range(10)])
+        self.assertEqual(recs["timestamp"][1] - recs["timestamp"][0], 30)
+        self.assertEqual(recs["timestamp"][0] % 1, .25)
+        self.assertTrue((recs["channel"] == 1).all())
+        self.assertEqual(b.stats()["records"], 10)
+
+    def test_block_split_at_midnight(self):
+        ## one block of records either side of midnight.
+        b = self.log(blockRecords=100, flushSeconds=1e9, compress=False)
+        for i in range(8):
+            b.write(reading(i))
+        b.close()
+        segs = b.segments()
+        self.assertEqual(len(segs), 2)
+        first, second = [readSegment(p) for p in segs]
+        self.assertEqual(len(first), 4)
+        self.assertEqual(len(second), 4)
+        day = 86400*(int(first["timestamp"][0]) // 86400 + 1)
+        self.assertTrue((first["timestamp"] < day).all())
+        self.assertTrue((second["timestamp"] >= day).all())
+
+    def test_size_rotation(self):
+        b = self.log(blockRecords=2, maxBytes=HEADER_SIZE + 4*RECORD.itemsize,
+                     compress=False, flushSeconds=1e9)
+        for i in range(12):
+            b.write(reading(i, seconds=1))
+        b.close()
+        segs = b.segments()
+        self.assertEqual([os.path.basename(p)[-7:-4] for p in segs],
+                         ["000", "001", "002"])
+        self.assertEqual([len(readSegment(p)) for p in segs], [4, 4, 4])
+        ## another log's segments, even with a dashed prefix, are not
+        ## this one's.
+        other = BinaryLog(self.dir, "walk-in")
+        other.write(reading(0))
+        other.close()
+        self.assertEqual(b.segments(), segs)
+
+    def test_partial_record(self):
+        b = self.log(compress=False)
+        for i in range(3):
+            b.write(reading(i))
+        b.close()
+        path = b.segments()[0]
+        with open(path, "ab") as f:
+            f.write(b"\x01\x02\x03")
+        self.assertEqual(len(readSegment(path)), 3)
+        lines = list(formatTsv("walk-in-1", readSegment(path)))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith("20.00C"))
+
+    def test_header_validation(self):
+        bad = os.path.join(self.dir, "bad.tdl")
+        with open(bad, "wb") as f:
+            f.write(b"NOTALOG!" + b"\x00"*40)
+        self.assertRaises(ValueError, readSegment, bad)
+        with open(bad, "wb") as f:
+            f.write(b"\x00"*8)
+        self.assertRaises(ValueError, readSegment, bad)
+        ## a different record layout.
+        head = bytearray(_header("x"))
+        head[10] += 1
+        with open(bad, "wb") as f:
+            f.write(bytes(head))
+        self.assertRaises(ValueError, readSegment, bad)
+        with open(bad, "wb") as f:
+            f.write(_header("x"))
+        self.assertEqual(len(readSegment(bad)), 0)
+        self.assertEqual(segmentName(bad), "x")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,212 @@
+import time
+import shutil
+import tempfile
+import unittest
+
+from datetime import timedelta
+from threading import Thread
+
+from thermodog.cloudwatch import CloudWatchPublisher, CloudWatchHistory, \
+    epochSeconds, epochToUtc
+from thermodog.common import utcNow
+from thermodog.spool import Spool
+
+NAMESPACE = "Wholebiome/Thermodog"
+
+def metric(name):
+    return {"MetricName": "Temperature",
+            "Dimensions": [{"Name": "MonitorName", "Value": name}]}
+
+class StubCloudWatch(object):
+    """Records `put_metric_data` requests; fails while `down`."""
+    def __init__(self):
+        self.requests = []
+        self.down     = False
+
+    def put_metric_data(self, Namespace, MetricData):
+        if self.down:
+            raise IOError("uplink down")
+        self.requests.append((Namespace, MetricData))
+
+class CloudWatchPublisherTest(unittest.TestCase):
+    def setUp(self):
+        self.client = StubCloudWatch()
+        self.tmpdir = tempfile.mkdtemp()
+        self.t0 = epochToUtc(epochSeconds(utcNow()) // 60 * 60)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def publisher(self, **args):
+        return CloudWatchPublisher(client=self.client, period=60,
+                                   start=False, **args)
+
+    def test_aggregates_readings_per_period(self):
+        p = self.publisher()
+        for i, v in enumerate([20, 22, 21]):
+            p.put(NAMESPACE, metric("fridge"), v,
+                  self.t0 + timedelta(seconds=i))
+        p.put(NAMESPACE, metric("fridge"), 30, self.t0 + timedelta(seconds=60))
+        self.assertEqual(p.flush(), 2)
+        self.assertEqual(len(self.client.requests), 1)
+        namespace, datums = self.client.requests[0]
+        self.assertEqual(namespace, NAMESPACE)
+        first = datums[0]["StatisticValues"]
+        self.assertEqual(first["SampleCount"], 3.0)
+        self.assertEqual(first["Sum"], 63.0)
+        self.assertEqual((first["Minimum"], first["Maximum"]), (20.0, 22.0))
+        self.assertEqual(datums[0]["Timestamp"], self.t0)
+        self.assertEqual(datums[1]["StatisticValues"]["SampleCount"], 1.0)
+
+    def test_values_mode(self):
+        p = self.publisher(mode=CloudWatchPublisher.VALUES)
+        for v in [20, 20, 21]:
+            p.put(NAMESPACE, metric("fridge"), v, self.t0)
+        p.flush()
+        datum = self.client.requests[0][1][0]
+        self.assertEqual(datum["Values"], [20.0, 21.0])
+        self.assertEqual(datum["Counts"], [2.0, 1.0])
+
+    def test_batches_up_to_the_datum_limit(self):
+        p = self.publisher()
+        for i in range(45):
+            p.put(NAMESPACE, metric("fridge-{}".format(i)), 4, self.t0)
+        self.assertEqual(p.flush(), 45)
+        self.assertEqual([len(d) for n, d in self.client.requests],
+                         [20, 20, 5])
+        self.assertEqual(p.stats()["maxBatch"], 20)
+
+    def test_spools_failed_requests_and_replays_them(self):
+        p = self.publisher(spool=Spool(self.tmpdir))
+        self.client.down = True
+        p.put(NAMESPACE, metric("fridge"), 4, self.t0)
+        self.assertEqual(p.flush(), 0)
+        self.assertFalse(p.spool.empty())
+        self.client.down = False
+        p.put(NAMESPACE, metric("fridge"), 5, self.t0 + timedelta(seconds=60))
+        self.assertEqual(p.flush(), 1)
+        self.assertEqual(len(self.client.requests), 2)
+        self.assertTrue(p.spool.empty())
+        self.assertEqual(p.stats()["replayed"], 1)
+
+    def test_background_thread_flushes_on_stop(self):
+        p = CloudWatchPublisher(client=self.client, period=60, maxAge=3600)
+        p.put(NAMESPACE, metric("fridge"), 4, self.t0)
+        p.stop()
+        self.assertEqual(len(self.client.requests), 1)
+
+    def test_stats_from_many_threads(self):
+        p = CloudWatchPublisher(client=self.client, period=60, maxAge=0,
+                                maxDatums=1)
+        def put(name):
+            for i in range(500):
+                p.put(NAMESPACE, metric(name), i, self.t0)
+        threads = [Thread(target=put, args=("fridge-{}".format(i),))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        p.stop()
+        s = p.stats()
+        self.assertEqual(s["readings"], 4000)
+        self.assertEqual(s["datums"], sum(len(d) for n, d in
+                                          self.client.requests))
+        self.assertEqual(s["requests"], len(self.client.requests))
+
+class FakeMetricData(object):
+    """Answers `get_metric_data` with a point every period, valued
+    by its epoch seconds, returning at most `pageSize` per page."""
+    def __init__(self, pageSize=100):
+        self.pageSize = pageSize
+        self.spans    = []
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime,
+                        ScanBy, NextToken=None):
+        start, end = epochSeconds(StartTime), epochSeconds(EndTime)
+        if NextToken is None:
+            self.spans.append((start, end))
+        period = MetricDataQueries[0]["MetricStat"]["Period"]
+        first = start + (-start % period)
+        ts = list(range(first, end, period))
+        page = int(NextToken or 0)
+        chunk = ts[page*self.pageSize:(page + 1)*self.pageSize]
+        r = {"MetricDataResults": [
+            {"Id": q["Id"], "Timestamps": [epochToUtc(t) for t in chunk],
+             "Values": [float(t) for t in chunk]}
+            for q in MetricDataQueries]}
+        if (page + 1)*self.pageSize < len(ts):
+            r["NextToken"] = str(page + 1)
+        return r
+
+class CloudWatchHistoryTest(unittest.TestCase):
+    DAY    = 24*60*60
+    PERIOD = 10*60
+
+    def setUp(self):
+        self.client = FakeMetricData()
+        self.tmpdir = tempfile.mkdtemp()
+        self.now = int(time.time())
+        self.metrics = [(NAMESPACE, metric("fridge")),
+                        (NAMESPACE, metric("freezer"))]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def history(self, **args):
+        return CloudWatchHistory(client=self.client, cachedir=self.tmpdir,
+                                 **args)
+
+    def assertComplete(self, result, start, end):
+        ts, vs = result
+        start -= start % self.PERIOD
+        expected = list(range(start + (-start % self.PERIOD), end,
+                              self.PERIOD))
+        self.assertEqual(ts, expected)
+        self.assertEqual(vs, [float(t) for t in expected])
+
+    def test_batches_metrics_and_follows_pages(self):
+        h = CloudWatchHistory(client=self.client, maxQueries=1)
+        start = self.now - self.DAY
+        results = h.fetch(self.metrics, start, self.now)
+        for r in results:
+            self.assertComplete(r, start, self.now)
+        ## one request per metric, each over two pages.
+        self.assertEqual(h.stats()["queries"], 2)
+        self.assertEqual(h.stats()["requests"], 4)
+
+    def test_fetches_only_the_unsettled_tail_again(self):
+        h = self.history()
+        start = self.now - self.DAY
+        h.fetch(self.metrics, start, self.now)
+        self.client.spans = []
+        results = h.fetch(self.metrics, start, self.now)
+        for r in results:
+            self.assertComplete(r, start, self.now)
+        self.assertEqual(len(self.client.spans), 1)
+        lo, hi = self.client.spans[0]
+        self.assertTrue(hi - lo <= 2*self.PERIOD + h._settle)
+
+    def test_disjoint_range_leaves_a_gap_uncovered(self):
+        h = self.history()
+        h.fetch(self.metrics, self.now - self.DAY, self.now)
+        h.fetch(self.metrics, self.now - 8*self.DAY, self.now - 7*self.DAY)
+        self.client.spans = []
+        start, end = self.now - 7*self.DAY, self.now - self.DAY
+        for r in h.fetch(self.metrics, start, end):
+            self.assertComplete(r, start, end)
+        self.assertEqual(len(self.client.spans), 1)
+        for r in h.fetch(self.metrics, self.now - 8*self.DAY, self.now):
+            self.assertComplete(r, self.now - 8*self.DAY, self.now)
+
+    def test_gaps(self):
+        h = self.history()
+        self.assertEqual(h._gaps(None, 0, 100), [(0, 100)])
+        self.assertEqual(h._gaps([[10, 20], [40, 50]], 0, 100),
+                         [(0, 10), (20, 40), (50, 100)])
+        self.assertEqual(h._gaps([[0, 60], [50, 100]], 10, 90), [])
+        self.assertEqual(h._merge([[40, 50], [0, 10], [10, 20]]),
+                         [[0, 20], [40, 50]])
+
+if __name__ == "__main__":
+    unittest.main()
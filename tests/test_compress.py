@@ -0,0 +1,97 @@
+import math
+import random
+import unittest
+
+from thermodog.compress import Deadband, SwingingDoor, CompressedStream, \
+    makeCompressor
+from thermodog.common import utcNow
+
+def series(n=2000, seed=5):
+    """A slow cycle with noise and a few steps, one point per 10s."""
+    rng = random.Random(seed)
+    pts, level = [], 20.0
+    for i in range(n):
+        if rng.random() < .005:
+            level += rng.choice((-3, 3))
+        v = level + 2*math.sin(i/50.0) + rng.gauss(0, .05)
+        pts.append((10.0*i, v))
+    return pts
+
+def compress(c, pts):
+    kept = []
+    for t, v in pts:
+        kept.extend(c.offer(t, v, (t, v)))
+    kept.extend(c.flush())
+    return kept
+
+def held(kept, t):
+    """Deadband rebuild: the last kept value at `t`."""
+    v = None
+    for kt, kv in kept:
+        if kt > t:
+            break
+        v = kv
+    return v
+
+def interpolated(kept, t):
+    """Swinging-door rebuild: the line between kept points about `t`."""
+    for (t0, v0), (t1, v1) in zip(kept, kept[1:]):
+        if t0 <= t <= t1:
+            return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+    raise AssertionError("{} is not covered".format(t))
+
+class CompressTest(unittest.TestCase):
+    def checkRebuild(self, c, rebuild):
+        pts = series()
+        kept = compress(c, pts)
+        self.assertEqual(kept, sorted(kept))
+        self.assertEqual(kept[0], pts[0])
+        for t, v in pts:
+            self.assertTrue(abs(rebuild(kept, t) - v) <= c.tolerance + 1e-9,
+                            "{} at {}".format(v, t))
+        self.assertTrue(c.ratio > 3)
+        return kept
+
+    def test_deadband(self):
+        self.checkRebuild(Deadband(.25, keepAlive=1e9), held)
+
+    def test_swinging_door(self):
+        kept = self.checkRebuild(SwingingDoor(.25, keepAlive=1e9),
+                                 interpolated)
+        ## the flush closes the last segment.
+        self.assertEqual(kept[-1], series()[-1])
+        ## far fewer points than holding values would need.
+        self.assertTrue(len(kept) <
+                        len(compress(Deadband(.25, keepAlive=1e9), series())))
+
+    def checkKeepAlive(self, c):
+        kept = compress(c, [(10.0*i, 20.0) for i in range(100)])
+        ts = [t for t, v in kept]
+        self.assertEqual(ts[0], 0)
+        self.assertTrue(all(b - a <= 60 for a, b in zip(ts, ts[1:])))
+        self.assertTrue(len(ts) >= 990 // 60)
+        ## after a silence longer than `keepAlive`, the next point is
+        ## kept at once.
+        self.assertEqual(c.offer(2000.0, 20.0, (2000.0, 20.0))[-1],
+                         (2000.0, 20.0))
+
+    def test_keep_alive(self):
+        self.checkKeepAlive(Deadband(.5, keepAlive=60))
+        self.checkKeepAlive(SwingingDoor(.5, keepAlive=60))
+
+    def test_make_compressor(self):
+        self.assertTrue(isinstance(makeCompressor("swinging-door", 1),
+                                   SwingingDoor))
+        self.assertRaises(ValueError, makeCompressor, "gzip", 1)
+
+    def test_stream(self):
+        out = []
+        s = CompressedStream(out.append, Deadband(.5))
+        for v in (20.0, 20.1, float("nan"), 21.0, None, 21.2):
+            s({"timestamp": utcNow(), "celsius": v})
+        s.flush()
+        self.assertEqual([e["celsius"] for e in out], [20.0, 21.0])
+        self.assertEqual(s.compressor.stats()["offered"], 4)
+
+if __name__ == "__main__":
+    unittest.main()
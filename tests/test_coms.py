@@ -0,0 +1,188 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from thermodog.coms import TokenBucket, RateLimiter, SnsTopic, SmsAlerter
+from thermodog.spool import Spool
+
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class TokenBucketTest(unittest.TestCase):
+    def test_refill(self):
+        b = TokenBucket(4, 3600, tokens=0, stamp=0)
+        self.assertEqual(b.tokens(0), 0)
+        ## one token per `period`/`capacity` seconds.
+        self.assertAlmostEqual(b.tokens(900), 1)
+        self.assertAlmostEqual(b.tokens(1350), 1.5)
+        b.take()
+        self.assertAlmostEqual(b.tokens(1350), .5)
+        ## never beyond capacity.
+        self.assertEqual(b.tokens(10*3600), 4)
+        ## a clock going backwards adds nothing.
+        self.assertEqual(b.tokens(0), 4)
+
+    def test_state(self):
+        b = TokenBucket(4, 3600, tokens=2, stamp=10)
+        self.assertEqual(b.state(), [2, 10])
+        c = TokenBucket(4, 3600, *b.state())
+        self.assertEqual(c.tokens(910), 3)
+
+class RateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "rate-limits.json")
+        self.clock = Clock()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def limiter(self, **args):
+        return RateLimiter(self.path, perHour=2, perDay=3, clock=self.clock,
+                           **args)
+
+    def send(self, limiter, key):
+        if limiter.allows(key):
+            limiter.record(key)
+            return True
+        limiter.suppress(key)
+        return False
+
+    def test_hourly_and_daily(self):
+        l = self.limiter()
+        self.assertEqual([self.send(l, "k") for i in range(3)],
+                         [True, True, False])
+        self.assertEqual(l.remaining("k"), (0, 1))
+        ## half an hour refills one hourly token.
+        self.clock.now += 1800
+        self.assertTrue(self.send(l, "k"))
+        self.clock.now += 1800
+        ## the daily cap holds.
+        self.assertFalse(self.send(l, "k"))
+        self.assertEqual(l.remaining("k"), (1, 0))
+        self.clock.now += RateLimiter.DAY
+        self.assertEqual(l.remaining("k"), (2, 3))
+
+    def test_keys_independent(self):
+        l = self.limiter()
+        l.configure("b", perHour=1)
+        self.assertEqual([self.send(l, "a") for i in range(2)], [True, True])
+        self.assertEqual([self.send(l, "b") for i in range(2)], [True, False])
+
+    def test_suppressed(self):
+        l = self.limiter()
+        for i in range(5):
+            self.send(l, "a")
+        self.send(l, "b")
+        self.assertEqual(l.suppressed("a"), 3)
+        self.assertEqual(l.suppressed("b"), 0)
+        self.assertEqual(l.suppressed(), 3)
+        self.assertEqual(l.stats(), {"admitted": {"a": 2, "b": 1},
+                                     "suppressed": {"a": 3}})
+
+    def test_persists(self):
+        l = self.limiter()
+        for i in range(3):
+            self.send(l, "a")
+        with open(self.path) as f:
+            self.assertEqual(json.load(f)["suppressed"], {"a": 1})
+        ## a restart keeps the caps, and the refill resumes from the
+        ## saved stamp.
+        self.clock.now += 1800
+        m = self.limiter()
+        self.assertEqual(m.suppressed("a"), 1)
+        self.assertEqual(m.stats()["admitted"], {"a": 2})
+        self.assertEqual(m.remaining("a"), (1, 1))
+        self.assertTrue(self.send(m, "a"))
+        self.assertFalse(self.send(m, "a"))
+
+    def test_unreadable_state(self):
+        with open(self.path, "w") as f:
+            f.write("{not json")
+        l = self.limiter()
+        self.assertEqual(l.remaining("a"), (2, 3))
+        self.assertTrue(self.send(l, "a"))
+
+class StubSns(object):
+    def __init__(self):
+        self.published = []
+        self.down = False
+
+    def publish(self, **args):
+        if self.down:
+            raise IOError("uplink down")
+        self.published.append(args.get("Message"))
+
+class AlertPathTest(unittest.TestCase):
+    """Topic and SMS alerts treat failures and rate limits alike."""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.clock = Clock()
+        self.limiter = RateLimiter(perHour=2, perDay=10, clock=self.clock)
+        self.client = StubSns()
+        self.spools = []
+
+    def tearDown(self):
+        for s in self.spools:
+            s.close()
+        shutil.rmtree(self.dir)
+
+    def spool(self, name):
+        s = Spool(os.path.join(self.dir, name), sync=False)
+        self.spools.append(s)
+        return s
+
+    def topic(self):
+        t = SnsTopic("alerts", spool=self.spool("sns"), limiter=self.limiter)
+        t._client, t._pubArn = self.client, "arn:alerts"
+        return t.publish, t.retry, t.limiterKey
+
+    def sms(self):
+        a = SmsAlerter(spool=self.spool("sms"), limiter=self.limiter)
+        a.addRecipient("+15550100", SmsAlerter.SYS_LIST, maxSmsPerHour=2,
+                       maxSmsPerDay=10)
+        g, r = a.recipients()[0]
+        r._client = self.client
+        def send(subject, msg):
+            ## as `alert` does, for one recipient.
+            a.retry()
+            return a.send(r, msg)
+        return send, a.retry, r.limiterKey
+
+    def check(self, path):
+        send, retry, key = path
+        self.client.down = True
+        self.assertFalse(send("s", "a"))
+        self.assertEqual(self.client.published, [])
+        self.client.down = False
+        self.assertTrue(send("s", "b"))
+        ## spooled messages go first; the rate limit drops the rest.
+        self.assertEqual(self.client.published, ["a", "b"])
+        self.assertFalse(send("s", "c"))
+        self.assertEqual(self.limiter.suppressed(key), 1)
+        ## a spooled message waits out the limit instead.
+        self.client.down = True
+        self.clock.now += 1800
+        self.assertFalse(send("s", "d"))
+        self.client.down = False
+        self.assertFalse(send("s", "e"))
+        self.assertEqual(self.client.published, ["a", "b", "d"])
+        self.assertEqual(retry(), 0)
+        self.clock.now += 1800
+        self.assertEqual(retry(), 0)
+        self.assertEqual(self.limiter.suppressed(key), 2)
+
+    def test_topic(self):
+        self.check(self.topic())
+
+    def test_sms(self):
+        self.check(self.sms())
+
+if __name__ == "__main__":
+    unittest.main()
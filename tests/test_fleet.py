@@ -0,0 +1,81 @@
+import time
+import unittest
+
+from thermodog.fleet import FleetClient, FleetAggregator
+from thermodog.common import utcNow
+
+class StubPublisher(object):
+    def __init__(self):
+        self.puts = []
+
+    def put(self, namespace, metricDict, value, timestamp=None):
+        self.puts.append((metricDict["Dimensions"][0]["Value"], value))
+
+def reading(celsius):
+    return {"timestamp": utcNow(), "celsius": celsius, "channel": 1}
+
+class FleetTest(unittest.TestCase):
+    def setUp(self):
+        self.publisher = StubPublisher()
+        self.aggregator = FleetAggregator(("127.0.0.1", 0),
+                                          publisher=self.publisher)
+        self.address = self.aggregator.address
+        self.clients = []
+
+    def tearDown(self):
+        for c in self.clients:
+            c.stop()
+        self.aggregator.stop()
+
+    def client(self, **args):
+        c = FleetClient(self.address, "dog", interval=.05, **args)
+        self.clients.append(c)
+        return c
+
+    def waitFor(self, fx, timeout=5):
+        deadline = time.time() + timeout
+        while not fx() and time.time() < deadline:
+            time.sleep(.02)
+        return fx()
+
+    def test_round_trip(self):
+        c = self.client()
+        for v in range(10):
+            c.add("fridge", reading(v))
+        self.assertTrue(self.waitFor(lambda: c.stats()["pending"] == 0))
+        self.assertEqual(sorted(v for s, v in self.publisher.puts),
+                         list(range(10)))
+        ## resent datagrams are taken once.
+        self.assertEqual(self.aggregator.stats()["readings"], 10)
+        self.assertEqual(self.aggregator.latest()[("dog", "fridge")][1], 9)
+
+    def test_aggregator_restart(self):
+        c = self.client()
+        for v in range(5):
+            c.add("fridge", reading(v))
+        self.assertTrue(self.waitFor(lambda: c.stats()["pending"] == 0))
+        self.aggregator.stop()
+        for v in range(5, 10):
+            c.add("fridge", reading(v))
+        time.sleep(.2)
+        self.assertEqual(c.stats()["pending"], 5)
+        self.publisher = StubPublisher()
+        self.aggregator = FleetAggregator(self.address,
+                                          publisher=self.publisher)
+        ## the new aggregator acks from the dog's oldest pending reading.
+        self.assertTrue(self.waitFor(lambda: c.stats()["pending"] == 0))
+        self.assertEqual(sorted(v for s, v in self.publisher.puts),
+                         list(range(5, 10)))
+
+    def test_readings_dropped_by_the_dog(self):
+        c = self.client(maxPending=3)
+        self.aggregator.stop()
+        for v in range(10):
+            c.add("fridge", reading(v))
+        self.aggregator = FleetAggregator(self.address,
+                                          publisher=self.publisher)
+        self.assertTrue(self.waitFor(lambda: c.stats()["pending"] == 0))
+        self.assertEqual(sorted(v for s, v in self.publisher.puts), [7, 8, 9])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+
+from thermodog.monitor import SensorHub, AdaptiveSampling
+
+from tests import waitFor
+
+class StubSensor(object):
+    """Counts its reads; raises `error` while set."""
+    def __init__(self, name="fridge"):
+        self.name   = name
+        self.reads  = 0
+        self.error  = None
+        self.alerts = []
+
+    def stopped(self):
+        return False
+
+    def sample(self):
+        self.reads += 1
+        if self.error:
+            raise self.error
+        return {"celsius": 20.0, "reading": self.reads}
+
+    def formatMsg(self, msg):
+        return "[{}] - {}".format(self.name, msg)
+
+    def alertSys(self, msg):
+        self.alerts.append(msg)
+
+class SensorHubTest(unittest.TestCase):
+    def setUp(self):
+        self.sensor = StubSensor()
+        self.hubs = []
+
+    def tearDown(self):
+        for h in self.hubs:
+            h.stop()
+
+    def hub(self, **args):
+        h = SensorHub.forSensor(self.sensor, **args)
+        self.hubs.append(h)
+        return h
+
+    def tick(self, hub, ticks):
+        """Tick at each second of `ticks`, reading if any subscriber
+        is due; returns the ticks read at."""
+        read = []
+        for now in ticks:
+            subs = hub.due(now)
+            if subs:
+                hub.publish(subs, self.sensor.sample(), now)
+                read.append(now)
+        return read
+
+    def test_fan_out(self):
+        hub = self.hub()
+        got = dict((f, []) for f in (1, 2, 4))
+        for f in got:
+            hub.subscribe(got[f].append, freq=f, start=False)
+        self.assertEqual(hub.freq, 1)
+        self.tick(hub, range(8))
+        ## one read per tick, shared by every subscriber due.
+        self.assertEqual(self.sensor.reads, 8)
+        self.assertEqual(hub.samples, 8)
+        self.assertEqual([e["reading"] for e in got[1]], list(range(1, 9)))
+        self.assertEqual([e["reading"] for e in got[2]], [1, 3, 5, 7])
+        self.assertEqual([e["reading"] for e in got[4]], [1, 5])
+        ## each subscriber gets its own copy.
+        got[1][0]["celsius"] = 0
+        self.assertEqual(got[2][0]["celsius"], 20.0)
+
+    def test_every(self):
+        hub = self.hub()
+        got = []
+        hub.subscribe(got.append, every=3, start=False)
+        self.assertEqual(self.tick(hub, range(9)), [2, 5, 8])
+        self.assertEqual(len(got), 3)
+
+    def test_cancel(self):
+        hub = self.hub()
+        fast, slow = [], []
+        a = hub.subscribe(fast.append, freq=1, start=False)
+        b = hub.subscribe(slow.append, freq=5, start=False)
+        self.tick(hub, range(2))
+        a.cancel()
+        a.cancel()
+        ## the period follows the remaining subscribers.
+        self.assertEqual(hub.freq, 5)
+        self.assertEqual(hub.subscribers, [b])
+        self.assertFalse(a.due(10))
+        self.tick(hub, range(5, 11, 5))
+        self.assertEqual(len(fast), 2)
+        self.assertEqual(len(slow), 3)
+        hub.unsubscribe(b)
+        ## an empty hub is stopped and forgotten.
+        self.assertFalse(self.sensor in SensorHub._hubs)
+        self.assertFalse(hub is self.hub())
+
+    def test_follow(self):
+        hub = self.hub()
+        follow, periodic = [], []
+        hub.subscribe(follow.append, freq=10, follow=True, start=False)
+        hub.subscribe(periodic.append, freq=10, start=False)
+        hub.adapt(AdaptiveSampling(floor=1, ceiling=100))
+        self.assertTrue(hub.adaptive)
+        self.tick(hub, range(5))
+        ## the adaptive period governs; only the follower sees every
+        ## reading.
+        self.assertEqual(len(follow), 5)
+        self.assertEqual(len(periodic), 1)
+        hub.adapt(None)
+        self.assertEqual(hub.freq, 10)
+        self.tick(hub, range(20, 25))
+        self.assertEqual(len(follow), 6)
+
+    def test_errors(self):
+        hub = self.hub()
+        errors, got = [], []
+        def broken(evt):
+            raise ValueError("subscriber bug")
+        hub.subscribe(broken, freq=1, onError=errors.append, start=False)
+        hub.subscribe(got.append, freq=1, onError=errors.append, start=False)
+        self.tick(hub, [0])
+        ## one subscriber failing doesn't keep the reading from others.
+        self.assertEqual(len(got), 1)
+        self.assertEqual([str(e) for e in errors], ["subscriber bug"])
+        self.sensor.error = IOError("bus")
+        hub.fail(hub.due(1), self.sensor.error, 1)
+        self.assertEqual(len(errors), 3)
+
+    def test_threaded(self):
+        hub = self.hub()
+        a, b = [], []
+        hub.subscribe(a.append, freq=.05)
+        hub.subscribe(b.append, freq=.1)
+        self.assertTrue(hub.running())
+        self.assertTrue(waitFor(lambda: len(b) >= 5))
+        hub.stop()
+        self.assertEqual(hub.samples, self.sensor.reads)
+        self.assertTrue(len(a) > len(b))
+        self.assertTrue(self.sensor.reads < len(a) + len(b))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import time
+import unittest
+
+from thermodog import sim, ThermoDog
+from thermodog.leds import LedController
+
+from tests import ALERTER, simDog, resetSim, waitFor
+
+PIN = 29
+
+class LedControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.levels = []
+        self.leds = LedController(lambda pin, v: self.levels.append((pin, v)))
+
+    def tearDown(self):
+        self.leds.shutdown()
+
+    def step(self, now):
+        """Apply the steps due at `now`; long patterns keep the loop
+        thread from getting there first."""
+        with self.leds._cond:
+            return self.leds._step(now)
+
+    def test_pattern(self):
+        t0 = time.time()
+        self.leds.play(PIN, ((1, 100), (0, 200)), repeat=True)
+        self.assertTrue(self.leds.running(PIN))
+        self.assertEqual(self.levels, [(PIN, 1)])
+        self.assertTrue(99 < self.step(t0) <= 101)
+        self.step(t0 + 101)
+        self.step(t0 + 301)
+        self.step(t0 + 401)
+        self.assertEqual([v for p, v in self.levels], [1, 0, 1, 0])
+        self.assertTrue(self.leds.stop(PIN))
+        self.assertEqual(self.levels[-1], (PIN, 0))
+        self.assertEqual(self.step(t0 + 1000), None)
+        self.assertEqual(len(self.levels), 5)
+
+    def test_flash(self):
+        t0 = time.time()
+        self.leds.play(PIN, LedController.flashing(100))
+        self.step(t0 + 101)
+        ## the last step holds; the pattern is no longer timed.
+        self.assertEqual([v for p, v in self.levels], [1, 0])
+        self.assertFalse(self.leds.running(PIN))
+
+    def test_on_replaces_blink(self):
+        t0 = time.time()
+        self.leds.play(PIN, LedController.blinking(100, 100), repeat=True)
+        self.leds.play(PIN, LedController.ON)
+        self.assertFalse(self.leds.running(PIN))
+        ## the blink's next step is dropped when it comes due.
+        self.step(t0 + 101)
+        self.step(t0 + 201)
+        self.assertEqual([v for p, v in self.levels], [1, 1])
+        self.assertFalse(self.leds.stop(PIN))
+
+    def test_pins_independent(self):
+        t0 = time.time()
+        self.leds.play(PIN, LedController.blinking(100, 100), repeat=True)
+        self.leds.play(31, LedController.blinking(200, 200), repeat=True)
+        self.step(t0 + 101)
+        self.assertEqual(self.levels[2:], [(PIN, 0)])
+        self.step(t0 + 201)
+        self.assertEqual(self.levels[3:], [(PIN, 1), (31, 0)])
+
+    def test_loop(self):
+        self.leds.play(PIN, LedController.blinking(.01, .01), repeat=True)
+        self.assertTrue(waitFor(lambda: len(self.levels) >= 6))
+        self.leds.stop(PIN)
+
+    def test_after(self):
+        called = []
+        def broken():
+            raise ValueError("timer bug")
+        self.leds.after(.05, lambda: called.append("second"))
+        self.leds.after(.01, broken)
+        self.leds.after(.02, lambda: called.append("first"))
+        ## a timer may start a pattern; a failing one is logged.
+        self.leds.after(.03, lambda: self.leds.play(PIN, LedController.ON))
+        self.assertTrue(waitFor(lambda: len(called) == 2))
+        self.assertEqual(called, ["first", "second"])
+        self.assertEqual(self.levels, [(PIN, 1)])
+
+    def test_after_cancelled_by_shutdown(self):
+        called = []
+        self.leds.after(.05, lambda: called.append(1))
+        self.leds.shutdown()
+        time.sleep(.1)
+        self.assertEqual(called, [])
+
+class PowerAlertTest(unittest.TestCase):
+    def setUp(self):
+        self.dog = simDog()
+
+    def tearDown(self):
+        sim.GPIO.drive(ThermoDog.power, 1)
+        waitFor(lambda: not self.dog.powerLed.running)
+        ## let the blink's stale steps drain, or the loop may wake
+        ## during interpreter shutdown.
+        waitFor(lambda: not self.dog._leds._heap)
+        resetSim(self.dog)
+
+    def test_power_lost(self):
+        t0 = time.time()
+        sim.GPIO.drive(ThermoDog.power, 0)
+        ## the edge callback returns at once; the check is debounced.
+        self.assertTrue(time.time() - t0 < .1)
+        self.assertEqual(ALERTER.alerts, [])
+        self.assertTrue(waitFor(lambda: ALERTER.alerts))
+        self.assertTrue("Has lost power." in ALERTER.alerts[0][1])
+        self.assertTrue(self.dog.powerLed.running)
+        sim.GPIO.drive(ThermoDog.power, 1)
+        self.assertTrue(waitFor(lambda: not self.dog.powerLed.running))
+        self.assertEqual(len(ALERTER.alerts), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+import random
+import unittest
+
+import numpy
+
+from thermodog import max31855, sim
+from thermodog.max31855 import OC, SCG, SCV, encodeFrame, decodeFrames
+
+from tests import simDog, resetSim
+
+class DecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        temps = [-270.0, -200.25, -0.25, 0.0, 21.5, 1023.75, 1372.0]
+        internal = [-55.0, -0.0625, 0.0, 25.0, 85.5, 125.0, 24.9375]
+        tc, rj, faults = decodeFrames(
+            [encodeFrame(c, i) for c, i in zip(temps, internal)])
+        self.assertEqual(list(tc), temps)
+        self.assertEqual(list(rj), internal)
+        self.assertFalse(faults.any())
+        ## agrees with the frame at a time decoding.
+        for c, i in zip(temps, internal):
+            f = encodeFrame(c, i)
+            self.assertEqual(max31855.tcpart(f), c)
+            self.assertEqual(max31855.rjpart(f), i)
+
+    def test_faults(self):
+        for code in (OC, SCG, SCV):
+            f = encodeFrame(20.0, 25.0, code)
+            tc, rj, faults = decodeFrames([f])
+            self.assertEqual(faults[0], code)
+            self.assertTrue(numpy.isnan(tc[0]) and numpy.isnan(rj[0]))
+            self.assertEqual(max31855.faultCode(f), code)
+            self.assertEqual(max31855.fault(code, 2).channel, 2)
+        ## the first set bit wins, as in `faultCode`.
+        f = encodeFrame(20.0, 25.0, SCG | SCV)
+        self.assertEqual(decodeFrames([f])[2][0], SCG)
+        ## the summary bit alone.
+        f = encodeFrame(20.0) | max31855.FAULT
+        self.assertEqual(decodeFrames([f])[2][0], max31855.UNKNOWN)
+        self.assertTrue(isinstance(max31855.fault(max31855.UNKNOWN),
+                                   max31855.UnknownFault))
+
+    def test_mixed_batch(self):
+        frames = numpy.array([[encodeFrame(-10.5), encodeFrame(0, fault=OC)],
+                              [encodeFrame(0, fault=SCV), encodeFrame(99.75)]],
+                             dtype=numpy.uint32)
+        tc, rj, faults = decodeFrames(frames)
+        self.assertEqual(tc.shape, (2, 2))
+        self.assertEqual(faults.tolist(), [[0, OC], [SCV, 0]])
+        self.assertEqual(tc[0, 0], -10.5)
+        self.assertEqual(tc[1, 1], 99.75)
+        self.assertTrue(numpy.isnan(tc[0, 1]) and numpy.isnan(tc[1, 0]))
+        self.assertEqual(numpy.nanmean(rj), 25.0)
+
+class AvgTest(unittest.TestCase):
+    def setUp(self):
+        self.dog = simDog()
+        random.seed(0)
+
+    def tearDown(self):
+        resetSim(self.dog)
+
+    def test_any_fault_raises(self):
+        sim.chips[0].script(celsius=[21.0, 21.0, 21.0])
+        self.assertEqual(self.dog.avg(1, nSamples=3, sampleRate=0)[0], 21.0)
+        sim.chips[0].inject(OC, rate=.5)
+        with self.assertRaises(max31855.OpenCircuit) as cm:
+            for i in range(20):
+                self.dog.avg(1, nSamples=4, sampleRate=0)
+        self.assertEqual(cm.exception.channel, 1)
+
+    def test_partial(self):
+        sim.chips[0].script(celsius=22.0)
+        sim.chips[0].inject(SCG, rate=.5)
+        for i in range(10):
+            try:
+                self.assertEqual(self.dog.avg(1, nSamples=4, sampleRate=0,
+                                              partial=True)[0], 22.0)
+            except max31855.ShortToGround:
+                ## every frame faulted.
+                pass
+        sim.chips[0].inject(SCG)
+        with self.assertRaises(max31855.ShortToGround):
+            self.dog.avg(1, nSamples=4, sampleRate=0, partial=True)
+
+class ScanTest(unittest.TestCase):
+    def setUp(self):
+        self.dog = simDog()
+
+    def tearDown(self):
+        resetSim(self.dog)
+
+    def test_scan(self):
+        sim.chips[0].script(celsius=[20.0, 21.0, 22.0])
+        sim.chips[1].script(celsius=-5.5, internal=24.0)
+        tc, rj, faults = self.dog.scan(nSamples=3, sampleRate=0)
+        self.assertEqual(tc.shape, (2, 3))
+        self.assertEqual(tc.tolist(), [[20.0, 21.0, 22.0], [-5.5]*3])
+        self.assertEqual(rj.tolist(), [[25.0]*3, [24.0]*3])
+        self.assertFalse(faults.any())
+
+    def test_calibrations(self):
+        self.dog.sensor(2, calibration=(1, 2))
+        tc, rj, faults = self.dog.scan([2, 1], nSamples=1, sampleRate=0,
+                                       calibrations={1: (0, .5)})
+        self.assertEqual(tc.tolist(), [[41.0], [10.0]])
+        ## a registered sensor's calibration is the default.
+        tc, rj, faults = self.dog.scan(nSamples=1, sampleRate=0)
+        self.assertEqual(tc.tolist(), [[20.0], [41.0]])
+
+    def test_faulted_channel(self):
+        sim.chips[0].inject(SCV)
+        sim.chips[1].script(celsius=30.0)
+        tc, rj, faults = self.dog.scan(nSamples=2, sampleRate=0)
+        self.assertEqual(faults.tolist(), [[SCV, SCV], [0, 0]])
+        self.assertTrue(numpy.isnan(tc[0]).all())
+        res = self.dog.measureAll(nSamples=2, sampleRate=0)
+        ## one faulted channel doesn't keep the others from a reading.
+        self.assertTrue(isinstance(res[1], max31855.ShortToVcc))
+        self.assertEqual(res[1].channel, 1)
+        self.assertEqual(res[2]["celsius"], 30.0)
+        self.assertEqual(res[2]["channel"], 2)
+        self.assertEqual(res[2]["internal"], 25.0)
+
+    def test_measure_all_partial(self):
+        sim.chips[0].script(celsius=19.0)
+        sim.chips[0].inject(OC, rate=.5)
+        random.seed(1)
+        seen = set()
+        for i in range(10):
+            res = self.dog.measureAll([1], nSamples=4, sampleRate=0,
+                                      partial=True)
+            if isinstance(res[1], max31855.OpenCircuit):
+                seen.add("fault")
+            else:
+                self.assertEqual(res[1]["celsius"], 19.0)
+                seen.add("reading")
+        self.assertTrue("reading" in seen)
+        res = self.dog.measureAll([1], nSamples=20, sampleRate=0)
+        self.assertTrue(isinstance(res[1], max31855.OpenCircuit))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+
+try:
+    from urllib2 import urlopen, Request
+except ImportError:
+    from urllib.request import urlopen, Request
+
+from thermodog import metrics
+from thermodog.metrics import MetricsRegistry, MetricsServer, Counter, Gauge
+from thermodog.coms import RateLimiter
+
+class ExpositionTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def lines(self, openMetrics=True):
+        return self.registry.exposition(openMetrics).splitlines()
+
+    def test_counter(self):
+        c = self.registry.counter("dog_frames_total", "Frames read.",
+                                  ["channel"])
+        c.labels(2).inc()
+        c.labels(1).inc(3)
+        self.assertEqual(self.lines(), [
+            "# HELP dog_frames Frames read.",
+            "# TYPE dog_frames counter",
+            'dog_frames_total{channel="1"} 3',
+            'dog_frames_total{channel="2"} 1',
+            "# EOF"])
+        ## the Prometheus text format names the family with _total and
+        ## has no terminator.
+        self.assertEqual(self.lines(False)[:2], [
+            "# HELP dog_frames_total Frames read.",
+            "# TYPE dog_frames_total counter"])
+        self.assertNotEqual(self.lines(False)[-1], "# EOF")
+
+    def test_escaping(self):
+        g = self.registry.gauge("dog_reading", "Reading.", ["sensor"])
+        g.labels('walk-in "B"\\\nnorth').set(float("nan"))
+        self.assertEqual(self.lines()[2],
+                         'dog_reading{sensor="walk-in \\"B\\"\\\\\\nnorth"} NaN')
+        g.labels("a").set(float("-inf"))
+        self.assertEqual(self.lines()[2], 'dog_reading{sensor="a"} -Inf')
+
+    def test_histogram(self):
+        h = self.registry.histogram("dog_read_seconds", "Read time.",
+                                    ["sensor"], buckets=(.1, 1))
+        for v in (.05, .1, .5, 2):
+            h.labels("x").observe(v)
+        self.assertEqual(self.lines()[2:-1], [
+            'dog_read_seconds_bucket{sensor="x",le="0.1"} 2',
+            'dog_read_seconds_bucket{sensor="x",le="1.0"} 3',
+            'dog_read_seconds_bucket{sensor="x",le="+Inf"} 4',
+            'dog_read_seconds_count{sensor="x"} 4',
+            'dog_read_seconds_sum{sensor="x"} 2.65'])
+
+    def test_callbacks(self):
+        n = [0]
+        self.registry.register(Counter("dog_sent", "Sent.", fx=lambda: n[0]))
+        self.registry.register(Gauge("dog_threads", "Threads.",
+                                     fx=lambda: 1/0))
+        n[0] = 5
+        ## a failing metric is left out, not the scrape.
+        self.assertEqual(self.lines(), [
+            "# HELP dog_sent Sent.",
+            "# TYPE dog_sent counter",
+            "dog_sent_total 5",
+            "# EOF"])
+
+    def test_watch_limiter(self):
+        l = RateLimiter(perHour=1)
+        for i in range(3):
+            if l.allows("sms:1"):
+                l.record("sms:1")
+            else:
+                l.suppress("sms:1")
+        c = metrics.watchLimiter(l)
+        try:
+            text = metrics.registry.exposition()
+            self.assertTrue("# TYPE thermodog_sms_suppressed counter\n" in text)
+            self.assertTrue("\nthermodog_sms_suppressed_total 2\n" in text)
+        finally:
+            metrics.registry._metrics.remove(c)
+
+    def test_server(self):
+        self.registry.counter("dog_up", "Up.").labels().inc()
+        s = MetricsServer(0, "127.0.0.1", registry=self.registry)
+        try:
+            url = "http://127.0.0.1:{}/metrics".format(s.port)
+            r = urlopen(Request(url, headers={
+                "Accept": "application/openmetrics-text"}))
+            self.assertTrue(r.info()["Content-Type"].startswith(
+                "application/openmetrics-text"))
+            self.assertTrue(r.read().decode("utf-8").endswith("# EOF\n"))
+            r = urlopen(url)
+            self.assertTrue(r.info()["Content-Type"].startswith("text/plain"))
+            self.assertTrue(b"dog_up_total 1" in r.read())
+        finally:
+            s.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,288 @@
+import random
+import logging
+import unittest
+import warnings
+
+from thermodog import max31855, sim
+from thermodog.monitor import AdaptiveSampling, BoardScanner, CircuitBreaker, \
+    SensorHub, SensorMonitor
+
+from tests import ALERTER, simDog, resetSim, waitFor
+
+class CircuitBreakerTest(unittest.TestCase):
+    def breaker(self, **args):
+        args.setdefault("jitter", 0)
+        return CircuitBreaker(threshold=3, base=2.0, maxDelay=30, **args)
+
+    def open(self, b, now=0):
+        """Fail `b` to open, its last failure at `now`."""
+        self.assertFalse(b.failure(now - 4))
+        self.assertFalse(b.failure(now - 2))
+        self.assertTrue(b.failure(now))
+
+    def test_opens_at_threshold(self):
+        b = self.breaker()
+        self.assertFalse(b.failure(0))
+        self.assertEqual(b.state, CircuitBreaker.CLOSED)
+        ## a failed reading is retried after `base`, not `freq`.
+        self.assertEqual(b.retryAt, 2.0)
+        self.assertEqual(b.period(60, 0), 2.0)
+        self.assertTrue(b.allow(1))
+        self.assertFalse(b.failure(2))
+        self.assertTrue(b.failure(4))
+        self.assertEqual(b.state, CircuitBreaker.OPEN)
+        self.assertEqual(b.failures, 3)
+        self.assertEqual(b.retryAt, 6.0)
+        self.assertEqual(b.period(60, 4), 2.0)
+
+    def test_half_open_after_retry_at(self):
+        b = self.breaker()
+        self.open(b, 4)
+        self.assertFalse(b.allow(5.9))
+        self.assertEqual(b.state, CircuitBreaker.OPEN)
+        self.assertTrue(b.allow(6))
+        self.assertEqual(b.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(b.probing())
+
+    def test_half_open_failure_backs_off(self):
+        b = self.breaker()
+        self.open(b, 4)
+        now, delays = 4, []
+        for i in range(6):
+            at = b.retryAt
+            delays.append(at - now)
+            now = at
+            self.assertTrue(b.allow(now))
+            ## reopening is not reported again.
+            self.assertFalse(b.failure(now))
+            self.assertEqual(b.state, CircuitBreaker.OPEN)
+        self.assertEqual(delays, [2, 4, 8, 16, 30, 30])
+        self.assertEqual(b.failures, 9)
+
+    def test_jitter_bounds(self):
+        random.seed(1)
+        for i in range(50):
+            b = self.breaker(jitter=.5)
+            self.open(b, 0)
+            self.assertTrue(1.0 <= b.retryAt <= 2.0)
+            for j in range(6):
+                now = b.retryAt
+                b.allow(now)
+                b.failure(now)
+            self.assertTrue(15 <= b.retryAt - now <= 30)
+
+    def test_success_closes(self):
+        b = self.breaker()
+        self.open(b, 4)
+        b.allow(6)
+        self.assertEqual(b.success(), 3)
+        self.assertTrue(b.closed())
+        self.assertEqual(b.failures, 0)
+        self.assertEqual(b.period(60, 6), 60)
+        ## the backoff starts over.
+        self.open(b, 10)
+        self.assertEqual(b.retryAt, 12.0)
+
+    def test_period(self):
+        b = self.breaker()
+        self.assertEqual(b.period(60, 0), 60)
+        b.failure(0)
+        self.assertEqual(b.period(60, 1.5), .5)
+        ## never a busy loop, never beyond `freq`.
+        self.assertEqual(b.period(60, 5), .1)
+        self.assertEqual(b.period(1, 0), 1)
+
+class AdaptiveSamplingTest(unittest.TestCase):
+    BOUNDS = [(0, 40)]
+
+    def steady(self, policy, celsius=20.0, now=0, n=20):
+        """Feed `n` readings of `celsius`, one per period; returns the
+        periods and the time after the last."""
+        periods = []
+        for i in range(n):
+            periods.append(policy.observe(celsius, now, self.BOUNDS))
+            now += periods[-1]
+        return periods, now
+
+    def test_steady_grows_to_ceiling(self):
+        p = AdaptiveSampling(floor=5, ceiling=300, growth=1.5)
+        self.assertEqual(p.period, 5)
+        periods, now = self.steady(p)
+        self.assertEqual(periods[-1], 300)
+        last = 5.0
+        for x in periods:
+            self.assertTrue(last <= x <= last*1.5 + 1e-9)
+            last = x
+        self.assertEqual(p.slope, 0)
+
+    def test_near_bound_drops_at_once(self):
+        p = AdaptiveSampling(floor=5, ceiling=300, margin=3.0)
+        periods, now = self.steady(p)
+        self.assertTrue(p.observe(38.5, now, self.BOUNDS) < 20)
+        ## and grows back by at most `growth` per reading.
+        q = p.period
+        periods, now = self.steady(p, now=now, n=3)
+        self.assertTrue(periods[0] <= q*1.5 + 1e-9)
+
+    def test_margin_interpolates(self):
+        p = AdaptiveSampling(floor=5, ceiling=300, margin=3.0,
+                             smoothing=0)
+        self.steady(p)
+        self.assertAlmostEqual(p.observe(38.5, 1e6, self.BOUNDS),
+                               5 + 295*1.5/3)
+
+    def test_crossing_bound(self):
+        p = AdaptiveSampling(floor=5, ceiling=300)
+        periods, now = self.steady(p)
+        self.assertEqual(p.observe(41, now, self.BOUNDS), 5)
+        self.assertEqual(p.observe(-1, now + 5, self.BOUNDS), 5)
+
+    def test_slope_shortens(self):
+        p = AdaptiveSampling(floor=5, ceiling=300, horizon=10)
+        periods, now = self.steady(p)
+        ## 1C/min towards a bound 20C away: 20 minutes to go.
+        c = 20.0
+        for i in range(30):
+            now += 5
+            c += 5/60.0
+            period = p.observe(c, now, self.BOUNDS)
+        self.assertTrue(period < 300)
+        self.assertTrue(period <= (40 - c)/p.slope/10 + 1e-9)
+
+    def test_nan_passes_through(self):
+        p = AdaptiveSampling(floor=5, ceiling=300)
+        periods, now = self.steady(p, n=3)
+        q = p.period
+        self.assertEqual(p.observe(float("nan"), now, self.BOUNDS), q)
+        self.assertEqual(p.observe(None, now, self.BOUNDS), q)
+        self.assertEqual(p.slope, 0)
+        self.assertEqual(p.observe(20.0, now, self.BOUNDS), q*1.5)
+
+class HubFaultTest(unittest.TestCase):
+    def setUp(self):
+        self.dog = simDog()
+
+    def tearDown(self):
+        resetSim(self.dog)
+
+    def test_fault_clears(self):
+        good, bad = [], []
+        fails = []
+        hubs = []
+        sim.chips[0].inject()
+        for n, out in ((1, bad), (2, good)):
+            s = self.dog.sensor(n, nSamples=2, sampleRate=0)
+            h = SensorHub.forSensor(s).protect(
+                CircuitBreaker(threshold=2, base=.1, maxDelay=.2, jitter=0))
+            h.subscribe(out.append, freq=.2, onError=fails.append)
+            hubs.append(h)
+        self.assertTrue(waitFor(
+            lambda: hubs[0].breaker.state != CircuitBreaker.CLOSED))
+        ## the other sensor keeps its period.
+        n = len(good)
+        self.assertTrue(waitFor(lambda: len(good) >= n + 3, 2))
+        self.assertFalse(bad)
+        self.assertTrue(fails)
+        sim.chips[0].clear()
+        self.assertTrue(waitFor(lambda: bad))
+        self.assertTrue(hubs[0].breaker.closed())
+        self.assertAlmostEqual(bad[-1]["celsius"], 20.0, 1)
+        self.assertTrue(any("recovered" in m for k, m in ALERTER.alerts))
+
+class BoardScannerTest(unittest.TestCase):
+    def setUp(self):
+        self.dog = simDog()
+
+    def tearDown(self):
+        resetSim(self.dog)
+
+    def test_one_scan_per_tick(self):
+        scanner = BoardScanner(self.dog)
+        got = dict((n, []) for n in (1, 2))
+        hubs = []
+        for n in got:
+            s = self.dog.sensor(n, nSamples=2, sampleRate=0)
+            h = SensorHub.forSensor(s)
+            hubs.append(h)
+            self.assertTrue(h.driver is scanner)
+        hubs[0].subscribe(got[1].append, freq=.1)
+        hubs[1].subscribe(got[2].append, freq=.2)
+        self.assertTrue(scanner.running())
+        self.assertEqual(scanner.freq, .1)
+        self.assertTrue(waitFor(lambda: len(got[2]) >= 3))
+        scanner.stop()
+        ## every reading came from a shared scan.
+        self.assertEqual(scanner.scans, len(got[1]))
+        self.assertTrue(len(got[2]) < len(got[1]))
+        self.assertEqual(got[1][-1]["channel"], 1)
+        self.assertEqual(got[2][-1]["celsius"], 20.0)
+
+    def test_faulted_channel(self):
+        scanner = BoardScanner(self.dog, freq=.1)
+        sim.chips[0].inject()
+        good, fails = [], []
+        for n, out in ((1, []), (2, good)):
+            s = self.dog.sensor(n, nSamples=2, sampleRate=0)
+            SensorHub.forSensor(s).subscribe(out.append, freq=.1,
+                                             onError=fails.append)
+        self.assertTrue(waitFor(lambda: len(good) >= 3))
+        self.assertTrue(fails)
+        self.assertTrue(all(isinstance(e, max31855.OpenCircuit)
+                            for e in fails))
+        scanner.stop()
+
+    def test_stop_deregisters(self):
+        scanner = BoardScanner(self.dog)
+        s = self.dog.sensor(1, nSamples=2, sampleRate=0)
+        h = SensorHub.forSensor(s)
+        scanner.stop()
+        self.assertFalse(scanner in SensorHub._drivers)
+        self.assertTrue(h.driver is None)
+        ## the hub acquires on its own.
+        got = []
+        h.subscribe(got.append, freq=.1)
+        self.assertTrue(waitFor(lambda: got))
+        self.assertFalse(scanner.running())
+
+class Levels(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.levels = []
+
+    def emit(self, record):
+        if "unexpected exception" in record.getMessage():
+            self.levels.append(record.levelno)
+
+class SensorMonitorTest(unittest.TestCase):
+    def setUp(self):
+        self.dog = simDog()
+        self.handler = Levels()
+        logging.getLogger("thermodog").addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger("thermodog").removeHandler(self.handler)
+        resetSim(self.dog)
+
+    def test_quiet_after(self):
+        sim.chips[0].inject()
+        s = self.dog.sensor(1, nSamples=1, sampleRate=0)
+        SensorHub.forSensor(s).protect(
+            CircuitBreaker(threshold=10, base=.05, jitter=0))
+        m = SensorMonitor(s, doMonitor=lambda evt: None, freq=.05,
+                          quietAfter=2)
+        self.assertTrue(waitFor(lambda: len(self.handler.levels) >= 4))
+        m.stop()
+        self.assertEqual(self.handler.levels[:4],
+                         [logging.ERROR]*2 + [logging.WARNING]*2)
+
+    def test_restarts_deprecated(self):
+        s = self.dog.sensor(1, nSamples=1, sampleRate=0)
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            m = SensorMonitor(s, doMonitor=lambda evt: None, restarts=4)
+        m.stop()
+        self.assertTrue(any(issubclass(x.category, DeprecationWarning)
+                            for x in w))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from threading import Thread, Event
+
+from thermodog import profiling
+from thermodog.profiling import SpanHistogram, StackSampler
+
+from tests import waitFor
+
+class SpanHistogramTest(unittest.TestCase):
+    def test_quantiles(self):
+        h = SpanHistogram()
+        self.assertTrue(h.quantile(.5) != h.quantile(.5))
+        for i in range(1, 101):
+            h.add(i / 1000.0)
+        self.assertEqual(h.count, 100)
+        self.assertAlmostEqual(h.mean, .0505)
+        self.assertEqual(h.max, .1)
+        ## within one bucket, an eighth of a decade.
+        for p, v in ((.5, .05), (.99, .099)):
+            self.assertTrue(v <= h.quantile(p) <= v * 10 ** (1 / 8.0))
+        self.assertEqual(h.quantile(1), .1)
+
+    def test_out_of_range(self):
+        h = SpanHistogram(lo=1e-3, hi=1)
+        h.add(0)
+        h.add(50)
+        self.assertEqual(h.quantile(.5), 1e-3)
+        self.assertEqual(h.quantile(1), 50)
+
+class SpanTest(unittest.TestCase):
+    def setUp(self):
+        profiling.reset()
+        profiling.enable()
+
+    def tearDown(self):
+        profiling.disable()
+        profiling.reset()
+
+    def test_span(self):
+        for i in range(3):
+            with profiling.span("test.span"):
+                time.sleep(.01)
+        h = profiling.histogram("test.span")
+        self.assertEqual(h.count, 3)
+        self.assertTrue(h.total >= .03)
+
+    def test_span_raising(self):
+        try:
+            with profiling.span("test.raise"):
+                raise ValueError("bus")
+        except ValueError:
+            pass
+        self.assertEqual(profiling.histogram("test.raise").count, 1)
+
+    def test_timed(self):
+        @profiling.timed("test.timed")
+        def square(x):
+            """Squares."""
+            if x < 0:
+                raise ValueError(x)
+            return x*x
+        self.assertEqual(square(3), 9)
+        self.assertRaises(ValueError, square, -1)
+        self.assertEqual(square.__name__, "square")
+        self.assertEqual(profiling.histogram("test.timed").count, 2)
+
+    def test_disabled(self):
+        profiling.disable()
+        with profiling.span("test.off"):
+            pass
+        profiling.timed("test.off")(lambda: None)()
+        profiling.observeAws("sts", "GetCallerIdentity", .1, True)
+        self.assertEqual(profiling.summary()[1:], [])
+
+    def test_summary(self):
+        profiling.observe("test.b", .002)
+        profiling.observe("test.b", .004)
+        profiling.observeAws("sns", "Publish", .1, False)
+        lines = profiling.summary()
+        self.assertEqual(lines[0].split(),
+                         ["span", "calls", "mean", "p50", "p99", "max",
+                          "total"])
+        self.assertEqual([l.split()[0] for l in lines[1:]],
+                         ["aws.sns.Publish", "test.b"])
+        b = lines[2].split()
+        self.assertEqual(b[1], "2")
+        self.assertEqual((b[2], b[5], b[6]), ("3.000", "4.000", "6.0"))
+
+    def test_dump(self):
+        d = tempfile.mkdtemp()
+        try:
+            path = os.path.join(d, "profile")
+            profiling.observe("test.dump", .001)
+            profiling.dump(path)
+            with open(path) as f:
+                text = f.read()
+            self.assertTrue("(enabled)" in text)
+            self.assertTrue("\ntest.dump " in text)
+        finally:
+            shutil.rmtree(d)
+
+class StackSamplerTest(unittest.TestCase):
+    def test_start_stop(self):
+        stop = Event()
+        def busyLoop():
+            stop.wait(5)
+        t = Thread(target=busyLoop, name="busy")
+        t.start()
+        s = StackSampler(interval=.005)
+        try:
+            s.start()
+            s.start()
+            self.assertTrue(waitFor(lambda: s.samples >= 5))
+        finally:
+            s.stop()
+            stop.set()
+            t.join()
+        n = s.samples
+        time.sleep(.02)
+        self.assertEqual(s.samples, n)
+        folded = s.folded()
+        busy = [l for l in folded if l.startswith("busy;")]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(" ", 1)
+        self.assertTrue("busyLoop (test_profiling.py:" in stack)
+        self.assertTrue(0 < int(count) <= n)
+        ## the sampling thread leaves itself out.
+        self.assertFalse([l for l in folded if l.startswith("stack-sampler;")])
+        s.reset()
+        self.assertEqual((s.samples, s.folded()), (0, []))
+
+    def test_max_stacks(self):
+        stop = Event()
+        t = Thread(target=stop.wait, args=(5,))
+        t.start()
+        try:
+            s = StackSampler(maxStacks=0)
+            s.sample()
+        finally:
+            stop.set()
+            t.join()
+        self.assertEqual(s.samples, 1)
+        self.assertEqual(s.folded(), [])
+        self.assertTrue(s._dropped > 0)
+
+if __name__ == "__main__":
+    unittest.main()
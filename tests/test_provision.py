@@ -0,0 +1,157 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from thermodog import aws
+from thermodog.provision import Provisioner, AwsState
+
+from tests import waitFor
+
+class StubClient(object):
+    """Records calls; the first `failures` calls raise."""
+    def __init__(self, failures=0):
+        self.calls    = []
+        self.failures = failures
+
+    def _call(self, name, args, result=None):
+        self.calls.append((name, args))
+        if self.failures:
+            self.failures -= 1
+            raise IOError("throttled")
+        return result
+
+    def put_metric_alarm(self, **args):
+        return self._call("put_metric_alarm", args)
+
+    def subscribe(self, **args):
+        return self._call("subscribe", args)
+
+    def get_caller_identity(self):
+        return self._call("get_caller_identity", {}, {"Account": "123456789012"})
+
+    def create_topic(self, Name):
+        return self._call("create_topic", {"Name": Name},
+                          {"TopicArn": "arn:aws:sns:us-west-2:1:" + Name})
+
+class StubMetric(object):
+    def __init__(self, client):
+        self.client = client
+
+    def alarmDict(self, alarmName, threshold=30):
+        return {"AlarmName": alarmName, "Threshold": threshold}
+
+class StubTopic(object):
+    topicName = "alerts"
+    pubArn    = "arn:aws:sns:us-west-2:1:alerts"
+
+    def __init__(self, client):
+        self.client = client
+
+class ProvisionerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "aws-state.json")
+        self.client = StubClient()
+        self.saved = aws.registry._clients
+        aws.registry._clients = {("sts", None): self.client,
+                                 ("sns", None): self.client}
+        self.provisioners = []
+
+    def tearDown(self):
+        for p in self.provisioners:
+            p.stop()
+        aws.registry._clients = self.saved
+        shutil.rmtree(self.dir)
+
+    def provisioner(self, **args):
+        args.setdefault("start", False)
+        p = Provisioner(AwsState(self.path), **args)
+        self.provisioners.append(p)
+        return p
+
+    def names(self):
+        return [n for n, a in self.client.calls]
+
+    def test_alarm_applied_once(self):
+        p = self.provisioner()
+        m = StubMetric(self.client)
+        self.assertTrue(p.ensureAlarm(m, "fridge Status"))
+        self.assertFalse(p.ensureAlarm(m, "fridge Status"))
+        self.assertEqual(self.names(), ["put_metric_alarm"])
+        self.assertEqual(p.stats()["skipped"], 1)
+        ## a restart remembers what was applied.
+        q = self.provisioner()
+        self.assertFalse(q.ensureAlarm(m, "fridge Status"))
+        ## a changed definition is applied.
+        self.assertTrue(q.ensureAlarm(m, "fridge Status", threshold=8))
+        self.assertEqual(self.names(), ["put_metric_alarm"]*2)
+        self.assertEqual(self.client.calls[-1][1]["Threshold"], 8)
+
+    def test_ttl(self):
+        p = self.provisioner(ttl=0)
+        m = StubMetric(self.client)
+        p.ensureAlarm(m, "fridge Status")
+        p.ensureAlarm(m, "fridge Status")
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_subscription_once(self):
+        p = self.provisioner()
+        t = StubTopic(self.client)
+        p.ensureSubscription(t, "sms", "+15550100")
+        p.ensureSubscription(t, "sms", "+15550100")
+        p.ensureSubscription(t, "email", "ops@example.com")
+        self.assertEqual(self.names(), ["subscribe"]*2)
+
+    def test_failed_job_backs_off(self):
+        p = self.provisioner(maxDelay=30)
+        self.client.failures = 4
+        m = StubMetric(self.client)
+        p.submit(p.ensureAlarm, m, "fridge Status")
+        p.drain()
+        delays = []
+        while p._waiting:
+            (at, job), = p._waiting
+            delays.append(round(at - time.time()))
+            p._waiting = []
+            p.runJob(job)
+        self.assertEqual(delays, [5, 10, 20, 30])
+        self.assertEqual(p.stats()["failed"], 4)
+        self.assertEqual(p.stats()["applied"], 1)
+        self.assertEqual(p.stats()["pending"], 0)
+        ## the failures were not recorded as applied.
+        self.assertFalse(p.ensureAlarm(m, "fridge Status"))
+        self.assertEqual(len(self.client.calls), 5)
+
+    def test_retried_in_background(self):
+        p = self.provisioner(maxDelay=.05, start=True)
+        self.client.failures = 2
+        p.submit(p.ensureAlarm, StubMetric(self.client), "fridge Status")
+        self.assertTrue(waitFor(lambda: p.stats()["applied"] == 1))
+        self.assertEqual(p.stats()["failed"], 2)
+
+    def test_account_and_topic_cached(self):
+        p = self.provisioner()
+        self.assertEqual(p.accountId(), "123456789012")
+        self.assertEqual(p.accountId(), "123456789012")
+        self.assertEqual(p.topicArn("alerts"), StubTopic.pubArn)
+        self.assertEqual(p.topicArn("alerts"), StubTopic.pubArn)
+        self.assertEqual(p.topicActions(["thermodog"]),
+                         ["arn:aws:sns:us-west-2:123456789012:thermodog"])
+        self.assertEqual(self.names(), ["get_caller_identity", "create_topic"])
+        q = self.provisioner()
+        q.accountId()
+        q.topicArn("alerts")
+        self.assertEqual(len(self.client.calls), 2)
+
+    def test_unreadable_state(self):
+        with open(self.path, "w") as f:
+            f.write("{")
+        s = AwsState(self.path)
+        self.assertEqual(s.get("topics"), {})
+        s.set("topics", "arn", "alerts")
+        self.assertEqual(AwsState(self.path).get("topics", "alerts"), "arn")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from thermodog.query import _parseFixed, _parseTsv, TsvIndex, LogQuery, \
+    downsample, parseTime
+from thermodog.binlog import BinaryLog
+from thermodog.common import pstIso
+from thermodog.cloudwatch import epochToUtc
+
+## two hours either side of the 2020 spring-forward, 10:00 UTC.
+T0 = 1583661600.0 - 2*60*60
+
+def line(name, t, celsius):
+    return "{:<10}\t{}\t{:>8.2f}C\n".format(name, pstIso(epochToUtc(t)),
+                                           celsius)
+
+def tsv(path, ts, celsius, name="fridge", mode="w"):
+    with open(path, mode) as f:
+        for t, c in zip(ts, celsius):
+            f.write(line(name, t, c))
+
+class ParseTest(unittest.TestCase):
+    def test_fixed_across_dst(self):
+        ts = T0 + 60*numpy.arange(240)
+        celsius = numpy.round(numpy.linspace(-20, 40, 240), 2)
+        data = "".join(line("fridge", t, c) for t, c in zip(ts, celsius))
+        self.assertTrue("-08:00" in data and "-07:00" in data)
+        t, c = _parseFixed(data.encode("utf-8"))
+        self.assertEqual(list(t), list(ts))
+        self.assertTrue(numpy.allclose(c, celsius))
+
+    def test_variable_width(self):
+        data = line("fridge", T0, 1.5) + line("fridge", T0 + .5, -2.25) + \
+            line("walk-in-freezer", T0 + 3*60*60, 100.0)
+        data = data.encode("utf-8")
+        self.assertEqual(_parseFixed(data), None)
+        t, c = _parseTsv(data)
+        ## fractions of a second are dropped.
+        self.assertEqual(list(t), [T0, T0, T0 + 3*60*60])
+        self.assertEqual(list(c), [1.5, -2.25, 100.0])
+        self.assertEqual(len(_parseTsv(b"")[0]), 0)
+
+    def test_parse_time(self):
+        now = T0 + 10
+        self.assertEqual(parseTime("now", now), now)
+        self.assertEqual(parseTime("90m", now), now - 90*60)
+        ## Pacific, unless zoned; 3am is the first hour of PDT.
+        self.assertEqual(parseTime("2020-03-08T01:00:00", now), T0 + 60*60)
+        self.assertEqual(parseTime("2020-03-08T03:00:00", now), T0 + 2*60*60)
+        self.assertEqual(parseTime("2020-03-08T00:00:00Z", now), T0 - 8*60*60)
+
+class TsvIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "fridge.tsv")
+        self.ts = T0 + 30*numpy.arange(500)
+        self.celsius = numpy.round(20 + numpy.sin(numpy.arange(500)/10.0), 2)
+        tsv(self.path, self.ts, self.celsius)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def expect(self, start, end):
+        keep = (self.ts >= start) & (self.ts <= end)
+        return list(self.ts[keep])
+
+    def test_seek(self):
+        idx = TsvIndex(self.path, stride=1000)
+        t, c = idx.read()
+        self.assertEqual(list(t), list(self.ts))
+        self.assertTrue(len(idx._offsets) > 10)
+        ## ranges starting and ending on, and either side of, the
+        ## indexed lines.
+        edges = []
+        for x in idx._times[1:4] + idx._times[-2:]:
+            edges.extend([x - 1, x, x + 1])
+        for start in edges + [T0 - 60, T0]:
+            for end in edges + [self.ts[-1], self.ts[-1] + 60]:
+                if end < start:
+                    continue
+                t, c = idx.read(start, end)
+                self.assertEqual(list(t), self.expect(start, end),
+                                 "{} to {}".format(start, end))
+        self.assertEqual(len(idx.read(self.ts[-1] + 1)[0]), 0)
+
+    def test_grows(self):
+        idx = TsvIndex(self.path, stride=1000)
+        n = len(idx.read()[0])
+        more = self.ts[-1] + 30*numpy.arange(1, 101)
+        tsv(self.path, more, numpy.zeros(100), mode="a")
+        t, c = idx.read(more[50])
+        self.assertEqual(list(t), list(more[50:]))
+        self.assertEqual(len(idx.read()[0]), n + 100)
+        ## replaced by a shorter file.
+        tsv(self.path, self.ts[:10], self.celsius[:10])
+        self.assertEqual(list(idx.read()[0]), list(self.ts[:10]))
+
+class DownsampleTest(unittest.TestCase):
+    def test_buckets(self):
+        ts = numpy.array([0, 10, 59, 60, 61, 300, 301], dtype=float) + 6000
+        v = numpy.array([1, 2, 3, 10, numpy.nan, -1, 5], dtype=float)
+        b = downsample(ts, v, 60)
+        self.assertEqual(list(b["start"]), [6000, 6060, 6300])
+        self.assertEqual(list(b["count"]), [3, 1, 2])
+        self.assertEqual(list(b["min"]), [1, 10, -1])
+        self.assertEqual(list(b["max"]), [3, 10, 5])
+        self.assertEqual(list(b["mean"]), [2, 10, 2])
+        self.assertEqual(len(downsample(ts[:0], v[:0], 60)), 0)
+
+class LogQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_merge(self):
+        b = BinaryLog(os.path.join(self.dir, "binlog"), "fridge",
+                      blockRecords=10)
+        for i in range(0, 40, 2):
+            b.write({"timestamp": epochToUtc(T0 + 60*i), "celsius": i})
+        b.close()
+        ts = T0 + 60*numpy.arange(1, 40, 2)
+        tsv(os.path.join(self.dir, "fridge.tsv"), ts, numpy.arange(1, 40, 2))
+        q = LogQuery(self.dir)
+        self.assertEqual(q.sensors(), ["fridge"])
+        t, c = q.read("fridge", T0 + 60*5, T0 + 60*14)
+        self.assertEqual(list(c), list(range(5, 15)))
+        self.assertEqual(list(t), list(T0 + 60*numpy.arange(5, 15)))
+        ## closed segments' spans are kept.
+        self.assertTrue(os.path.exists(
+            os.path.join(self.dir, "binlog", LogQuery.INDEX)))
+        self.assertEqual(len(LogQuery(self.dir).read("fridge")[0]), 40)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import pty
+import time
+import unittest
+
+import numpy
+
+from thermodog.serialdog import SerialDog, SerialBus, mqPpm
+from thermodog.framing import FrameDecoder, encodeFrames
+
+class SerialTest(unittest.TestCase):
+    """Drive the serial backend through a pty standing in for the
+    Arduino."""
+    def setUp(self):
+        self.master, slave = pty.openpty()
+        self.path = os.ttyname(slave)
+        self.slave = slave
+        self.dog = SerialDog(name="gasdog")
+
+    def tearDown(self):
+        self.dog.shutdown()
+        for fd in (self.master, self.slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def connect(self, bus):
+        ## opening the port discards what was written before.
+        self.assertTrue(self.waitFor(bus.connected))
+
+    def send(self, data):
+        os.write(self.master, data)
+
+    def waitFor(self, fx, timeout=5):
+        deadline = time.time() + timeout
+        while not fx() and time.time() < deadline:
+            time.sleep(.02)
+        return fx()
+
+    def test_lines(self):
+        s1 = self.dog.sensor(self.path, 1, name="methane", nSamples=3)
+        s2 = self.dog.sensor(self.path, 2, name="co", sensorType="MQ7")
+        self.assertIs(s1.bus, s2.bus)
+        self.connect(s1.bus)
+        with self.assertRaises(Exception):
+            s1.sample()
+        ## a line split across writes, one too long, one malformed.
+        self.send(b"10\t2")
+        time.sleep(.1)
+        self.send(b"00\n" + b"9" * 600 + b"\nbad\tline\n")
+        for i in range(5):
+            self.send("{}\t{}\r\n".format(300 + i, 100).encode("ascii"))
+        self.assertTrue(self.waitFor(lambda: s1.bus.stats()["lines"] == 6))
+        stats = s1.bus.stats()
+        self.assertEqual(stats["overflows"], 1)
+        self.assertEqual(stats["malformed"], 1)
+        _, counts = s1.bus.latest(1)
+        self.assertEqual(list(counts), [10, 300, 301, 302, 303, 304])
+        e = s1.sample()
+        self.assertEqual(e["counts"], 303)
+        self.assertAlmostEqual(
+            e["PPM"], numpy.mean(mqPpm(numpy.array([302, 303, 304]), "MQ4")))
+        self.assertEqual(s2.sample()["counts"], 100)
+
+    def test_stale(self):
+        s = self.dog.sensor(self.path, 1, stale=.2)
+        self.connect(s.bus)
+        self.send(b"100\n")
+        self.assertTrue(self.waitFor(lambda: s.bus.stats()["lines"] == 1))
+        s.sample()
+        time.sleep(.3)
+        with self.assertRaises(Exception):
+            s.sample()
+
+    def test_frames(self):
+        s = self.dog.sensor(self.path, 2, frameChannels=3, decimate=4)
+        self.connect(s.bus)
+        samples = numpy.array([[1, 10 + i, 3] for i in range(8)])
+        data = encodeFrames(0, samples)
+        ## noise before and a corrupted frame between the good ones.
+        bad = bytearray(encodeFrames(8, [[1, 2, 3]]))
+        bad[6] ^= 0xFF
+        self.send(b"\x00\xa5" + data[:20])
+        time.sleep(.1)
+        self.send(data[20:] + bytes(bad) + encodeFrames(9, [[1, 50, 3]] * 4))
+        self.assertTrue(self.waitFor(lambda: s.bus.stats()["lines"] == 3))
+        stats = s.bus.stats()
+        self.assertEqual((stats["frames"], stats["corrupt"], stats["dropped"]),
+                         (12, 1, 1))
+        _, counts = s.bus.latest(2)
+        self.assertEqual(list(counts), [11.5, 15.5, 50.0])
+
+    def test_frame_defaults(self):
+        s = self.dog.sensor(self.path, 1, frameChannels=5)
+        self.assertEqual(s.bus._baud, 115200)
+        self.assertEqual(s.bus._decimate.factor, 400)
+
+    def test_reopens(self):
+        bus = SerialBus(self.path, reopen=.1)
+        try:
+            self.connect(bus)
+            self.send(b"1\n")
+            self.assertTrue(self.waitFor(lambda: bus.stats()["lines"] == 1))
+            os.close(self.master)
+            self.assertTrue(self.waitFor(lambda: bus.stats()["reopens"] >= 1))
+            self.assertTrue(bus.running())
+        finally:
+            bus.stop()
+
+    def test_decoder_stats(self):
+        d = FrameDecoder(2)
+        seqs, samples = d.decode(encodeFrames(65535, [[1, 2], [3, 4]]))
+        self.assertEqual(list(seqs), [65535, 0])
+        self.assertEqual(samples.tolist(), [[1, 2], [3, 4]])
+        self.assertEqual(d.stats()["dropped"], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from thermodog.spool import Spool
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.spools = []
+
+    def tearDown(self):
+        for s in self.spools:
+            s.close()
+        shutil.rmtree(self.dir)
+
+    def spool(self, **args):
+        args.setdefault("sync", False)
+        s = Spool(os.path.join(self.dir, "spool"), **args)
+        self.spools.append(s)
+        return s
+
+    def drain(self, spool, batchSize=20):
+        out = []
+        def take(payloads):
+            out.extend(payloads)
+            return True
+        spool.replay({"n": take}, batchSize=batchSize)
+        return out
+
+    def lastSegment(self, spool):
+        return spool._segPath(spool.segments()[-1])
+
+    def test_round_trip(self):
+        s = self.spool()
+        self.assertTrue(s.empty())
+        for i in range(5):
+            s.append("n", {"i": i})
+        self.assertFalse(s.empty())
+        self.assertEqual(self.drain(s), [{"i": i} for i in range(5)])
+        self.assertTrue(s.empty())
+        self.assertEqual(self.drain(s), [])
+
+    def test_segment_rollover(self):
+        s = self.spool(segmentBytes=100)
+        for i in range(20):
+            s.append("n", i)
+        self.assertTrue(len(s.segments()) > 5)
+        self.assertEqual(self.drain(s, batchSize=3), list(range(20)))
+        ## delivered segments, but the one being written, are removed.
+        self.assertEqual(s.segments(), [s.segments()[-1]])
+        s.append("n", 20)
+        self.assertEqual(self.drain(s), [20])
+
+    def test_bound_drops_oldest(self):
+        s = self.spool(segmentBytes=100, maxBytes=400)
+        for i in range(50):
+            s.append("n", i)
+        self.assertTrue(s.size() <= 400 + 100)
+        self.assertTrue(s.stats()["dropped"] > 0)
+        out = self.drain(s)
+        ## the newest records survive, in order.
+        self.assertEqual(out, list(range(50 - len(out), 50)))
+        self.assertTrue(0 < len(out) < 50)
+
+    def test_torn_trailing_line(self):
+        s = self.spool()
+        for i in range(3):
+            s.append("n", i)
+        s.close()
+        with open(self.lastSegment(s), "ab") as f:
+            f.write(b'0badc0de {"kind": "n", "pay')
+        self.assertEqual(self.drain(s), [0, 1, 2])
+        ## the next append terminates the torn record first.
+        r = self.spool()
+        r.append("n", 3)
+        self.assertEqual(self.drain(r), [3])
+        self.assertEqual(r.stats()["corrupt"], 1)
+
+    def test_corrupt_line(self):
+        s = self.spool()
+        for i in range(3):
+            s.append("n", {"v": i})
+        s.close()
+        path = self.lastSegment(s)
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        lines[1] = lines[1].replace(b'"v": 1', b'"v": 7')
+        with open(path, "wb") as f:
+            f.writelines(lines)
+        self.assertEqual(self.drain(s), [{"v": 0}, {"v": 2}])
+        self.assertEqual(s.stats()["corrupt"], 1)
+
+    def test_cursor_persists(self):
+        s = self.spool(segmentBytes=100)
+        for i in range(10):
+            s.append("n", i)
+        out = []
+        def first(payloads):
+            out.extend(payloads)
+            return len(out) <= 4
+        self.assertEqual(s.replay({"n": first}, batchSize=4), 4)
+        s.close()
+        ## a re-opened spool resumes after the last delivered batch.
+        r = self.spool(segmentBytes=100)
+        self.assertEqual(self.drain(r), list(range(4, 10)))
+
+    def test_failed_handler_stops(self):
+        s = self.spool()
+        for i in range(3):
+            s.append("n", i)
+        s.append("m", "x")
+        s.append("n", 3)
+        calls = []
+        def n(payloads):
+            calls.append(("n", payloads))
+            return True
+        def m(payloads):
+            calls.append(("m", payloads))
+            return False
+        self.assertEqual(s.replay({"n": n, "m": m}), 3)
+        self.assertEqual(calls, [("n", [0, 1, 2]), ("m", ["x"])])
+        ## retried from the failed record.
+        del calls[:]
+        self.assertEqual(s.replay({"n": n, "m": lambda p: True}), 2)
+        self.assertEqual(calls, [("n", [3])])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import math
+import random
+import datetime
+import unittest
+
+import numpy
+import pytz
+
+from thermodog.stats import P2Quantile, RunningStats, RollingStats
+
+class P2QuantileTest(unittest.TestCase):
+    def test_uniform(self):
+        rng = random.Random(7)
+        xs = [rng.uniform(0, 100) for i in range(20000)]
+        for p in (.1, .5, .9, .99):
+            q = P2Quantile(p)
+            for x in xs:
+                q.add(x)
+            self.assertAlmostEqual(q.value(), numpy.percentile(xs, 100*p),
+                                   delta=1.0)
+
+    def test_normal(self):
+        rng = random.Random(11)
+        xs = [rng.gauss(20, 2) for i in range(20000)]
+        q = P2Quantile(.9)
+        for x in xs:
+            q.add(x)
+        ## 20 + 1.2816 * 2
+        self.assertAlmostEqual(q.value(), 22.563, delta=.1)
+
+    def test_few_samples(self):
+        q = P2Quantile(.5)
+        self.assertTrue(math.isnan(q.value()))
+        for x in (3, 1, 2):
+            q.add(x)
+        self.assertEqual(q.value(), 2)
+
+class RunningStatsTest(unittest.TestCase):
+    def test_welford(self):
+        rng = random.Random(3)
+        ## a large offset loses precision in a naive sum of squares.
+        xs = [1e6 + rng.gauss(0, .5) for i in range(5000)]
+        s = RunningStats()
+        for x in xs:
+            s.add(x)
+        self.assertEqual(s.count, len(xs))
+        self.assertAlmostEqual(s.mean, numpy.mean(xs), places=6)
+        self.assertAlmostEqual(s.variance, numpy.var(xs, ddof=1), places=6)
+        self.assertAlmostEqual(s.stdev, numpy.std(xs, ddof=1), places=6)
+        self.assertEqual(s.min, min(xs))
+        self.assertEqual(s.max, max(xs))
+        self.assertAlmostEqual(s.quantile(.5), numpy.median(xs), delta=.05)
+
+    def test_nan_and_reset(self):
+        s = RunningStats()
+        self.assertTrue(math.isnan(s.mean))
+        for x in (1.0, float("nan"), 3.0):
+            s.add(x)
+        self.assertEqual(s.count, 2)
+        self.assertEqual(s.mean, 2.0)
+        self.assertEqual(s.variance, 2.0)
+        self.assertEqual(sorted(s.summary()),
+                         ["count", "max", "mean", "min", "p50", "p90",
+                          "p99", "stdev"])
+        self.assertRaises(KeyError, s.quantile, .75)
+        s.reset()
+        self.assertEqual(s.count, 0)
+        self.assertTrue(math.isnan(s.variance))
+
+class RollingStatsTest(unittest.TestCase):
+    T0 = 1500000000 - 1500000000 % 60
+
+    def fill(self, r, minutes):
+        """One reading per minute, valued the minute, over `minutes`."""
+        for m in range(minutes):
+            r.add(m, RollingStatsTest.T0 + 60*m + 30)
+        return RollingStatsTest.T0 + 60*(minutes - 1) + 30
+
+    def test_windows(self):
+        r = RollingStats()
+        last = self.fill(r, 90)
+        s = r.summary()
+        self.assertEqual(sorted(s), [5*60, 15*60, 60*60])
+        for w, n in ((5*60, 5), (15*60, 15), (60*60, 60)):
+            xs = list(range(90 - n, 90))
+            self.assertEqual(s[w]["count"], n)
+            self.assertEqual(s[w]["mean"], numpy.mean(xs))
+            self.assertAlmostEqual(s[w]["stdev"], numpy.std(xs, ddof=1))
+            self.assertEqual((s[w]["min"], s[w]["max"]), (90 - n, 89))
+
+    def test_buckets_expire(self):
+        r = RollingStats()
+        last = self.fill(r, 10)
+        self.assertEqual(r.window(5*60)["count"], 5)
+        ## minutes later with no readings, the buckets age out.
+        self.assertEqual(r.window(5*60, last + 3*60)["count"], 2)
+        self.assertEqual(r.window(5*60, last + 5*60)["count"], 0)
+        self.assertTrue(math.isnan(r.window(5*60, last + 5*60)["mean"]))
+        self.assertEqual(r.window(15*60, last + 5*60)["count"], 10)
+        self.assertEqual(r.window(60*60, last + 60*60)["count"], 0)
+
+    def test_bounded(self):
+        r = RollingStats()
+        self.fill(r, 24*60)
+        self.assertTrue(len(r._buckets) <= 61)
+        self.assertEqual(r.window(60*60)["count"], 60)
+
+    def test_datetimes(self):
+        r = RollingStats()
+        t0 = datetime.datetime(2020, 1, 1, 12, 0, 10, tzinfo=pytz.utc)
+        for i in range(3):
+            r.add(10*i, t0 + datetime.timedelta(seconds=20*i))
+        r.add(float("nan"), t0)
+        ## a late reading for an earlier bucket is ignored.
+        r.add(100, t0 - datetime.timedelta(minutes=5))
+        w = r.window(5*60)
+        self.assertEqual((w["count"], w["mean"]), (3, 10.0))
+
+if __name__ == "__main__":
+    unittest.main()
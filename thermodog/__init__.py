@@ -3,3 +3,9 @@ from .monitor import *
 from .coms import *
 from .cloudwatch import *
 from .common import *
+from .spool import *
+from .stats import *
+from .binlog import BinaryLog, readSegment
+from .max31855 import decodeFrames, Max31855Fault, OpenCircuit, \
+    ShortToGround, ShortToVcc
+from .serialdog import SerialDog, SerialBus, SerialSensor, mqPpm
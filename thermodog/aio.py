@@ -0,0 +1,171 @@
+##
+## Optional single event-loop runtime: periodic monitoring tasks, LED
+## blinking and AWS I/O share one asyncio loop; blocking GPIO reads
+## and AWS calls run on two small executors.
+##
+import time
+import signal
+import logging
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import monitor
+from .leds import LedController
+
+log = logging.getLogger("thermodog")
+
+class AsyncTask(object):
+    """Run `f` every `taskfreq` seconds on `executor`. The next run is
+    scheduled on the loop once the previous one finished, so runs
+    never overlap and nothing polls."""
+    def __init__(self, runtime, f, taskfreq, executor):
+        self._runtime  = runtime
+        self._f        = f
+        self._taskfreq = taskfreq
+        self._executor = executor
+        self._handle   = None
+        self._finished = False
+        self._t0       = 0
+        runtime.loop.call_soon_threadsafe(self._fire)
+
+    @property
+    def taskfreq(self):
+        return self._taskfreq
+    @taskfreq.setter
+    def taskfreq(self, f):
+        shorter = f < self._taskfreq
+        self._taskfreq = f
+        if shorter and not self._finished:
+            self._runtime.loop.call_soon_threadsafe(self._retime)
+
+    def _retime(self):
+        ## a shorter period moves up the run already scheduled.
+        if self._handle is None or self._finished:
+            return
+        self._handle.cancel()
+        wait = max(0, self._taskfreq - (time.time() - self._t0))
+        self._handle = self._runtime.loop.call_later(wait, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        if self._finished:
+            return
+        self._t0 = time.time()
+        fut = self._runtime.loop.run_in_executor(self._executor, self._f)
+        fut.add_done_callback(self._done)
+
+    def _done(self, fut):
+        if not fut.cancelled() and fut.exception() is not None:
+            log.error("task {} failed: {}".format(self._f, fut.exception()))
+        if self._finished:
+            return
+        wait = max(0, self._taskfreq - (time.time() - self._t0))
+        self._handle = self._runtime.loop.call_later(wait, self._fire)
+
+    def active(self):
+        return not self._finished
+
+    def stop(self):
+        self._finished = True
+        if not self._runtime.loop.is_closed():
+            self._runtime.loop.call_soon_threadsafe(self._cancel)
+
+    def _cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+class AsyncRuntime(object):
+    """The asyncio runtime. `install` makes `monitor.startTask` and
+    the `LedController` timer use it; `run` blocks on the loop until
+    SIGINT or SIGTERM."""
+    def __init__(self, loop=None, gpioWorkers=1, ioWorkers=4):
+        self._loop   = loop if loop else asyncio.new_event_loop()
+        self._gpio   = ThreadPoolExecutor(gpioWorkers)
+        self._io     = ThreadPoolExecutor(ioWorkers)
+        self._tasks  = []
+
+    @property
+    def loop(self):
+        return self._loop
+
+    def install(self):
+        monitor.runtime = self
+        LedController.runtime = self
+        return self
+
+    def uninstall(self):
+        if monitor.runtime is self:
+            monitor.runtime = None
+        if LedController.runtime is self:
+            LedController.runtime = None
+
+    def task(self, f, taskfreq, io=False):
+        """Run `f` periodically on the GPIO, or with `io`, the I/O
+        executor."""
+        t = AsyncTask(self, f, taskfreq, self._io if io else self._gpio)
+        self._tasks.append(t)
+        return t
+
+    def offload(self, f, *args):
+        """Run `f(*args)` once on the I/O executor, from any thread."""
+        def submit():
+            fut = self.loop.run_in_executor(self._io, f, *args)
+            fut.add_done_callback(self._logFailure)
+        self.loop.call_soon_threadsafe(submit)
+
+    def _logFailure(self, fut):
+        if not fut.cancelled() and fut.exception() is not None:
+            log.error("offloaded call failed: {}".format(fut.exception()))
+
+    def run(self):
+        def stop():
+            log.info("runtime stopping.")
+            self.loop.stop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def shutdown(self):
+        """Stop every task and wait for in-flight work to finish."""
+        for t in self._tasks:
+            t._finished = True
+            t._cancel()
+        self._gpio.shutdown(wait=True)
+        self._io.shutdown(wait=True)
+        self.uninstall()
+        self.loop.close()
+
+class AsyncAlerter(object):
+    """Send the alerts of `alerter` from the runtime's I/O executor so
+    monitors never wait on SNS."""
+    def __init__(self, alerter, runtime):
+        self._alerter = alerter
+        self._runtime = runtime
+
+    def __getattr__(self, name):
+        return getattr(self._alerter, name)
+
+    def alert(self, distributionList, msg):
+        self._runtime.offload(self._alerter.alert, distributionList, msg)
+
+    def alertAll(self, msg):
+        self._runtime.offload(self._alerter.alertAll, msg)
+
+    def alertSys(self, msg):
+        self._runtime.offload(self._alerter.alertSys, msg)
+
+    def alertMon(self, msg):
+        self._runtime.offload(self._alerter.alertMon, msg)
@@ -0,0 +1,134 @@
+##
+## One boto3 client per service and region, shared by every thread,
+## with pooled keep-alive connections, bounded timeouts and retries,
+## and per-call statistics.
+##
+import time
+import logging
+
+from threading import Lock
+
+log = logging.getLogger("thermodog")
+
+class ClientRegistry(object):
+    """Create each service's client once, from one session. boto3
+    clients are thread-safe; sessions and client creation are not, so
+    creation happens under a lock. Every call is timed through
+    botocore's before-parameter-build and after-call events; `stats` sums them
+    per service and operation and `addListener` callbacks receive
+    (service, operation, seconds, ok) as each call completes."""
+    def __init__(self, region=None, connectTimeout=5, readTimeout=15,
+                 retries=4, maxPoolConnections=10):
+        self._region    = region
+        self._config    = dict(connectTimeout=connectTimeout,
+                               readTimeout=readTimeout,
+                               retries=retries,
+                               maxPoolConnections=maxPoolConnections)
+        self._session   = None
+        self._clients   = {}
+        self._listeners = []
+        self._stats     = {}
+        self._lock      = Lock()
+
+    def configure(self, **args):
+        """Change the client configuration; clients are recreated."""
+        with self._lock:
+            self._config.update(args)
+            self._clients = {}
+
+    def addListener(self, fx):
+        self._listeners.append(fx)
+
+    def client(self, service, region=None):
+        region = region if region else self._region
+        key = (service, region)
+        c = self._clients.get(key)
+        if c is not None:
+            return c
+        with self._lock:
+            if key not in self._clients:
+                self._clients[key] = self._create(service, region)
+                log.debug("Created {} client ({}).".format(
+                    service, region or "default region"))
+            return self._clients[key]
+
+    def _botoConfig(self):
+        import botocore
+        from botocore.config import Config
+        cfg = self._config
+        version = tuple(int(v) for v in botocore.__version__.split(".")[:2])
+        args = dict(connect_timeout=cfg["connectTimeout"],
+                    read_timeout=cfg["readTimeout"],
+                    max_pool_connections=cfg["maxPoolConnections"])
+        ## `retries` counts retries after the first attempt; botocore
+        ## before 1.15 has only the legacy mode, and rejects any other
+        ## key than its max_attempts, which counts the same.
+        if version >= (1, 15):
+            args["retries"] = {"total_max_attempts": cfg["retries"] + 1,
+                               "mode": "standard"}
+        else:
+            args["retries"] = {"max_attempts": cfg["retries"]}
+        ## botocore before 1.27 has no tcp_keepalive; pooled
+        ## connections are kept alive between calls regardless.
+        if version >= (1, 27):
+            args["tcp_keepalive"] = True
+        return Config(**args)
+
+    def _create(self, service, region):
+        ## boto3 takes seconds to import on a Pi; only when first needed.
+        import boto3
+        if self._session is None:
+            self._session = boto3.session.Session()
+        c = self._session.client(service, region_name=region,
+                                 config=self._botoConfig())
+        ## each client has its own event hierarchy.
+        c.meta.events.register("before-parameter-build", self._before)
+        c.meta.events.register("after-call", self._after)
+        c.meta.events.register("after-call-error", self._afterError)
+        return c
+
+    def _before(self, model=None, context=None, **args):
+        ## after-call-error has no model; keep what is timed with it.
+        if context is not None and model is not None:
+            context["thermodog-t0"] = (time.time(),
+                                       model.service_model.service_name,
+                                       model.name)
+
+    def _after(self, context=None, http_response=None, **args):
+        ok = http_response is None or http_response.status_code < 300
+        self._record(context, ok)
+
+    def _afterError(self, context=None, **args):
+        self._record(context, False)
+
+    def _record(self, context, ok):
+        if context is None or "thermodog-t0" not in context:
+            return
+        t0, service, op = context.pop("thermodog-t0")
+        dt = time.time() - t0
+        key = "{}.{}".format(service, op)
+        with self._lock:
+            s = self._stats.get(key)
+            if s is None:
+                s = self._stats[key] = {"calls": 0, "errors": 0,
+                                        "seconds": 0.0, "maxSeconds": 0.0}
+            s["calls"] += 1
+            s["errors"] += 0 if ok else 1
+            s["seconds"] += dt
+            s["maxSeconds"] = max(s["maxSeconds"], dt)
+        for fx in self._listeners:
+            try:
+                fx(service, op, dt, ok)
+            except Exception as e:
+                log.warning("AWS stats listener failed: {}".format(e))
+
+    def stats(self):
+        """Calls, errors and seconds per 'service.Operation'."""
+        with self._lock:
+            return dict((k, dict(v)) for k, v in self._stats.items())
+
+## the registry used throughout thermodog.
+registry = ClientRegistry()
+
+def client(service, region=None):
+    return registry.client(service, region)
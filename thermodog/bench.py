@@ -0,0 +1,82 @@
+"""Read-path benchmarks, run with `python -m thermodog.bench`. Off
+the Pi, or with THERMODOG_SIM=1, they run against the simulated board.
+
+Usage:
+   bench [--iterations=<n>] [--bus=<bus>] [--seconds=<s>]
+
+Options:
+ -n, --iterations=<n>   Calls per benchmark [Default: 2000]
+ -b, --bus=<bus>        Thermocouple bus, 'bitbang' or 'spi' [Default: bitbang]
+ -s, --seconds=<s>      Duration of the monitor pipeline run [Default: 2]
+"""
+import io
+import sys
+import time
+import numpy
+import docopt
+
+from .thermodog import ThermoDog
+from .coms import SmsAlerter
+from .cloudwatch import CloudWatchPublisher
+from .monitor import SensorHub, SensorFileLogger, SensorRangeAlarm, \
+    CloudWatchHeartbeat
+
+class _StubCloudWatch(object):
+    def __init__(self):
+        self.calls = 0
+    def put_metric_data(self, **args):
+        self.calls += 1
+
+def timeCalls(f, n):
+    """Per-call latencies, in seconds, of `n` calls to `f`."""
+    lat = numpy.empty(n)
+    for i in range(n):
+        t0 = time.time()
+        f()
+        lat[i] = time.time() - t0
+    return lat
+
+def summarize(name, lat, out=sys.stdout):
+    us = lat * 1e6
+    out.write("{:<12} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}\n".format(
+        name, len(lat) / lat.sum() if lat.sum() else float("inf"),
+        numpy.percentile(us, 50), numpy.percentile(us, 90),
+        numpy.percentile(us, 99), us.max()))
+
+def pipeline(dog, seconds):
+    """Tick intervals of one hub feeding a logger, a range alarm and a
+    CloudWatch heartbeat as fast as it can run."""
+    sensor = dog.sensor(1, name="bench", sampleRate=0)
+    publisher = CloudWatchPublisher(client=_StubCloudWatch())
+    ticks = []
+    monitors = [
+        SensorFileLogger(sensor, io.StringIO() if sys.version_info[0] > 2
+                         else io.BytesIO(), freq=0),
+        SensorRangeAlarm(sensor, minc=-100, maxc=100, freq=0),
+        CloudWatchHeartbeat(sensor, publisher=publisher, freq=0)
+    ]
+    sub = SensorHub.forSensor(sensor).subscribe(
+        lambda evt: ticks.append(time.time()))
+    time.sleep(seconds)
+    sub.cancel()
+    for m in monitors:
+        m.stop()
+    publisher.stop()
+    return numpy.diff(ticks)
+
+def run(n=2000, bus="bitbang", seconds=2, out=sys.stdout):
+    dog = ThermoDog(alerter=SmsAlerter(), bus=bus)
+    out.write("{:<12} {:>10} {:>10} {:>10} {:>10} {:>10}\n".format(
+        "benchmark", "calls/s", "p50 us", "p90 us", "p99 us", "max us"))
+    summarize("read", timeCalls(lambda: dog.read(1), n), out)
+    summarize("avg", timeCalls(
+        lambda: dog.avg(1, nSamples=5, sampleRate=0), n // 5), out)
+    summarize("measure", timeCalls(
+        lambda: dog.measure(1, nSamples=5, sampleRate=0), n // 5), out)
+    summarize("pipeline", pipeline(dog, seconds), out)
+    dog.shutdown()
+
+if __name__ == "__main__":
+    args = docopt.docopt(__doc__)
+    run(n=int(args["--iterations"]), bus=args["--bus"],
+        seconds=float(args["--seconds"]))
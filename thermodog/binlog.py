@@ -0,0 +1,214 @@
+"""Binary measurement logs: fixed-width records written in blocks to
+daily, size-bounded segments that are gzipped once closed.
+
+Usage:
+   binlog <segment>...
+
+Prints the records of each segment, plain or gzipped, as TSV.
+"""
+##
+## A segment is a 32-byte header followed by packed little-endian
+## RECORD rows, so an open segment maps straight onto
+## `numpy.memmap(path, RECORD, mode="r", offset=HEADER_SIZE)`.
+##
+import os
+import sys
+import gzip
+import time
+import struct
+import shutil
+import logging
+import numpy
+
+from threading import Lock, Thread
+
+from .common import pstIso
+from .cloudwatch import epochSeconds, epochToUtc
+
+log = logging.getLogger("thermodog")
+
+MAGIC       = b"TDOGLOG\x00"
+VERSION     = 1
+HEADER_SIZE = 32
+SUFFIX      = ".tdl"
+
+RECORD = numpy.dtype([("timestamp", "<f8"),
+                      ("channel",   "<u1"),
+                      ("faults",    "<u1"),
+                      ("celsius",   "<f4"),
+                      ("internal",  "<f4")])
+
+def _header(name):
+    name = name.encode("utf-8")[:HEADER_SIZE - 12]
+    return MAGIC + struct.pack("<HH", VERSION, RECORD.itemsize) + \
+        name.ljust(HEADER_SIZE - 12, b"\x00")
+
+def _checkHeader(head, path):
+    if len(head) < HEADER_SIZE or head[:8] != MAGIC:
+        raise ValueError("{} is not a thermodog binary log".format(path))
+    version, size = struct.unpack("<HH", head[8:12])
+    if size != RECORD.itemsize:
+        raise ValueError("{}: record size {}, expected {}".format(
+            path, size, RECORD.itemsize))
+    return head[12:HEADER_SIZE].rstrip(b"\x00").decode("utf-8")
+
+def readSegment(path):
+    """The records of a segment: a read-only memmap, or an array for
+    gzipped segments. A trailing partial record is ignored."""
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            data = f.read()
+        _checkHeader(data[:HEADER_SIZE], path)
+        n = (len(data) - HEADER_SIZE) // RECORD.itemsize
+        return numpy.frombuffer(data, RECORD, n, HEADER_SIZE)
+    with open(path, "rb") as f:
+        _checkHeader(f.read(HEADER_SIZE), path)
+    n = (os.path.getsize(path) - HEADER_SIZE) // RECORD.itemsize
+    if n == 0:
+        return numpy.zeros(0, RECORD)
+    return numpy.memmap(path, RECORD, mode="r", offset=HEADER_SIZE,
+                        shape=(n,))
+
+def segmentName(path):
+    """The sensor name recorded in a segment's header."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return _checkHeader(f.read(HEADER_SIZE), path)
+
+def formatTsv(name, records):
+    """TSV lines as written by `SensorFileLogger`."""
+    for r in records:
+        yield "{:<10}\t{}\t{:>8.2f}C".format(
+            name, pstIso(epochToUtc(float(r["timestamp"]))), r["celsius"])
+
+class BinaryLog(object):
+    """Append measurements of one sensor as RECORD rows to segments
+    `<name>-<yyyymmdd>-<n>.tdl` under `dirname`. Records are buffered
+    and written `blockRecords` at a time, or after `flushSeconds`; a
+    segment is closed at the UTC day boundary or beyond `maxBytes`,
+    then gzipped in the background if `compress`."""
+    def __init__(self, dirname, name, maxBytes=16*1024*1024,
+                 blockRecords=256, flushSeconds=300, compress=True):
+        self._dirname   = dirname
+        self._name      = name
+        self._maxbytes  = maxBytes
+        self._flushsecs = flushSeconds
+        self._compress  = compress
+        self._buf       = numpy.zeros(blockRecords, RECORD)
+        self._n         = 0
+        self._lastflush = time.time()
+        self._file      = None
+        self._path      = None
+        self._day       = None
+        self._gzips     = []
+        self._lock      = Lock()
+        self._stats     = {"records": 0, "blocks": 0, "segments": 0}
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def path(self):
+        """The segment currently written."""
+        return self._path
+
+    def stats(self):
+        return dict(self._stats)
+
+    def segments(self):
+        """Paths of this log's segments, oldest first."""
+        ## name-day-number; the name may itself contain dashes.
+        return sorted(os.path.join(self._dirname, f)
+                      for f in os.listdir(self._dirname)
+                      if (f.endswith(SUFFIX) or f.endswith(SUFFIX + ".gz")) and
+                      f.rsplit("-", 2)[0] == self._name)
+
+    def write(self, evt):
+        ts = evt["timestamp"]
+        with self._lock:
+            r = self._buf[self._n]
+            r["timestamp"] = epochSeconds(ts) + ts.microsecond / 1e6
+            r["channel"]   = evt.get("channel") or 0
+            r["faults"]    = evt.get("faults") or 0
+            r["celsius"]   = evt["celsius"]
+            internal = evt.get("internal")
+            r["internal"]  = numpy.nan if internal is None else internal
+            self._n += 1
+            self._stats["records"] += 1
+            if self._n == len(self._buf) or \
+               time.time() - self._lastflush >= self._flushsecs:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._lastflush = time.time()
+        if self._n == 0:
+            return
+        block = self._buf[:self._n]
+        ## split the block at UTC day boundaries, each run going to
+        ## the segment of its day.
+        days = numpy.floor(block["timestamp"] / 86400.0)
+        for run in numpy.split(block, numpy.flatnonzero(numpy.diff(days)) + 1):
+            day = epochToUtc(float(run[0]["timestamp"])).strftime("%Y%m%d")
+            if self._file is None or day != self._day or \
+               self._file.tell() >= self._maxbytes:
+                self._rotate(day)
+            self._file.write(run.tobytes())
+        self._file.flush()
+        self._n = 0
+        self._stats["blocks"] += 1
+
+    def _rotate(self, day):
+        self._close()
+        self._day = day
+        pre = "{}-{}-".format(self._name, day)
+        seq = [int(f[len(pre):].split(".")[0])
+               for f in os.listdir(self._dirname) if f.startswith(pre)]
+        self._path = os.path.join(self._dirname, "{}{:03d}{}".format(
+            pre, max(seq) + 1 if seq else 0, SUFFIX))
+        self._file = open(self._path, "wb")
+        self._file.write(_header(self._name))
+        self._stats["segments"] += 1
+        log.debug("Logging {} to {}".format(self._name, self._path))
+
+    def _close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self._compress:
+            t = Thread(target=compressSegment, args=(self._path,))
+            t.daemon = True
+            t.start()
+            self._gzips = [g for g in self._gzips if g.is_alive()] + [t]
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._close()
+        for g in self._gzips:
+            g.join()
+
+def compressSegment(path):
+    """Replace a closed segment with `<path>.gz`."""
+    try:
+        with open(path, "rb") as src:
+            with gzip.open(path + ".gz.tmp", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        os.rename(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+    except Exception as e:
+        log.warning("Failed to compress {}: {}".format(path, e))
+
+if __name__ == "__main__":
+    import docopt
+    args = docopt.docopt(__doc__)
+    for p in args["<segment>"]:
+        for line in formatTsv(segmentName(p), readSegment(p)):
+            sys.stdout.write(line + "\n")
@@ -0,0 +1,123 @@
+##
+## Bus transports for reading raw 32-bit MAX31855 frames.
+##
+import os
+import logging
+
+## Off the Pi, or with THERMODOG_SIM set, run against the simulated
+## board in `sim`.
+SIMULATED = not os.uname()[4].startswith("arm") or \
+            bool(os.environ.get("THERMODOG_SIM"))
+
+if SIMULATED:
+    from . import sim
+    from .sim import GPIO
+else:
+    import RPi.GPIO as GPIO
+
+log = logging.getLogger("thermodog")
+
+class Bus(object):
+    """Read raw MAX31855 frames; channels are numbered from 1 in the
+    order of `cs_pins`. Transports provide `readFrame(n)`, the 32-bit
+    frame of channel `n` as an int."""
+    def __init__(self, cs_pins):
+        self._cs_pins = list(cs_pins)
+
+    @property
+    def cs_pins(self):
+        return self._cs_pins
+
+    def setup(self):
+        pass
+
+    def close(self):
+        pass
+
+class BitBangBus(Bus):
+    """Clock the frame in one bit at a time over GPIO."""
+    def __init__(self, cs_pins, clock_pin, data_pin):
+        super(BitBangBus, self).__init__(cs_pins)
+        self._clock_pin = clock_pin
+        self._data_pin  = data_pin
+
+    def __repr__(self):
+        return "BitBangBus(clock={}, data={})".format(self._clock_pin,
+                                                       self._data_pin)
+
+    def setup(self):
+        # Initialize clock and data pin
+        GPIO.setup(self._clock_pin, GPIO.OUT)
+        GPIO.setup(self._data_pin, GPIO.IN)
+        # Initialize thermocouple pins
+        for p in self.cs_pins:
+            GPIO.setup(p, GPIO.OUT)
+            GPIO.output(p, GPIO.HIGH)
+
+    def readFrame(self, n):
+        cs_pin = self.cs_pins[n-1]
+        bytesin = 0
+        # Select the chip
+        GPIO.output(cs_pin, GPIO.LOW)
+        # Read in 32 bits
+        for i in range(32):
+            GPIO.output(self._clock_pin, GPIO.LOW)
+            bytesin = bytesin << 1
+            if (GPIO.input(self._data_pin)):
+                bytesin = bytesin | 1
+            GPIO.output(self._clock_pin, GPIO.HIGH)
+        # Unselect the chip
+        GPIO.output(cs_pin, GPIO.HIGH)
+        return bytesin
+
+class SpiBus(Bus):
+    """Read the frame with one transfer on the hardware SPI
+    controller. The board's chip selects, pins 24 and 26, are CE0 and
+    CE1 of SPI0, so channel `n` is `/dev/spidev<bus>.<devices[n-1]>`."""
+    ## the MAX31855 tops out at 5MHz, read-only, SPI mode 0.
+    MAX_SPEED = 5000000
+
+    def __init__(self, cs_pins, bus=0, devices=None, speed=MAX_SPEED):
+        super(SpiBus, self).__init__(cs_pins)
+        self._bus     = bus
+        self._devices = devices if devices else range(len(self.cs_pins))
+        self._speed   = speed
+        self._spi     = []
+
+    def __repr__(self):
+        return "SpiBus(bus={}, devices={})".format(self._bus,
+                                                   list(self._devices))
+
+    def setup(self):
+        if SIMULATED:
+            spidev = sim.spidev
+        else:
+            import spidev
+        self.close()
+        for d in self._devices:
+            spi = spidev.SpiDev()
+            spi.open(self._bus, d)
+            spi.max_speed_hz = self._speed
+            spi.mode = 0
+            self._spi.append(spi)
+
+    def readFrame(self, n):
+        b = self._spi[n-1].readbytes(4)
+        return (b[0] << 24) | (b[1] << 16) | (b[2] << 8) | b[3]
+
+    def close(self):
+        for spi in self._spi:
+            try:
+                spi.close()
+            except Exception:
+                log.exception("failed to close {}".format(self))
+        self._spi = []
+
+def makeBus(kind, cs_pins, clock_pin, data_pin, **args):
+    """Bus named by `kind`: 'bitbang' or 'spi'."""
+    if kind == "spi":
+        return SpiBus(cs_pins, **args)
+    elif kind == "bitbang":
+        return BitBangBus(cs_pins, clock_pin, data_pin)
+    else:
+        raise ValueError("unknown bus: {}".format(kind))
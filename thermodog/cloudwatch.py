@@ -1,13 +1,28 @@
+import os
+import json
 import time
-import boto3
 import random
 import pprint
+import hashlib
+import logging
+import calendar
 
-from .common import utcIso, utcNow
+from datetime import datetime, timedelta
+from threading import Thread, Lock, Event
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+from . import aws
+from .common import utcIso, utcNow, UTC
+
+log = logging.getLogger("thermodog")
 
 class CloudWatch(object):
-    def __init__(self, namespace=None):
-        self._client = boto3.client('cloudwatch')
+    def __init__(self, namespace=None, client=None):
+        self._client = client
         self._namespace = namespace
 
     def listMetrics(self):
@@ -18,15 +33,16 @@ class CloudWatch(object):
         return self._namespace
     @property
     def client(self):
-        return self._client    
+        return self._client if self._client else aws.client("cloudwatch")
 
 class CloudWatchMetric(CloudWatch):
     def __init__(self, metricName=None, dimName=None,
-                 dimValue=None, **kwargs):
+                 dimValue=None, publisher=None, **kwargs):
         super(CloudWatchMetric, self).__init__(**kwargs)
         self._metricName = metricName
         self._dimName = dimName
         self._dimValue = dimValue
+        self._publisher = publisher
 
     @property
     def metricName(self):
@@ -37,6 +53,14 @@ class CloudWatchMetric(CloudWatch):
     @property
     def dimValue(self):
         return self._dimValue   
+    @property
+    def publisher(self):
+        return self._publisher
+    @property
+    def client(self):
+        if self._client is None and self._publisher:
+            return self._publisher.client
+        return super(CloudWatchMetric, self).client
 
     @property
     def metricDict(self):
@@ -54,7 +78,12 @@ class CloudWatchMetric(CloudWatch):
         ## pushing one value at a time might be problematic, if: we do
         ## so every minute, we have 60*24*30*10, where 10 is the
         ## approximate number of dogs; the fix is to measure more and
-        ## submit less using the vector submit.
+        ## submit less using the vector submit, see
+        ## `CloudWatchPublisher`.
+        if self.publisher:
+            self.publisher.put(self.namespace, self.metricDict,
+                               value, timestamp)
+            return
         d = self.metricDict
         d.update({
             "Value": value,
@@ -79,18 +108,29 @@ class CloudWatchMetric(CloudWatch):
             ]})
         return self.client.get_metric_statistics(**d)
 
+    def history(self, startTime=None, endTime=None, period=10*60,
+                stat="Average", history=None):
+        """(timestamps, values) of `stat` per `period`, by default over
+        the last 24 hours, through `history`, a `CloudWatchHistory`."""
+        history = history if history else CloudWatchHistory(client=self.client)
+        key = (self.namespace, self.metricDict)
+        return history.fetch([key], startTime, endTime, period, stat)[0]
+
 
-    def addAlarm(self,
-                 alarmName,
-                 threshold=30,
-                 alarmActions=[
-                     "arn:aws:sns:us-west-2:329245541944:thermodog"
-                 ],
-                 period=60,
-                 evalPeriods=2,
-                 datapointsToAlarm=2,
-                 treatMissingData="breaching",
-                 compOperator="GreaterThanOrEqualToThreshold"):
+    def addAlarm(self, alarmName, **args):
+        self.client.put_metric_alarm(**self.alarmDict(alarmName, **args))
+
+    def alarmDict(self,
+                  alarmName,
+                  threshold=30,
+                  alarmActions=[
+                      "arn:aws:sns:us-west-2:329245541944:thermodog"
+                  ],
+                  period=60,
+                  evalPeriods=2,
+                  datapointsToAlarm=2,
+                  treatMissingData="breaching",
+                  compOperator="GreaterThanOrEqualToThreshold"):
     
         adict = {
             "AlarmName":                alarmName,
@@ -111,5 +151,417 @@ class CloudWatchMetric(CloudWatch):
             "TreatMissingData": treatMissingData,
             "ComparisonOperator": compOperator
         }
-        self.client.put_metric_alarm(**adict)
+        return adict
+
+
+def epochSeconds(ts):
+    return calendar.timegm(ts.utctimetuple())
+
+def epochToUtc(secs):
+    return UTC.localize(datetime.utcfromtimestamp(secs))
+
+class _Aggregate(object):
+    """Readings of one metric within one period."""
+    def __init__(self, metricDict, start):
+        self.metricDict = metricDict
+        self.start      = start
+        self.created    = time.time()
+        self.count      = 0
+        self.total      = 0.0
+        self.minimum    = None
+        self.maximum    = None
+        self.values     = {}
+
+    def add(self, value):
+        value = float(value)
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.values[value] = self.values.get(value, 0) + 1
+
+    def datum(self, mode):
+        d = dict(self.metricDict)
+        d["Timestamp"] = epochToUtc(self.start)
+        if mode == CloudWatchPublisher.VALUES:
+            vs = sorted(self.values.keys())
+            d["Values"] = vs
+            d["Counts"] = [float(self.values[v]) for v in vs]
+        else:
+            d["StatisticValues"] = {
+                "SampleCount": float(self.count),
+                "Sum":         self.total,
+                "Minimum":     self.minimum,
+                "Maximum":     self.maximum
+            }
+        return d
+
+class CloudWatchPublisher(object):
+    """Collect readings from any number of metrics, aggregate them per
+    `period` seconds and flush them in the background as multi-datum
+    `put_metric_data` requests. A flush happens once `maxDatums`
+    aggregates are pending or the oldest is `maxAge` seconds old.
+
+    With a `spool`, requests that fail are kept on disk and replayed,
+    in order, after the next request that succeeds."""
+    STATISTICS = "statistics"
+    VALUES     = "values"
+    ## API limits on datums per request and distinct values per datum.
+    MAX_DATUMS = 20
+    MAX_VALUES = 150
+
+    def __init__(self, client=None, period=60, maxDatums=MAX_DATUMS,
+                 maxAge=None, mode=STATISTICS, maxQueue=10000, spool=None,
+                 start=True):
+        self._client    = client
+        self._spool     = spool
+        self._period    = period
+        self._maxdatums = min(maxDatums, CloudWatchPublisher.MAX_DATUMS)
+        self._maxage    = maxAge if maxAge is not None else period
+        self._mode      = mode
+        self._queue     = Queue(maxQueue)
+        self._pending   = {}
+        self._flushlock = Lock()
+        ## `put` runs on sensor threads, `_send` on the publisher's.
+        self._statslock = Lock()
+        self._finished  = Event()
+        self._thread    = None
+        self._stats     = {
+            "readings": 0, "dropped": 0, "flushes": 0, "requests": 0,
+            "datums": 0, "errors": 0, "spooled": 0, "replayed": 0,
+            "maxBatch": 0,
+            "lastLatency": 0.0, "totalLatency": 0.0, "maxLatency": 0.0
+        }
+        if start:
+            self.start()
+
+    @property
+    def client(self):
+        return self._client if self._client else aws.client("cloudwatch")
+    @property
+    def period(self):
+        return self._period
+    @property
+    def mode(self):
+        return self._mode
+    @property
+    def spool(self):
+        return self._spool
+
+    def _count(self, key, n=1):
+        with self._statslock:
+            self._stats[key] += n
+
+    def stats(self):
+        with self._statslock:
+            s = dict(self._stats)
+        s["pending"] = len(self._pending)
+        s["queued"]  = self._queue.qsize()
+        s["meanBatch"] = float(s["datums"]) / s["requests"] \
+                         if s["requests"] else 0.0
+        s["meanLatency"] = s["totalLatency"] / s["requests"] \
+                           if s["requests"] else 0.0
+        return s
+
+    def put(self, namespace, metricDict, value, timestamp=None):
+        """Queue a reading; never blocks on the network."""
+        if not timestamp:
+            timestamp = utcNow()
+        try:
+            self._queue.put_nowait((namespace, metricDict, value, timestamp))
+            self._count("readings")
+        except Full:
+            self._count("dropped")
+            log.warning("CloudWatch publish queue full, dropping reading.")
+
+    def _key(self, namespace, metricDict, start):
+        dims = tuple((d["Name"], d["Value"])
+                     for d in metricDict.get("Dimensions", []))
+        return (namespace, metricDict["MetricName"], dims, start)
+
+    def _aggregate(self, item):
+        namespace, metricDict, value, timestamp = item
+        ts = epochSeconds(timestamp)
+        start = ts - (ts % self.period)
+        k = self._key(namespace, metricDict, start)
+        if k not in self._pending:
+            self._pending[k] = _Aggregate(metricDict, start)
+        self._pending[k].add(value)
+        return self._pending[k]
+
+    def _due(self, now):
+        if not self._pending:
+            return False
+        if len(self._pending) >= self._maxdatums:
+            return True
+        if any(len(a.values) >= CloudWatchPublisher.MAX_VALUES
+               for a in self._pending.values()):
+            return True
+        oldest = min(a.created for a in self._pending.values())
+        return (now - oldest) >= self._maxage
+
+    def drain(self):
+        """Move queued readings into the per-period aggregates."""
+        while True:
+            try:
+                self._aggregate(self._queue.get_nowait())
+            except Empty:
+                return
+
+    def flush(self):
+        """Send everything pending, grouped by namespace."""
+        with self._flushlock:
+            self.drain()
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            bynamespace = {}
+            for k in sorted(pending.keys(), key=lambda k: k[3]):
+                bynamespace.setdefault(k[0], []).append(
+                    pending[k].datum(self.mode))
+            sent = 0
+            for namespace, datums in bynamespace.items():
+                for i in range(0, len(datums), self._maxdatums):
+                    sent += self._send(namespace, datums[i:i+self._maxdatums],
+                                       spoolOnFail=True)
+            self._count("flushes")
+        if sent and self.spool and not self.spool.empty():
+            self.replay()
+        return sent
+
+    def replay(self):
+        """Resend spooled requests; returns the number replayed."""
+        def resend(payloads):
+            bynamespace = {}
+            for p in payloads:
+                bynamespace.setdefault(p["Namespace"], []).extend(
+                    p["MetricData"])
+            for namespace, datums in bynamespace.items():
+                for i in range(0, len(datums), self._maxdatums):
+                    if not self._send(namespace, datums[i:i+self._maxdatums]):
+                        return False
+            return True
+        n = self.spool.replay({"metric": resend})
+        self._count("replayed", n)
+        if n:
+            log.info("Replayed {} spooled CloudWatch requests.".format(n))
+        return n
+
+    def _send(self, namespace, datums, spoolOnFail=False):
+        t0 = time.time()
+        try:
+            self.client.put_metric_data(Namespace=namespace,
+                                        MetricData=datums)
+        except Exception as e:
+            self._count("errors")
+            if spoolOnFail and self.spool:
+                log.warning("Failed to publish {} datums to {}, spooling: {}".format(
+                    len(datums), namespace, e))
+                self.spool.append("metric", {"Namespace": namespace,
+                                             "MetricData": datums})
+                self._count("spooled", len(datums))
+            else:
+                log.exception("Failed to publish {} datums to {}: {}".format(
+                    len(datums), namespace, e))
+            return 0
+        dt = time.time() - t0
+        with self._statslock:
+            self._stats["requests"] += 1
+            self._stats["datums"] += len(datums)
+            self._stats["maxBatch"] = max(self._stats["maxBatch"], len(datums))
+            self._stats["lastLatency"] = dt
+            self._stats["totalLatency"] += dt
+            self._stats["maxLatency"] = max(self._stats["maxLatency"], dt)
+        return len(datums)
+
+    def run(self):
+        while not self._finished.is_set():
+            try:
+                item = self._queue.get(timeout=1)
+                with self._flushlock:
+                    self._aggregate(item)
+                    self.drain()
+            except Empty:
+                pass
+            if self._due(time.time()):
+                self.flush()
+        self.flush()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the background thread after a final flush."""
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        else:
+            self.flush()
+
+def _toEpoch(ts):
+    if ts is None or isinstance(ts, (int, float)):
+        return ts
+    return epochSeconds(ts)
+
+class CloudWatchHistory(object):
+    """Fetch the history of many metrics with batched `get_metric_data`
+    requests, up to `maxQueries` metrics each, following NextToken.
+    With a `cachedir`, the periods already fetched are kept on disk
+    per metric, period and statistic, so a repeated query only fetches
+    what is missing, usually the recent tail. Periods younger than
+    `settle` seconds are refetched as CloudWatch may still be
+    aggregating them."""
+    MAX_QUERIES = 500
+
+    def __init__(self, client=None, cachedir=None, maxQueries=MAX_QUERIES,
+                 settle=10*60):
+        self._client     = client
+        self._cachedir   = cachedir
+        self._maxqueries = maxQueries
+        self._settle     = settle
+        self._stats      = {"requests": 0, "queries": 0, "datapoints": 0,
+                            "cached": 0}
+        if cachedir and not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+
+    @property
+    def client(self):
+        return self._client if self._client else aws.client("cloudwatch")
+
+    def stats(self):
+        return dict(self._stats)
+
+    def _cachePath(self, namespace, metricDict, period, stat):
+        key = json.dumps([namespace, metricDict, period, stat], sort_keys=True)
+        return os.path.join(self._cachedir, "{}.json".format(
+            hashlib.sha1(key.encode("utf-8")).hexdigest()))
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                c = json.load(f)
+            covered = c["covered"]
+            if covered and not isinstance(covered[0], list):
+                ## one [lo, hi] span, as cached before.
+                covered = [covered]
+            return covered, dict((int(t), v) for t, v in c["points"])
+        except (IOError, OSError, ValueError, KeyError):
+            return None, {}
+
+    def _save(self, path, covered, points):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"covered": covered,
+                       "points": sorted(points.items())}, f)
+        os.rename(tmp, path)
+
+    def fetch(self, metrics, startTime=None, endTime=None, period=10*60,
+              stat="Average"):
+        """For each (namespace, metricDict) of `metrics`, a pair of lists,
+        epoch seconds and values, between `startTime` and `endTime`,
+        datetimes or epoch seconds, by default the last 24 hours."""
+        end = _toEpoch(endTime)
+        end = int(time.time()) if end is None else int(end)
+        start = _toEpoch(startTime)
+        start = end - 24*60*60 if start is None else int(start)
+        start -= start % period
+        ## the cacheable part ends with the last settled period.
+        settled = int(time.time()) - self._settle
+        settled = min(end, settled - settled % period)
+
+        caches, missing = [], {}
+        for i, (namespace, metricDict) in enumerate(metrics):
+            path, covered, points = None, None, {}
+            if self._cachedir:
+                path = self._cachePath(namespace, metricDict, period, stat)
+                covered, points = self._load(path)
+            caches.append([path, covered, points])
+            for span in self._gaps(covered, start, end):
+                missing.setdefault(span, []).append(i)
+            if covered:
+                self._stats["cached"] += 1
+
+        for (lo, hi), idx in missing.items():
+            for j in range(0, len(idx), self._maxqueries):
+                chunk = idx[j:j + self._maxqueries]
+                fetched = self._getMetricData(
+                    [metrics[i] for i in chunk], lo, hi, period, stat)
+                for i, pts in zip(chunk, fetched):
+                    caches[i][2].update(pts)
+
+        results = []
+        for path, covered, points in caches:
+            if path:
+                ## recent periods are refetched rather than cached.
+                spans = list(covered or [])
+                if settled > start:
+                    spans.append([start, settled])
+                spans = self._merge(spans)
+                kept = dict((t, v) for t, v in points.items()
+                            if any(lo <= t < hi for lo, hi in spans))
+                if spans:
+                    self._save(path, spans, kept)
+            ts = sorted(t for t in points if start <= t < end)
+            results.append((ts, [points[t] for t in ts]))
+        return results
+
+    def _merge(self, spans):
+        """Sorted disjoint spans covering the [lo, hi) `spans`;
+        overlapping and adjacent spans are joined."""
+        merged = []
+        for lo, hi in sorted(spans):
+            if merged and lo <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], hi)
+            else:
+                merged.append([lo, hi])
+        return merged
+
+    def _gaps(self, covered, start, end):
+        """Spans of [start, end) outside the cached `covered` spans."""
+        gaps = []
+        for lo, hi in self._merge(covered or []):
+            if hi <= start or lo >= end:
+                continue
+            if start < lo:
+                gaps.append((start, lo))
+            start = max(start, hi)
+        if start < end:
+            gaps.append((start, end))
+        return gaps
 
+    def _getMetricData(self, metrics, start, end, period, stat):
+        """Points, a dict of epoch seconds to value, per metric."""
+        queries = []
+        for i, (namespace, metricDict) in enumerate(metrics):
+            m = dict(metricDict)
+            m["Namespace"] = namespace
+            queries.append({
+                "Id": "m{}".format(i),
+                "MetricStat": {"Metric": m, "Period": period, "Stat": stat},
+                "ReturnData": True
+            })
+        points = [{} for m in metrics]
+        args = {"MetricDataQueries": queries,
+                "StartTime": epochToUtc(start),
+                "EndTime": epochToUtc(end),
+                "ScanBy": "TimestampAscending"}
+        while True:
+            r = self.client.get_metric_data(**args)
+            self._stats["requests"] += 1
+            for res in r.get("MetricDataResults", []):
+                pts = points[int(res["Id"][1:])]
+                for t, v in zip(res.get("Timestamps", []),
+                                res.get("Values", [])):
+                    pts[_toEpoch(t)] = v
+                self._stats["datapoints"] += len(res.get("Values", []))
+            if not r.get("NextToken"):
+                break
+            args["NextToken"] = r["NextToken"]
+        self._stats["queries"] += len(queries)
+        log.debug("Fetched {} metrics over {}s in {} requests.".format(
+            len(metrics), end - start, self._stats["requests"]))
+        return points
@@ -0,0 +1,151 @@
+##
+## Lossy compression of reading streams: keep only the points needed
+## to rebuild a series within a tolerance, plus a keep-alive point at
+## least every `keepAlive` seconds.
+##
+import logging
+
+from .cloudwatch import epochSeconds
+
+log = logging.getLogger("thermodog")
+
+class Compressor(object):
+    """Offer (t, value, item) points; compressors provide `offer(t, v,
+    item)`, returning the items to keep, in time order."""
+    def __init__(self, tolerance, keepAlive=10*60):
+        self._tolerance = float(tolerance)
+        self._keepalive = keepAlive
+        self._offered   = 0
+        self._emitted   = 0
+
+    @property
+    def tolerance(self):
+        return self._tolerance
+
+    @property
+    def ratio(self):
+        """Points offered per point kept."""
+        return self._offered / float(self._emitted) if self._emitted else 0.0
+
+    def stats(self):
+        return {"offered": self._offered, "emitted": self._emitted,
+                "ratio": self.ratio}
+
+    def _emit(self, items):
+        self._emitted += len(items)
+        return items
+
+    def flush(self):
+        """Items held back, e.g., at shutdown."""
+        return []
+
+class Deadband(Compressor):
+    """Keep a point when it differs from the last kept point by more
+    than `tolerance`; the series is rebuilt by holding values."""
+    def __init__(self, tolerance, keepAlive=10*60):
+        super(Deadband, self).__init__(tolerance, keepAlive)
+        self._last = None
+
+    def offer(self, t, v, item):
+        self._offered += 1
+        if self._last is None or abs(v - self._last[1]) > self._tolerance or \
+           t - self._last[0] >= self._keepalive:
+            self._last = (t, v)
+            return self._emit([item])
+        return []
+
+class SwingingDoor(Compressor):
+    """Swinging-door trending: keep a point when no straight line from
+    the last kept point passes within `tolerance` of every point since;
+    the series is rebuilt by linear interpolation. A point is kept
+    once the next one closes the door, so output lags by one point."""
+    def __init__(self, tolerance, keepAlive=10*60):
+        super(SwingingDoor, self).__init__(tolerance, keepAlive)
+        self._anchor = None
+        self._held   = None
+        self._lower  = float("-inf")
+        self._upper  = float("inf")
+
+    def _open(self, anchor):
+        self._anchor = anchor
+        self._held   = None
+        self._lower  = float("-inf")
+        self._upper  = float("inf")
+
+    def _swing(self, t, v):
+        """Narrow the door by (t, v); False if it closed, or if the line
+        to (t, v) would miss a point already inside it."""
+        ta, va = self._anchor[0], self._anchor[1]
+        dt = float(t - ta)
+        if not self._lower <= (v - va) / dt <= self._upper:
+            return False
+        lower = max(self._lower, (v - va - self._tolerance) / dt)
+        upper = min(self._upper, (v - va + self._tolerance) / dt)
+        if lower > upper:
+            return False
+        self._lower, self._upper = lower, upper
+        return True
+
+    def offer(self, t, v, item):
+        self._offered += 1
+        if self._anchor is None:
+            self._open((t, v, item))
+            return self._emit([item])
+        if t <= self._anchor[0] or (self._held and t <= self._held[0]):
+            return []
+        if t - self._anchor[0] >= self._keepalive:
+            out = [self._held[2]] if self._held and \
+                self._held[0] > self._anchor[0] else []
+            self._open((t, v, item))
+            return self._emit(out + [item])
+        if self._swing(t, v):
+            self._held = (t, v, item)
+            return []
+        ## the door closed: keep the last point it held and restart
+        ## from there.
+        held = self._held
+        self._open(held)
+        self._swing(t, v)
+        self._held = (t, v, item)
+        return self._emit([held[2]])
+
+    def flush(self):
+        if self._held is None:
+            return []
+        held = self._held
+        self._open(held)
+        return self._emit([held[2]])
+
+COMPRESSORS = {"deadband": Deadband, "swinging-door": SwingingDoor}
+
+def makeCompressor(kind, tolerance, keepAlive=10*60):
+    if kind not in COMPRESSORS:
+        raise ValueError("unknown compression: {}".format(kind))
+    return COMPRESSORS[kind](tolerance, keepAlive)
+
+class CompressedStream(object):
+    """Pass readings, monitor events, through `compressor` on the
+    way to `fx`. Call `flush` when the stream ends."""
+    def __init__(self, fx, compressor, field="celsius"):
+        self._fx         = fx
+        self._compressor = compressor
+        self._field      = field
+
+    @property
+    def compressor(self):
+        return self._compressor
+
+    def __call__(self, evt):
+        v = evt[self._field]
+        if v is None or v != v:
+            return
+        for e in self._compressor.offer(epochSeconds(evt["timestamp"]),
+                                        v, evt):
+            self._fx(e)
+
+    def flush(self):
+        for e in self._compressor.flush():
+            self._fx(e)
+        log.debug("Compressed {} readings to {} ({:.1f}:1).".format(
+            self._compressor.stats()["offered"],
+            self._compressor.stats()["emitted"], self._compressor.ratio))
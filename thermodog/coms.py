@@ -1,18 +1,196 @@
 ##
 ## Communication-related classes.
 ##
+import os
+import re
 import time
 import json
-import boto3
 import logging
 
+from threading import Lock, Timer
+
+from . import aws
+
 log = logging.getLogger("thermodog")
 
+class TokenBucket(object):
+    """`capacity` tokens, refilled continuously over `period` seconds."""
+    def __init__(self, capacity, period, tokens=None, stamp=None):
+        self._capacity = float(capacity)
+        self._period   = float(period)
+        self._tokens   = self._capacity if tokens is None else float(tokens)
+        self._stamp    = time.time() if stamp is None else float(stamp)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def tokens(self, now=None):
+        self._refill(time.time() if now is None else now)
+        return self._tokens
+
+    def _refill(self, now):
+        if now > self._stamp:
+            self._tokens = min(self._capacity, self._tokens +
+                               (now - self._stamp) * self._capacity / self._period)
+        self._stamp = now
+
+    def take(self):
+        self._tokens -= 1
+
+    def state(self):
+        return [self._tokens, self._stamp]
+
+class RateLimiter(object):
+    """Hourly and daily token buckets per key, e.g., per phone number
+    or topic. Admission is constant time; the buckets and counts of
+    suppressed sends are saved to `path`, when given, so a restart
+    loop can't reset the caps. `clock` returns the time in seconds."""
+    HOUR = 60*60
+    DAY  = 60*60*24
+
+    def __init__(self, path=None, perHour=4, perDay=20, clock=time.time):
+        self._path     = path
+        self._clock    = clock
+        self._perhour  = perHour
+        self._perday   = perDay
+        self._lock     = Lock()
+        self._limits   = {}
+        self._buckets  = {}
+        self._admitted = {}
+        self._suppressed = {}
+        self._load()
+
+    def __repr__(self):
+        return "RateLimiter('{}')".format(self._path)
+
+    def configure(self, key, perHour=None, perDay=None):
+        """Set the caps for `key`; defaults apply otherwise."""
+        with self._lock:
+            self._limits[key] = (perHour if perHour is not None else self._perhour,
+                                 perDay if perDay is not None else self._perday)
+            if key in self._buckets:
+                now = self._clock()
+                h, d = self._buckets[key]
+                self._buckets[key] = (
+                    TokenBucket(self._limits[key][0], RateLimiter.HOUR,
+                                min(h.tokens(now), self._limits[key][0]), now),
+                    TokenBucket(self._limits[key][1], RateLimiter.DAY,
+                                min(d.tokens(now), self._limits[key][1]), now))
+
+    def _bucketsFor(self, key):
+        if key not in self._buckets:
+            perhour, perday = self._limits.get(key, (self._perhour, self._perday))
+            now = self._clock()
+            self._buckets[key] = (TokenBucket(perhour, RateLimiter.HOUR, stamp=now),
+                                  TokenBucket(perday, RateLimiter.DAY, stamp=now))
+        return self._buckets[key]
+
+    def allows(self, key):
+        """True if both of `key`'s buckets have a token. Nothing is
+        charged: a send is `record`ed once it succeeded, and
+        `suppress`ed if dropped for lack of tokens."""
+        now = self._clock()
+        with self._lock:
+            hour, day = self._bucketsFor(key)
+            return hour.tokens(now) >= 1 and day.tokens(now) >= 1
+
+    def record(self, key):
+        """Take a token from both of `key`'s buckets for a send."""
+        with self._lock:
+            hour, day = self._bucketsFor(key)
+            hour.take()
+            day.take()
+            self._admitted[key] = self._admitted.get(key, 0) + 1
+            self._save()
+
+    def suppress(self, key):
+        """Count a send dropped for lack of tokens."""
+        with self._lock:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            self._save()
+
+    def remaining(self, key):
+        """Whole tokens left in the hourly and daily buckets."""
+        now = self._clock()
+        with self._lock:
+            hour, day = self._bucketsFor(key)
+            return (int(hour.tokens(now)), int(day.tokens(now)))
+
+    def suppressed(self, key=None):
+        with self._lock:
+            if key is None:
+                return sum(self._suppressed.values())
+            return self._suppressed.get(key, 0)
+
+    def stats(self):
+        with self._lock:
+            return {"admitted": dict(self._admitted),
+                    "suppressed": dict(self._suppressed)}
+
+    def _load(self):
+        if not self._path or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path) as f:
+                st = json.load(f)
+            for k, (h, d) in st.get("buckets", {}).items():
+                perhour, perday = self._limits.get(k, (self._perhour, self._perday))
+                self._buckets[k] = (
+                    TokenBucket(perhour, RateLimiter.HOUR, min(h[0], perhour), h[1]),
+                    TokenBucket(perday, RateLimiter.DAY, min(d[0], perday), d[1]))
+            self._admitted = st.get("admitted", {})
+            self._suppressed = st.get("suppressed", {})
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            log.warning("{} ignoring unreadable state: {}".format(self, e))
+
+    def _save(self):
+        if not self._path:
+            return
+        st = {"buckets": dict((k, [h.state(), d.state()])
+                              for k, (h, d) in self._buckets.items()),
+              "admitted": self._admitted,
+              "suppressed": self._suppressed}
+        tmp = self._path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(st, f)
+            os.rename(tmp, self._path)
+        except (IOError, OSError) as e:
+            log.warning("{} failed to save state: {}".format(self, e))
+
+def _deliver(target, send, spool, kind, payload, limiter, key):
+    """Deliver to `target` with `send`, returning True if sent. Every
+    alert path treats failures alike: a send that raises is spooled
+    as a `kind` record, if there is a spool, and retried in order; a
+    send refused by `limiter` is dropped and counted as suppressed.
+    Spooled messages stay spooled while rate limited."""
+    try:
+        sent = send()
+    except Exception as e:
+        if spool is None:
+            raise
+        log.warning("Failed to send to {}, spooling: {}".format(target, e))
+        spool.append(kind, payload)
+        return False
+    if not sent:
+        limiter.suppress(key)
+        log.info("NOT sending to: {} ({} suppressed).".format(
+            target, limiter.suppressed(key)))
+    return sent
+
 class SnsTopic(object):
-    def __init__(self, topicName):
+    """An SNS topic, created on first use. With a `provisioner`, its
+    ARN comes from the cached AWS state instead of a `create_topic`
+    call per start."""
+    def __init__(self, topicName, spool=None, limiter=None,
+                 provisioner=None):
         self._topicName = topicName
-        response = self.client.create_topic(Name=self.topicName)
-        self.pubArn = response.get("TopicArn", None)
+        self._spool = spool
+        self._limiter = limiter
+        self._provisioner = provisioner
+        self._client = None
+        self._pubArn = None
 
     @property
     def topicName(self):
@@ -20,69 +198,220 @@ class SnsTopic(object):
 
     @property
     def client(self):
-        return boto3.client("sns")
+        return self._client if self._client else aws.client("sns")
+
+    @property
+    def pubArn(self):
+        if self._pubArn is None:
+            if self._provisioner:
+                self._pubArn = self._provisioner.topicArn(self.topicName)
+            else:
+                response = self.client.create_topic(Name=self.topicName)
+                self._pubArn = response.get("TopicArn", None)
+        return self._pubArn
     
     def __repr__(self):
         return "SnsTopic('{}')".format(self.topicName)
+
+    @property
+    def limiterKey(self):
+        return "sns:{}".format(self.topicName)
     
-    def subscribe(self, email):
-        self.client.subscribe(TopicArn=self.pubArn, Protocol="email",
+    def subscribe(self, email, protocol="email"):
+        if self._provisioner:
+            self._provisioner.ensureSubscription(self, protocol, email)
+            return
+        self.client.subscribe(TopicArn=self.pubArn, Protocol=protocol,
                               Endpoint=email)
         log.info("Subscribed {} to {}".format(email, self))
+
+    def subscribeSms(self, phoneNumber):
+        self.subscribe(phoneNumber, protocol="sms")
                   
+    def _send(self, subject, message):
+        """Publish unless rate limited; returns True if published."""
+        if self._limiter and not self._limiter.allows(self.limiterKey):
+            return False
+        self.client.publish(TopicArn=self.pubArn,
+                            Message=message, Subject=subject)
+        if self._limiter:
+            self._limiter.record(self.limiterKey)
+        return True
+
     def publish(self, subject, message):
+        """Returns True if published, False if rate limited or
+        spooled."""
         log.info("Publishing to topic: {}".format(self.topicName))
         if len(subject) > 100:
             log.info("Truncating subject to 100 characters.")
             subject = subject[0:100]
-        self.client.publish(TopicArn=self.pubArn,
-                            Message=message, Subject=subject)
+        if self._spool is not None:
+            self.retry()
+        return _deliver(self, lambda: self._send(subject, message),
+                        self._spool, "sns",
+                        {"subject": subject, "message": message},
+                        self._limiter, self.limiterKey)
+
+    def retry(self):
+        """Publish spooled messages; returns the number delivered.
+        Messages are kept while rate limited."""
+        def resend(payloads):
+            for p in payloads:
+                if not self._send(p["subject"], p["message"]):
+                    return False
+            return True
+        if self._spool is None or self._spool.empty():
+            return 0
+        return self._spool.replay({"sns": resend}, batchSize=1)
 
 class SmsRecipient(object):
     """Receive fixed number of SMS messages per hour and day."""
-    def __init__(self, phoneNumber, maxSmsPerHour=4, maxSmsPerDay=20):
+    def __init__(self, phoneNumber, maxSmsPerHour=4, maxSmsPerDay=20,
+                 limiter=None):
         self._number    = phoneNumber
-        self._perhour   = maxSmsPerHour
-        self._perday    = maxSmsPerDay
-        self._sendtimes = []
-        self._lastalert = 0
-        self._client    = boto3.client("sns")
+        self._limiter   = limiter if limiter else RateLimiter()
+        self._limiter.configure(self.limiterKey, maxSmsPerHour, maxSmsPerDay)
+        self._client    = None
 
     def __repr__(self):
         return "SmsRecipient('{}')".format(self._number)
 
+    @property
+    def client(self):
+        return self._client if self._client else aws.client("sns")
+
+    @property
+    def number(self):
+        return self._number
+
+    @property
+    def limiter(self):
+        return self._limiter
+
+    @property
+    def limiterKey(self):
+        return "sms:{}".format(self._number)
+
     def sendMsg(self, msg):
-        now  = time.time()
-        lthourold = [t for t in self._sendtimes if t >= (now - 60*60)]
-        ltdayold = [t for t in self._sendtimes if t >= (now - 60*60*24)]
-        if len(lthourold) < self._perhour and \
-           len(ltdayold) < self._perday:
-            log.info("Sending SMS to: {} ({}, {}).".format(
-                self, len(lthourold), len(ltdayold)))
-            self._client.publish(PhoneNumber=self._number, Message=msg)
-            self._sendtimes = ltdayold + [now]
-        else:
-            log.info("NOT sending SMS to: {} ({}, {}).".format(
-                self, len(lthourold), len(ltdayold)))
+        """Returns True if sent, False if rate limited."""
+        if not self._limiter.allows(self.limiterKey):
+            return False
+        log.info("Sending SMS to: {} {}.".format(
+            self, self._limiter.remaining(self.limiterKey)))
+        self.client.publish(PhoneNumber=self._number, Message=msg)
+        self._limiter.record(self.limiterKey)
+        return True
 
 class SmsAlerter(object):
+    """Send SMS alerts to distribution lists. With a `spool`, messages
+    that fail to send are kept on disk and retried in order, so an
+    outage never turns into an exception in the monitoring path."""
     SYS_LIST = 1
     MON_LIST = 2
     ALL_LIST = SYS_LIST | MON_LIST
 
     def __init__(self, *numbers, **args):
         self._recipients = {}
+        self._spool = args.pop("spool", None)
+        self._limiter = args.pop("limiter", None)
+        if self._limiter is None:
+            self._limiter = RateLimiter()
         for number in numbers:
             self.addRecipient(number, **args)
-        
+
+    @property
+    def spool(self):
+        return self._spool
+    @property
+    def limiter(self):
+        return self._limiter
+
     def addRecipient(self, number, receive=MON_LIST, **args):
+        args.setdefault("limiter", self.limiter)
         self._recipients[number] = (
             receive, SmsRecipient(number, **args))
 
+    def recipients(self, distributionList=ALL_LIST):
+        """(group, recipient) pairs reached by `distributionList`."""
+        return [(g, r) for g, r in self._recipients.values()
+                if (g & distributionList) == g]
+
+    def send(self, recipient, msg):
+        """Returns True if sent, False if rate limited or spooled."""
+        return _deliver(recipient, lambda: recipient.sendMsg(msg),
+                        self.spool, "sms",
+                        {"number": recipient.number, "msg": msg},
+                        recipient.limiter, recipient.limiterKey)
+
+    def alert(self, distributionList, msg):
+        if self.spool is not None:
+            self.retry()
+        for g, r in self.recipients(distributionList):
+            self.send(r, msg)
+
+    def retry(self):
+        """Resend spooled messages; returns the number delivered."""
+        def resend(payloads):
+            ## a rate limited message stays spooled until tokens refill.
+            for p in payloads:
+                if p["number"] in self._recipients and \
+                   not self._recipients[p["number"]][1].sendMsg(p["msg"]):
+                    return False
+            return True
+        if self.spool is None or self.spool.empty():
+            return 0
+        n = self.spool.replay({"sms": resend}, batchSize=1)
+        if n:
+            log.info("Resent {} spooled SMS messages.".format(n))
+        return n
+
+    def alertAll(self, msg):
+        self.alert(SmsAlerter.ALL_LIST, msg)
+
+    def alertSys(self, msg):
+        self.alert(SmsAlerter.SYS_LIST, msg)
+
+    def alertMon(self, msg):
+        self.alert(SmsAlerter.MON_LIST, msg)
+
+class AlertDigest(object):
+    """Collect alerts for `window` seconds, then send each recipient
+    of `alerter` one digest of everything addressed to it, merged by
+    host and severity. With a `topic`, monitoring alerts go out as
+    one publish to the topic, whose subscribers replace the
+    per-phone SMS of monitor-only recipients. Stands in for the
+    alerter otherwise."""
+    SEVERITY = {SmsAlerter.SYS_LIST: "system",
+                SmsAlerter.MON_LIST: "monitor",
+                SmsAlerter.ALL_LIST: "all"}
+    HOST = re.compile(r"\[T://([^/\]]+)")
+
+    def __init__(self, alerter, window=60, topic=None, maxLength=1600):
+        self._alerter   = alerter
+        self._window    = window
+        self._topic     = topic
+        self._maxlength = maxLength
+        self._pending   = []
+        self._lock      = Lock()
+        self._timer     = None
+        self._stats     = {"alerts": 0, "digests": 0, "sends": 0}
+
+    def __getattr__(self, name):
+        return getattr(self._alerter, name)
+
+    def stats(self):
+        return dict(self._stats)
+
     def alert(self, distributionList, msg):
-        for g, r in self._recipients.values():
-            if (g & distributionList) == g:
-                r.sendMsg(msg)
+        m = AlertDigest.HOST.search(msg)
+        host = m.group(1) if m else "unknown"
+        with self._lock:
+            self._pending.append((distributionList, host, msg))
+            self._stats["alerts"] += 1
+            if self._timer is None:
+                self._timer = Timer(self._window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
 
     def alertAll(self, msg):
         self.alert(SmsAlerter.ALL_LIST, msg)
@@ -93,5 +422,68 @@ class SmsAlerter(object):
     def alertMon(self, msg):
         self.alert(SmsAlerter.MON_LIST, msg)
 
+    def format(self, items):
+        """One message for `items`, grouped by host and severity with
+        repeats counted."""
+        groups = {}
+        for d, host, msg in items:
+            k = (host, AlertDigest.SEVERITY.get(d, str(d)))
+            groups.setdefault(k, []).append(msg)
+        lines = []
+        for (host, severity), msgs in sorted(groups.items()):
+            lines.append("{} {} alerts on {}:".format(len(msgs), severity, host))
+            seen = []
+            for m in msgs:
+                if m not in seen:
+                    seen.append(m)
+            for m in seen:
+                n = msgs.count(m)
+                lines.append("- {}{}".format(m, " (x{})".format(n) if n > 1 else ""))
+        digest = "\n".join(lines)
+        if len(digest) > self._maxlength:
+            digest = digest[:self._maxlength - 15] + "... (truncated)"
+        return digest
 
+    def flush(self):
+        """Send the digests now; returns the number of sends."""
+        with self._lock:
+            items, self._pending = self._pending, []
+            self._timer = None
+        if not items:
+            return 0
+        self._stats["digests"] += 1
+        sends = 0
+        if self._topic is not None:
+            topical = [i for i in items
+                       if (SmsAlerter.MON_LIST & i[0]) == SmsAlerter.MON_LIST]
+            if topical:
+                digest = self.format(topical)
+                ## one failed send must not drop the other digests.
+                try:
+                    self._topic.publish(
+                        "thermodog: {} alerts".format(len(topical)), digest)
+                    sends += 1
+                except Exception as e:
+                    log.error("Failed to publish digest to {}: {}".format(
+                        self._topic, e))
+        for g, r in self._alerter.recipients():
+            if self._topic is not None and g == SmsAlerter.MON_LIST:
+                continue
+            mine = [i for i in items if (g & i[0]) == g]
+            if mine:
+                try:
+                    self._alerter.send(r, self.format(mine))
+                    sends += 1
+                except Exception as e:
+                    log.error("Failed to send digest to {}: {}".format(r, e))
+        self._stats["sends"] += sends
+        log.info("Sent {} alerts as {} digest messages.".format(len(items), sends))
+        return sends
 
+    def stop(self):
+        with self._lock:
+            timer = self._timer
+        if timer is not None:
+            timer.cancel()
+            timer.join(1)
+        self.flush()
@@ -0,0 +1,318 @@
+##
+## Fleet mode: dogs stream readings over UDP to one aggregator, which
+## forwards them to CloudWatch in batches and evaluates alarms across
+## the fleet.
+##
+## A datagram is a JSON object {"dog", "boot", "base", "readings":
+## [...]}; each reading carries a sequence number, unique per dog and
+## boot, and `base` is the lowest the dog still holds, everything
+## before it acknowledged or given up on. The aggregator replies
+## {"boot", "ack": n}, acknowledging every reading up to `n`; the dog
+## resends the rest with its next flush, and the aggregator drops
+## readings it has seen.
+##
+import json
+import time
+import random
+import socket
+import logging
+
+from collections import deque
+from threading import Thread, Lock, Event
+
+from .monitor import SensorHub, startTask
+from .cloudwatch import epochSeconds, epochToUtc
+from .common import pstIso
+
+log = logging.getLogger("thermodog")
+
+PORT     = 8649
+MAX_SIZE = 8192
+
+def parseAddress(s, port=PORT):
+    """(host, port) of 'host[:port]'."""
+    host, _, p = s.partition(":")
+    return host or "127.0.0.1", int(p) if p else port
+
+class FleetClient(object):
+    """Send the readings of attached sensors to the aggregator at
+    `address` every `interval` seconds. Unacknowledged readings are
+    resent, up to `maxPending`, the oldest dropped beyond that."""
+    def __init__(self, address, dog, interval=5, maxPending=2000,
+                 perDatagram=40):
+        self._address  = address
+        self._dog      = dog
+        self._boot     = "{:x}".format(random.getrandbits(32))
+        self._seq      = 0
+        self._pending  = deque(maxlen=maxPending)
+        self._perdgram = perDatagram
+        self._lock     = Lock()
+        self._subs     = []
+        self._sock     = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("", 0))
+        self._sock.settimeout(1)
+        self._finished = Event()
+        self._stats    = {"readings": 0, "datagrams": 0, "acked": 0,
+                          "errors": 0}
+        self._receiver = Thread(target=self._receive)
+        self._receiver.daemon = True
+        self._receiver.start()
+        self._task = startTask(self.flush, interval)
+
+    @property
+    def boot(self):
+        return self._boot
+
+    def stats(self):
+        with self._lock:
+            d = dict(self._stats)
+            d["pending"] = len(self._pending)
+        return d
+
+    def attach(self, sensor, freq=60):
+        """Stream the readings of `sensor` every `freq` seconds."""
+        def fx(evt):
+            self.add(sensor.name, evt)
+        self._subs.append(SensorHub.forSensor(sensor).subscribe(fx, freq=freq))
+        return self
+
+    def add(self, sensor, evt):
+        with self._lock:
+            self._seq += 1
+            self._pending.append({
+                "seq": self._seq, "sensor": sensor,
+                "channel": evt.get("channel"),
+                "ts": epochSeconds(evt["timestamp"]),
+                "celsius": evt["celsius"]})
+            self._stats["readings"] += 1
+
+    def flush(self):
+        with self._lock:
+            readings = list(self._pending)
+        if not readings:
+            return
+        base = readings[0]["seq"]
+        for i in range(0, len(readings), self._perdgram):
+            msg = json.dumps({"dog": self._dog, "boot": self._boot,
+                              "base": base,
+                              "readings": readings[i:i + self._perdgram]})
+            try:
+                self._sock.sendto(msg.encode("utf-8"), self._address)
+                self._stats["datagrams"] += 1
+            except (socket.error, OSError) as e:
+                self._stats["errors"] += 1
+                log.warning("Failed to send readings to {}: {}".format(
+                    self._address, e))
+                return
+
+    def _receive(self):
+        while not self._finished.is_set():
+            try:
+                data, _ = self._sock.recvfrom(MAX_SIZE)
+                msg = json.loads(data.decode("utf-8"))
+            except socket.timeout:
+                continue
+            except (socket.error, OSError, ValueError):
+                if self._finished.is_set():
+                    return
+                continue
+            if msg.get("boot") != self._boot:
+                continue
+            with self._lock:
+                while self._pending and self._pending[0]["seq"] <= msg["ack"]:
+                    self._pending.popleft()
+                    self._stats["acked"] += 1
+
+    def stop(self):
+        for s in self._subs:
+            s.cancel()
+        self._task.stop()
+        self.flush()
+        self._finished.set()
+        self._receiver.join(2)
+        self._sock.close()
+
+class _Stream(object):
+    """Sequence numbers received from one dog since it booted: all up
+    to `acked`, plus those seen beyond it, bounded by `window`."""
+    def __init__(self, window):
+        self.acked  = 0
+        self.ahead  = set()
+        self.window = window
+
+    def skipTo(self, base):
+        """Take everything before `base` as acknowledged: the dog no
+        longer holds it, e.g., after this aggregator restarted or the
+        dog dropped its oldest pending readings."""
+        if base - 1 > self.acked:
+            self.acked = base - 1
+            self.ahead = set(s for s in self.ahead if s > self.acked)
+            self._advance()
+
+    def accept(self, seq):
+        """True the first time `seq` is seen."""
+        if seq <= self.acked or seq in self.ahead:
+            return False
+        self.ahead.add(seq)
+        self._advance()
+        if len(self.ahead) > self.window:
+            ## give up on readings lost for good.
+            self.acked = min(self.ahead)
+            self.ahead.remove(self.acked)
+            self._advance()
+        return True
+
+    def _advance(self):
+        while self.acked + 1 in self.ahead:
+            self.acked += 1
+            self.ahead.remove(self.acked)
+
+class FleetAlarm(object):
+    """Evaluate the latest readings of the whole fleet: alert when a
+    dog has sent nothing for `stale` seconds, and when at least
+    `quorum` sensors are outside (`minc`, `maxc`) at once, e.g., a
+    room or building failure rather than one fridge."""
+    def __init__(self, alerter, minc=None, maxc=None, quorum=2,
+                 stale=5*60):
+        self._alerter = alerter
+        self._minc    = minc
+        self._maxc    = maxc
+        self._quorum  = quorum
+        self._stale   = stale
+        self._silent  = set()
+        self._alarmed = False
+
+    def outOfRange(self, celsius):
+        return (self._minc is not None and celsius < self._minc) or \
+            (self._maxc is not None and celsius > self._maxc)
+
+    def evaluate(self, latest, seen, now=None):
+        """`latest` maps (dog, sensor) to (ts, celsius), `seen` maps
+        dogs to when they were last heard from."""
+        now = time.time() if now is None else now
+        for dog, t in seen.items():
+            if now - t > self._stale and dog not in self._silent:
+                self._silent.add(dog)
+                self._alerter.alertSys(
+                    "[fleet] {} silent since {}.".format(
+                        dog, pstIso(epochToUtc(t))))
+            elif now - t <= self._stale and dog in self._silent:
+                self._silent.discard(dog)
+                self._alerter.alertSys("[fleet] {} is back.".format(dog))
+        out = sorted("{}/{} {:.1f}C".format(d, s, c)
+                     for (d, s), (t, c) in latest.items()
+                     if now - t <= self._stale and self.outOfRange(c))
+        if len(out) >= self._quorum and not self._alarmed:
+            self._alarmed = True
+            self._alerter.alertAll(
+                "[fleet] {} sensors out of range: {}.".format(
+                    len(out), ", ".join(out)))
+        elif len(out) < self._quorum:
+            self._alarmed = False
+        return out
+
+class FleetAggregator(object):
+    """Receive readings on `address`, drop duplicates, forward each new
+    reading to `publisher` as the `Temperature` metric of its sensor
+    and evaluate `alarms` every `freq` seconds."""
+    NAMESPACE = "Wholebiome/Thermodog"
+
+    def __init__(self, address=("127.0.0.1", PORT), publisher=None,
+                 alarms=(), freq=30, window=4096):
+        self._publisher = publisher
+        self._alarms    = list(alarms)
+        self._window    = window
+        self._streams   = {}
+        self._latest    = {}
+        self._seen      = {}
+        self._lock      = Lock()
+        self._stats     = {"datagrams": 0, "readings": 0, "duplicates": 0,
+                           "invalid": 0}
+        self._sock      = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(address)
+        self._sock.settimeout(1)
+        self._finished  = Event()
+        self._thread    = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        self._task = startTask(self.evaluate, freq) if self._alarms else None
+
+    @property
+    def address(self):
+        return self._sock.getsockname()
+
+    def stats(self):
+        with self._lock:
+            d = dict(self._stats)
+            d["dogs"] = len(self._seen)
+        return d
+
+    def latest(self):
+        """(dog, sensor) to the (ts, celsius) last received."""
+        with self._lock:
+            return dict(self._latest)
+
+    def _run(self):
+        while not self._finished.is_set():
+            try:
+                data, peer = self._sock.recvfrom(MAX_SIZE)
+            except socket.timeout:
+                continue
+            except (socket.error, OSError):
+                if self._finished.is_set():
+                    return
+                continue
+            try:
+                ack = self.receive(json.loads(data.decode("utf-8")))
+                self._sock.sendto(json.dumps(ack).encode("utf-8"), peer)
+            except (ValueError, KeyError, TypeError) as e:
+                self._stats["invalid"] += 1
+                log.warning("Invalid datagram from {}: {}".format(peer, e))
+            except (socket.error, OSError) as e:
+                log.warning("Failed to ack {}: {}".format(peer, e))
+
+    def receive(self, msg):
+        """Take the readings of one datagram; returns its ack."""
+        dog, boot = msg["dog"], msg["boot"]
+        fresh = []
+        with self._lock:
+            self._stats["datagrams"] += 1
+            stream = self._streams.get(dog)
+            if stream is None or stream[0] != boot:
+                stream = (boot, _Stream(self._window))
+                self._streams[dog] = stream
+            self._seen[dog] = time.time()
+            if "base" in msg:
+                stream[1].skipTo(int(msg["base"]))
+            for r in msg["readings"]:
+                if not stream[1].accept(int(r["seq"])):
+                    self._stats["duplicates"] += 1
+                    continue
+                fresh.append(r)
+                key = (dog, r["sensor"])
+                if key not in self._latest or self._latest[key][0] <= r["ts"]:
+                    self._latest[key] = (r["ts"], r["celsius"])
+            self._stats["readings"] += len(fresh)
+            acked = stream[1].acked
+        if self._publisher:
+            for r in fresh:
+                self._publisher.put(
+                    FleetAggregator.NAMESPACE,
+                    {"MetricName": "Temperature",
+                     "Dimensions": [{"Name": "MonitorName",
+                                     "Value": r["sensor"]}]},
+                    round(r["celsius"]), epochToUtc(r["ts"]))
+        return {"boot": boot, "ack": acked}
+
+    def evaluate(self):
+        with self._lock:
+            latest, seen = dict(self._latest), dict(self._seen)
+        for a in self._alarms:
+            a.evaluate(latest, seen)
+
+    def stop(self):
+        if self._task:
+            self._task.stop()
+        self._finished.set()
+        self._thread.join(2)
+        self._sock.close()
@@ -0,0 +1,167 @@
+##
+## Binary framed streaming of ADC samples, as sent by
+## etc/arduino/analog-bus-binary. A frame is, little-endian:
+##
+##   sync    2 bytes   0xA5 0x5A
+##   seq     uint16    frame counter, wrapping
+##   n       uint8     number of channels
+##   samples n uint16  ADC counts of channels 1..n
+##   crc     uint16    CRC-16/CCITT-FALSE of seq, n and samples
+##
+## Frames are decoded in bulk: sync candidates are located, sliced and
+## checked with numpy across all frames at once, one step per byte
+## position of a frame rather than per byte received.
+##
+import logging
+import numpy
+
+log = logging.getLogger("thermodog")
+
+SYNC   = (0xA5, 0x5A)
+HEADER = 5
+SEQ_MOD = 1 << 16
+
+## the serial speed and frames per second of etc/arduino/analog-bus-binary.
+FRAME_BAUD = 115200
+FRAME_RATE = 400
+
+def _crcTable():
+    table = numpy.zeros(256, dtype=numpy.uint16)
+    for i in range(256):
+        c = i << 8
+        for _ in range(8):
+            c = ((c << 1) ^ 0x1021) if c & 0x8000 else (c << 1)
+        table[i] = c & 0xFFFF
+    return table
+
+CRC_TABLE = _crcTable()
+
+def crc16(frames):
+    """CRC-16/CCITT-FALSE of each row of `frames`, a 2-D uint8 array."""
+    frames = numpy.atleast_2d(frames)
+    crc = numpy.full(frames.shape[0], 0xFFFF, dtype=numpy.uint16)
+    for j in range(frames.shape[1]):
+        crc = (crc << 8) ^ CRC_TABLE[(crc >> 8) ^ frames[:, j]]
+    return crc
+
+def frameSize(channels):
+    return HEADER + 2*channels + 2
+
+def encodeFrames(seq, samples):
+    """The bytes of frames carrying the rows of `samples`, frames x
+    channels counts, numbered from `seq`."""
+    samples = numpy.atleast_2d(numpy.asarray(samples, dtype="<u2"))
+    k, n = samples.shape
+    frames = numpy.zeros((k, frameSize(n)), dtype=numpy.uint8)
+    frames[:, 0], frames[:, 1] = SYNC
+    seqs = ((seq + numpy.arange(k)) % SEQ_MOD).astype("<u2")
+    frames[:, 2:4] = seqs.view(numpy.uint8).reshape(k, 2)
+    frames[:, 4] = n
+    frames[:, HEADER:-2] = samples.view(numpy.uint8).reshape(k, 2*n)
+    crc = crc16(frames[:, 2:-2]).astype("<u2")
+    frames[:, -2:] = crc.view(numpy.uint8).reshape(k, 2)
+    return frames.tobytes()
+
+class FrameDecoder(object):
+    """Decode frames of `channels` samples from a byte stream fed in
+    arbitrary chunks. Counts frames whose CRC fails as corrupt, bytes
+    between frames as skipped, and gaps in the sequence as dropped."""
+    def __init__(self, channels, maxBuffer=64*1024):
+        self._channels  = channels
+        self._size      = frameSize(channels)
+        self._maxbuffer = maxBuffer
+        self._buf       = bytearray()
+        self._lastseq   = None
+        self._stats     = {"frames": 0, "corrupt": 0, "dropped": 0,
+                           "skipped": 0}
+
+    @property
+    def channels(self):
+        return self._channels
+
+    @property
+    def frameSize(self):
+        return self._size
+
+    def stats(self):
+        return dict(self._stats)
+
+    def decode(self, data):
+        """Sequence numbers and frames x channels samples of the whole
+        frames in `data` and the bytes held over from earlier calls."""
+        self._buf += data
+        size = self._size
+        a = numpy.frombuffer(bytes(self._buf), dtype=numpy.uint8)
+        last = len(a) - size
+        if last < 0:
+            return self._empty()
+        starts = numpy.flatnonzero((a[:last + 1] == SYNC[0]) &
+                                   (a[1:last + 2] == SYNC[1]) &
+                                   (a[4:last + 5] == self._channels))
+        frames = a[starts[:, None] + numpy.arange(size)]
+        crc = frames[:, -2].astype(numpy.uint16) | \
+            (frames[:, -1].astype(numpy.uint16) << 8)
+        ok = crc16(frames[:, 2:-2]) == crc
+        failed = starts[~ok]
+        starts, frames = starts[ok], frames[ok]
+        if len(starts) > 1 and (numpy.diff(starts) < size).any():
+            ## a sync word inside a frame with a matching CRC; rare,
+            ## so resolved one frame at a time.
+            keep, end = [], 0
+            for i, s in enumerate(starts):
+                if s >= end:
+                    keep.append(i)
+                    end = s + size
+            starts, frames = starts[keep], frames[keep]
+        ## a failed candidate inside a good frame is just payload.
+        i = numpy.searchsorted(starts, failed, "right") - 1
+        inside = (i >= 0) & (failed < starts[numpy.maximum(i, 0)] + size) \
+            if len(starts) else numpy.zeros(len(failed), dtype=bool)
+        self._stats["corrupt"] += int((~inside).sum())
+        ## hold over what may still be the start of a frame.
+        consumed = last + 1
+        if len(starts):
+            consumed = max(consumed, starts[-1] + size)
+        self._stats["skipped"] += consumed - len(starts)*size
+        del self._buf[:consumed]
+        if len(self._buf) > self._maxbuffer:
+            del self._buf[:-self._maxbuffer]
+        if not len(starts):
+            return self._empty()
+        seqs = frames[:, 2].astype(numpy.int64) | \
+            (frames[:, 3].astype(numpy.int64) << 8)
+        samples = numpy.ascontiguousarray(frames[:, HEADER:-2]).view("<u2")
+        self._count(seqs)
+        return seqs, samples
+
+    def _count(self, seqs):
+        prev = numpy.r_[self._lastseq if self._lastseq is not None
+                        else seqs[0] - 1, seqs[:-1]]
+        self._stats["dropped"] += int(((seqs - prev - 1) % SEQ_MOD).sum())
+        self._stats["frames"] += len(seqs)
+        self._lastseq = int(seqs[-1])
+
+    def _empty(self):
+        return (numpy.zeros(0, dtype=numpy.int64),
+                numpy.zeros((0, self._channels), dtype="<u2"))
+
+class Decimator(object):
+    """Average every `factor` frames into one reading per channel,
+    holding partial blocks over to the next call."""
+    def __init__(self, factor):
+        self._factor  = max(1, int(factor))
+        self._pending = None
+
+    @property
+    def factor(self):
+        return self._factor
+
+    def add(self, samples):
+        """Readings, blocks x channels means, of the complete blocks."""
+        samples = numpy.asarray(samples, dtype=numpy.float64)
+        if self._pending is not None and len(self._pending):
+            samples = numpy.concatenate([self._pending, samples])
+        k = (len(samples) // self._factor) * self._factor
+        self._pending = samples[k:]
+        return samples[:k].reshape(-1, self._factor, samples.shape[1]) \
+            .mean(axis=1)
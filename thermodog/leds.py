@@ -0,0 +1,166 @@
+##
+## One timer loop driving every status LED.
+##
+import time
+import heapq
+import logging
+
+from threading import Thread, Condition
+
+log = logging.getLogger("thermodog")
+
+class LedController(object):
+    """Play LED patterns, sequences of (level, seconds) steps, from a
+    single timer loop: a thread of its own or, with the asyncio
+    runtime installed, the event loop. A step lasting `None` seconds
+    holds until the next pattern. Starting and stopping patterns only
+    updates a table and never waits on the loop. The loop also runs
+    one-shot timers, see `after`."""
+    ## set by `thermodog.aio.AsyncRuntime.install`.
+    runtime = None
+
+    ON        = ((1, None),)
+    OFF       = ((0, None),)
+    HEARTBEAT = ((1, .1), (0, .15), (1, .1), (0, .65))
+
+    @staticmethod
+    def blinking(f=1, d=.1):
+        return ((1, d), (0, f))
+
+    @staticmethod
+    def flashing(d=.1):
+        return ((1, d), (0, None))
+
+    def __init__(self, setLevel):
+        self._setlevel = setLevel
+        self._states   = {}
+        self._heap     = []
+        self._timers   = {}
+        self._due      = []
+        self._gen      = 0
+        self._cond     = Condition()
+        self._finished = False
+        self._thread   = None
+        self._handle   = None
+        self._loop     = LedController.runtime.loop \
+                         if LedController.runtime else None
+        if self._loop is None:
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def play(self, pin, pattern, repeat=False):
+        """Start `pattern` on `pin`, replacing whatever was playing."""
+        with self._cond:
+            self._gen += 1
+            level, dur = pattern[0]
+            self._states[pin] = [pattern, 0, self._gen, repeat]
+            self._setlevel(pin, level)
+            if dur is not None:
+                heapq.heappush(self._heap, (time.time() + dur, self._gen, pin))
+                self._wake()
+
+    def after(self, seconds, fx):
+        """Call `fx()` on the loop in `seconds`. It is called outside
+        the controller's lock, but patterns are held while it runs."""
+        with self._cond:
+            self._gen += 1
+            self._timers[self._gen] = fx
+            heapq.heappush(self._heap, (time.time() + seconds, self._gen, None))
+            self._wake()
+
+    def stop(self, pin):
+        """Turn `pin` off; True if a timed pattern was playing."""
+        with self._cond:
+            st = self._states.pop(pin, None)
+            self._setlevel(pin, 0)
+            return st is not None and self._timed(st)
+
+    def running(self, pin):
+        with self._cond:
+            st = self._states.get(pin)
+            return st is not None and self._timed(st)
+
+    def _timed(self, st):
+        pattern, i, gen, repeat = st
+        return pattern[i][1] is not None
+
+    def _step(self, now):
+        """Apply due steps; seconds until the next one, or None."""
+        while self._heap and self._heap[0][0] <= now:
+            t, gen, pin = heapq.heappop(self._heap)
+            if pin is None:
+                ## a timer, called once the lock is released.
+                self._due.append(self._timers.pop(gen))
+                continue
+            st = self._states.get(pin)
+            if st is None or st[2] != gen:
+                ## replaced or stopped since scheduled.
+                continue
+            pattern, i, _, repeat = st
+            i += 1
+            if i == len(pattern):
+                if not repeat:
+                    del self._states[pin]
+                    continue
+                i = 0
+            st[1] = i
+            level, dur = pattern[i]
+            self._setlevel(pin, level)
+            if dur is not None:
+                heapq.heappush(self._heap, (t + dur, gen, pin))
+        if self._heap:
+            return max(0, self._heap[0][0] - now)
+        return None
+
+    def _wake(self):
+        if self._loop is None:
+            self._cond.notify()
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._kick)
+
+    def _call(self, calls):
+        for fx in calls:
+            try:
+                fx()
+            except Exception as e:
+                log.exception(e)
+
+    def _kick(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        with self._cond:
+            if self._finished:
+                return
+            wait = self._step(time.time())
+            calls, self._due = self._due, []
+        self._call(calls)
+        if wait is not None:
+            self._handle = self._loop.call_later(wait, self._kick)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._finished:
+                    return
+                wait = self._step(time.time())
+                calls, self._due = self._due, []
+                if not calls:
+                    self._cond.wait(wait)
+            ## steps again at once, so no wakeup is missed.
+            self._call(calls)
+
+    def shutdown(self):
+        with self._cond:
+            self._finished = True
+            self._states = {}
+            self._heap = []
+            self._timers = {}
+            self._due = []
+            if self._loop is None:
+                self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(1)
+        if self._handle is not None:
+            self._handle.cancel()
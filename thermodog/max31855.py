@@ -0,0 +1,101 @@
+##
+## Encoding and decoding of MAX31855 frames, one at a time or in
+## bulk, e.g., for oversampling or reprocessing raw captures.
+##
+import numpy
+
+## fault bits, D0-D2, and the summary fault bit, D16.
+OC      = 1
+SCG     = 2
+SCV     = 4
+UNKNOWN = 8
+FAULT   = 0x10000
+
+FAULTS = {
+    OC:      "No Connection",
+    SCG:     "Thermocouple short to ground",
+    SCV:     "Thermocouple short to VCC",
+    # Perhaps another SPI device is trying to send data?
+    # Did you remember to initialize all other SPI devices?
+    UNKNOWN: "Unknown Error"
+}
+
+class Max31855Fault(Exception):
+    """A faulted frame; `code` is one of OC, SCG, SCV or UNKNOWN. The
+    message is that of FAULTS, as before these were typed."""
+    code = UNKNOWN
+
+    def __init__(self, msg=None, channel=None):
+        super(Max31855Fault, self).__init__(msg if msg else FAULTS[self.code])
+        self.channel = channel
+
+class OpenCircuit(Max31855Fault):
+    code = OC
+
+class ShortToGround(Max31855Fault):
+    code = SCG
+
+class ShortToVcc(Max31855Fault):
+    code = SCV
+
+class UnknownFault(Max31855Fault):
+    code = UNKNOWN
+
+FAULT_TYPES = {OC: OpenCircuit, SCG: ShortToGround, SCV: ShortToVcc,
+               UNKNOWN: UnknownFault}
+
+def fault(code, channel=None):
+    """The exception of fault `code`."""
+    return FAULT_TYPES.get(int(code), UnknownFault)(channel=channel)
+
+def faultCode(data_32):
+    """0 for a valid frame, else one of OC, SCG, SCV or UNKNOWN."""
+    if not data_32 & FAULT:
+        return 0
+    for f in (OC, SCG, SCV):
+        if data_32 & f:
+            return f
+    return UNKNOWN
+
+def tcpart(data_32):
+    """Thermocouple temperature, D31-D18, in celsius."""
+    tc_data = ((data_32 >> 18) & 0x3FFF)
+    if tc_data & 0x2000:
+        tc_data -= 0x4000
+    return tc_data * 0.25
+
+def rjpart(data_32):
+    """Cold-junction temperature, D15-D4, in celsius."""
+    rj_data = ((data_32 >> 4) & 0xFFF)
+    if rj_data & 0x800:
+        rj_data -= 0x1000
+    return rj_data * 0.0625
+
+def encodeFrame(celsius, internal=25.0, fault=0):
+    """Encode a 32-bit frame; `fault` is a combination of OC, SCG
+    and SCV."""
+    tc = int(round(celsius / 0.25)) & 0x3FFF
+    rj = int(round(internal / 0.0625)) & 0xFFF
+    frame = (tc << 18) | (rj << 4)
+    if fault:
+        frame |= FAULT | (fault & 0x7)
+    return frame
+
+def decodeFrames(frames):
+    """Decode an array of raw frames in one pass. Returns arrays of
+    thermocouple celsius, cold-junction celsius and fault codes; both
+    temperatures are NaN for faulted frames."""
+    f = numpy.asarray(frames, dtype=numpy.uint32).astype(numpy.int64)
+    tc = (f >> 18) & 0x3FFF
+    tc = numpy.where(tc & 0x2000, tc - 0x4000, tc) * 0.25
+    rj = (f >> 4) & 0xFFF
+    rj = numpy.where(rj & 0x800, rj - 0x1000, rj) * 0.0625
+    faults = numpy.where(
+        (f & FAULT) == 0, 0,
+        numpy.where(f & OC, OC,
+                    numpy.where(f & SCG, SCG,
+                                numpy.where(f & SCV, SCV, UNKNOWN))))
+    bad = faults != 0
+    tc[bad] = numpy.nan
+    rj[bad] = numpy.nan
+    return tc, rj, faults.astype(numpy.uint8)
@@ -0,0 +1,301 @@
+##
+## Counters, gauges and histograms of readings and internals, served
+## as OpenMetrics text over HTTP for a local Prometheus scraper.
+##
+## Updates take no lock: each labelled series is a small list updated
+## in place, and a series is, in practice, only written by the thread
+## acquiring for its sensor. Locks are taken only to create a series
+## and to render a scrape.
+##
+import bisect
+import logging
+import threading
+import numpy
+
+from threading import Lock, Thread
+
+from . import max31855
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+log = logging.getLogger("thermodog")
+
+OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS  = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(v):
+    return "{}".format(v).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, _escape(v))
+                          for k, v in pairs) + "}"
+
+def _number(v):
+    if v != v:
+        return "NaN"
+    if v in (float("inf"), float("-inf")):
+        return "+Inf" if v > 0 else "-Inf"
+    return repr(float(v)) if isinstance(v, float) else "{}".format(v)
+
+class Metric(object):
+    """A named family of series, one per combination of `labels`."""
+    TYPE = None
+
+    def __init__(self, name, help, labels=()):
+        self._name   = name
+        self._help   = help
+        self._labels = tuple(labels)
+        self._series = {}
+        self._lock   = Lock()
+
+    @property
+    def name(self):
+        return self._name
+
+    def _new(self):
+        return [0]
+
+    def _get(self, values):
+        s = self._series.get(values)
+        if s is None:
+            with self._lock:
+                s = self._series.setdefault(values, self._new())
+        return s
+
+    def labels(self, *values):
+        return _Child(self, tuple("{}".format(v) for v in values))
+
+    def remove(self, *values):
+        with self._lock:
+            self._series.pop(tuple("{}".format(v) for v in values), None)
+
+    def _samples(self, openMetrics):
+        """(suffix, labels, value) of every series."""
+        with self._lock:
+            series = sorted(self._series.items())
+        for values, s in series:
+            yield "", _labels(self._labels, values), s[0]
+
+    def render(self, openMetrics=True):
+        lines = ["# HELP {} {}".format(self._name, self._help),
+                 "# TYPE {} {}".format(self._name, self.TYPE)]
+        for suffix, labels, v in self._samples(openMetrics):
+            lines.append("{}{}{} {}".format(self._name, suffix, labels,
+                                            _number(v)))
+        return lines
+
+class _Child(object):
+    """One series of a metric, e.g., `FAULTS.labels(1, "open-circuit")`."""
+    def __init__(self, metric, values):
+        self._metric = metric
+        self._series = metric._get(values)
+
+    def inc(self, amount=1):
+        self._series[0] += amount
+
+    def set(self, v):
+        self._series[0] = v
+
+    def observe(self, v):
+        self._metric._observe(self._series, v)
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def __init__(self, name, help, labels=(), fx=None):
+        """With `fx`, the count is `fx()` at scrape time."""
+        ## OpenMetrics names the family without, and samples with, _total.
+        if name.endswith("_total"):
+            name = name[:-len("_total")]
+        super(Counter, self).__init__(name, help, labels)
+        self._fx = fx
+
+    def render(self, openMetrics=True):
+        lines = super(Counter, self).render(openMetrics)
+        if not openMetrics:
+            lines[1] = "# TYPE {}_total counter".format(self._name)
+            lines[0] = "# HELP {}_total {}".format(self._name, self._help)
+        return lines
+
+    def _samples(self, openMetrics):
+        if self._fx is not None:
+            yield "_total", "", self._fx()
+            return
+        for _, labels, v in super(Counter, self)._samples(openMetrics):
+            yield "_total", labels, v
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def __init__(self, name, help, labels=(), fx=None):
+        """With `fx`, the value is `fx()` at scrape time."""
+        super(Gauge, self).__init__(name, help, labels)
+        self._fx = fx
+
+    def _samples(self, openMetrics):
+        if self._fx is not None:
+            yield "", "", self._fx()
+            return
+        for s in super(Gauge, self)._samples(openMetrics):
+            yield s
+
+class Histogram(Metric):
+    """Counts of observations at most each of `buckets`, plus their
+    count and sum; memory is fixed per series."""
+    TYPE = "histogram"
+    DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self._bounds = tuple(sorted(buckets))
+
+    def _new(self):
+        ## counts per bucket, the last for +Inf, then count and sum.
+        return [0] * (len(self._bounds) + 1) + [0, 0.0]
+
+    def _observe(self, s, v):
+        s[bisect.bisect_left(self._bounds, v)] += 1
+        s[-2] += 1
+        s[-1] += v
+
+    def _samples(self, openMetrics):
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        n = len(self._bounds)
+        for values, s in series:
+            cumulative = 0
+            for i, le in enumerate(self._bounds + (float("inf"),)):
+                cumulative += s[i]
+                yield "_bucket", _labels(self._labels, values,
+                                         [("le", _number(float(le)))]), \
+                    cumulative
+            yield "_count", _labels(self._labels, values), s[n + 1]
+            yield "_sum", _labels(self._labels, values), s[n + 2]
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._metrics = []
+        self._lock    = Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), fx=None):
+        return self.register(Counter(name, help, labels, fx))
+
+    def gauge(self, name, help, labels=(), fx=None):
+        return self.register(Gauge(name, help, labels, fx))
+
+    def histogram(self, name, help, labels=(), **args):
+        return self.register(Histogram(name, help, labels, **args))
+
+    def exposition(self, openMetrics=True):
+        """The text of every metric, as a scraper reads it."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            try:
+                lines.extend(m.render(openMetrics))
+            except Exception as e:
+                log.warning("Failed to render metric {}: {}".format(m.name, e))
+        if openMetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+## the registry used throughout thermodog, and its metrics.
+registry = MetricsRegistry()
+
+READING = registry.gauge(
+    "thermodog_reading_celsius", "Latest reading of each sensor.",
+    ["sensor"])
+READ_SECONDS = registry.histogram(
+    "thermodog_read_seconds", "Time taken to acquire a reading.",
+    ["sensor"], buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+FAULTS = registry.counter(
+    "thermodog_faults", "Faulted MAX31855 frames, by fault bit.",
+    ["channel", "fault"])
+CONSECUTIVE_FAILURES = registry.gauge(
+    "thermodog_monitor_consecutive_failures",
+    "Consecutive failures of each sensor monitor.", ["sensor", "monitor"])
+AWS_SECONDS = registry.histogram(
+    "thermodog_aws_call_seconds", "Time taken by AWS calls.",
+    ["service", "operation"])
+AWS_ERRORS = registry.counter(
+    "thermodog_aws_call_errors", "Failed AWS calls.",
+    ["service", "operation"])
+THREADS = registry.gauge(
+    "thermodog_threads", "Live threads in this process.",
+    fx=threading.active_count)
+
+_FAULT_BITS = ((max31855.OC, "open-circuit"), (max31855.SCG, "short-to-gnd"),
+               (max31855.SCV, "short-to-vcc"), (max31855.UNKNOWN, "unknown"))
+
+def countFaults(channel, faults):
+    """Count the faulted frames among `faults`, codes as returned by
+    `max31855.decodeFrames`."""
+    faults = numpy.asarray(faults)
+    if not faults.any():
+        return
+    for bit, name in _FAULT_BITS:
+        n = int((faults == bit).sum())
+        if n:
+            FAULTS.labels(channel, name).inc(n)
+
+def observeAws(service, operation, seconds, ok):
+    """A `thermodog.aws.ClientRegistry` listener."""
+    AWS_SECONDS.labels(service, operation).observe(seconds)
+    if not ok:
+        AWS_ERRORS.labels(service, operation).inc()
+
+def watchLimiter(limiter):
+    """Expose the sends a `RateLimiter` has suppressed, in total;
+    its keys are phone numbers and topics."""
+    return registry.counter(
+        "thermodog_sms_suppressed_total", "Alerts suppressed by rate limits.",
+        fx=limiter.suppressed)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        om = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = self.server.registry.exposition(om).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS if om else PROMETHEUS)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug("metrics: " + fmt % args)
+
+class MetricsServer(object):
+    """Serve `registry` at http://`address`:`port`/metrics on a
+    background thread; port 0 picks a free port."""
+    def __init__(self, port, address="", registry=registry):
+        self._httpd = HTTPServer((address, port), _Handler)
+        self._httpd.registry = registry
+        self._thread = Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        log.info("Serving metrics on port {}.".format(self.port))
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join(2)
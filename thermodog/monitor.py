@@ -1,12 +1,19 @@
 import sys
 import numpy
+import random
 import logging
 import time
+import warnings
 from threading import Thread, Lock, Event
 
 from .coms import SnsTopic
 from .cloudwatch import CloudWatchMetric
 from .common import utcIso, pstIso
+from .stats import RunningStats, RollingStats
+from .binlog import BinaryLog
+from .compress import CompressedStream
+from . import metrics
+from . import profiling
 
 log = logging.getLogger("thermodog")
 
@@ -15,6 +22,7 @@ class TaskThread(Thread):
     def __init__(self, f, taskfreq=60*60, **args):
         Thread.__init__(self)
         self._finished = Event()
+        self._retimed  = Event()
         self._taskfreq = taskfreq
         self._taskfunc = f
         self._taskargs = args
@@ -25,13 +33,46 @@ class TaskThread(Thread):
                 return
             else:
                 self._taskfunc(**self._taskargs)
-            self._finished.wait(self._taskfreq)
+            self._wait(time.time())
+
+    def _wait(self, t0):
+        ## a shorter period cuts the current wait short.
+        while not self._finished.is_set():
+            left = t0 + self._taskfreq - time.time()
+            if left <= 0 or not self._retimed.wait(left):
+                return
+            self._retimed.clear()
+
+    @property
+    def taskfreq(self):
+        return self._taskfreq
+    @taskfreq.setter
+    def taskfreq(self, f):
+        shorter = f < self._taskfreq
+        self._taskfreq = f
+        if shorter:
+            self._retimed.set()
 
     def active(self):
         return not self._finished.is_set()
 
     def stop(self):
         self._finished.set()
+        self._retimed.set()
+
+## The runtime periodic tasks are started on; `None` runs each on its
+## own `TaskThread`, see `thermodog.aio.AsyncRuntime` for the
+## alternative.
+runtime = None
+
+def startTask(f, taskfreq):
+    """Run `f` every `taskfreq` seconds on the configured runtime,
+    returning a handle with `stop`, `active` and `taskfreq`."""
+    if runtime is not None:
+        return runtime.task(f, taskfreq)
+    t = TaskThread(f, taskfreq)
+    t.start()
+    return t
 
 class HasSensor(object):
     @property
@@ -46,52 +87,605 @@ class HasSensor(object):
     def alerter(self):
         return self.sensor.alerter
 
+class Subscription(object):
+    """A subscriber to a `SensorHub`, receiving every `every`-th
+    reading, or at most one reading per `freq` seconds."""
+    def __init__(self, hub, fx, every=1, freq=None, onError=None,
+                 follow=False):
+        self._hub       = hub
+        self._fx        = fx
+        self._every     = max(1, int(every))
+        self._freq      = freq
+        self._follow    = follow
+        self._onError   = onError
+        self._ticks     = 0
+        self._last      = None
+        self._active    = True
+
+    @property
+    def hub(self):
+        return self._hub
+    @property
+    def freq(self):
+        return self._freq
+    @property
+    def every(self):
+        return self._every
+    @property
+    def follow(self):
+        """True to receive every reading of an adaptive hub."""
+        return self._follow
+
+    def active(self):
+        return self._active
+
+    def due(self, now):
+        """Called once per hub tick; True if this tick's reading
+        should be delivered."""
+        if not self._active:
+            return False
+        self._ticks += 1
+        if self._follow and self.hub.adaptive:
+            return True
+        if self._freq is not None:
+            ## tolerate half a hub period of scheduling jitter.
+            return self._last is None or \
+                (now - self._last) >= (self._freq - self.hub.tickFreq/2.0)
+        return self._ticks >= self._every
+
+    def deliver(self, evt, now=None):
+        self._ticks = 0
+        self._last  = now if now is not None else time.time()
+        try:
+            self._fx(evt)
+        except Exception as e:
+            self.fail(e)
+
+    def fail(self, e):
+        ## a scan's failures are returned, not raised; no traceback.
+        if self._onError:
+            self._onError(e)
+        else:
+            log.error(e)
+
+    def cancel(self):
+        if self._active:
+            self._active = False
+            self.hub.unsubscribe(self)
+
+class AdaptiveSampling(object):
+    """Choose a hub's sampling period from its readings: `ceiling`
+    seconds while readings are steady and more than `margin` degrees
+    inside every bound, shrinking towards `floor` as they approach a
+    bound, or as the rate of change would reach one within
+    `horizon` samples. The period shrinks at once but grows by at most
+    `growth` per reading."""
+    def __init__(self, floor=5, ceiling=300, margin=3.0, horizon=10,
+                 growth=1.5, smoothing=.3):
+        self._floor     = float(floor)
+        self._ceiling   = float(ceiling)
+        self._margin    = margin
+        self._horizon   = horizon
+        self._growth    = growth
+        self._smoothing = smoothing
+        self._period    = self._floor
+        self._slope     = 0.0
+        self._last      = None
+
+    @property
+    def period(self):
+        return self._period
+    @property
+    def slope(self):
+        """Smoothed rate of change, degrees per second."""
+        return self._slope
+
+    def observe(self, celsius, now, bounds):
+        """Take a reading within `bounds`, (min, max) pairs; returns
+        the next period."""
+        if celsius is None or celsius != celsius:
+            return self._period
+        if self._last is not None and now > self._last[0]:
+            s = (celsius - self._last[1]) / (now - self._last[0])
+            self._slope += self._smoothing * (s - self._slope)
+        self._last = (now, celsius)
+        inside = [min(celsius - lo, hi - celsius) for lo, hi in bounds]
+        distance = min(inside) if inside else float("inf")
+        if distance <= 0:
+            target = self._floor
+        else:
+            target = self._ceiling
+            if distance < self._margin:
+                target = self._floor + (self._ceiling - self._floor) * \
+                    distance / self._margin
+            if abs(self._slope) > 0:
+                ## reach the bound in no fewer than `horizon` samples.
+                target = min(target, distance / abs(self._slope) / self._horizon)
+        target = max(self._floor, min(self._ceiling, target))
+        self._period = min(target, self._period * self._growth)
+        return self._period
+
+class CircuitBreaker(object):
+    """Guard acquisition from a failing sensor. Closed, every reading
+    is taken, a failed one retried after `base` seconds; after
+    `threshold` consecutive failures it opens and
+    readings are skipped until a retry is due, `base` seconds doubling
+    per failed retry up to `maxDelay`, less up to `jitter` of that at
+    random so sensors failing together don't retry in step. The retry
+    is taken half-open: success closes the breaker, failure reopens
+    it."""
+    CLOSED    = "closed"
+    OPEN      = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=3, base=2.0, maxDelay=5*60, jitter=.5):
+        self._threshold = threshold
+        self._base      = base
+        self._maxdelay  = maxDelay
+        self._jitter    = jitter
+        self._state     = CircuitBreaker.CLOSED
+        self._failures  = 0
+        self._retries   = 0
+        self._retryat   = 0
+
+    @property
+    def state(self):
+        return self._state
+    @property
+    def failures(self):
+        """Consecutive failures."""
+        return self._failures
+    @property
+    def retryAt(self):
+        return self._retryat
+
+    def closed(self):
+        return self._state == CircuitBreaker.CLOSED
+
+    def probing(self):
+        return self._state == CircuitBreaker.HALF_OPEN
+
+    def allow(self, now):
+        """True if a reading may be taken at `now`."""
+        if self._state == CircuitBreaker.OPEN and now >= self._retryat:
+            self._state = CircuitBreaker.HALF_OPEN
+        return self._state != CircuitBreaker.OPEN
+
+    def delay(self):
+        d = min(self._maxdelay, self._base * 2**self._retries)
+        return d * (1 - self._jitter * random.random())
+
+    def success(self):
+        """Record a reading; returns the failures it ended."""
+        failures = self._failures
+        self._state, self._failures, self._retries = \
+            CircuitBreaker.CLOSED, 0, 0
+        return failures
+
+    def failure(self, now):
+        """Record a failed reading; True if the breaker opened."""
+        self._failures += 1
+        if self._state == CircuitBreaker.HALF_OPEN:
+            self._retries += 1
+        elif self._failures < self._threshold:
+            self._retryat = now + self._base
+            return False
+        opened = self._state == CircuitBreaker.CLOSED
+        self._state = CircuitBreaker.OPEN
+        self._retryat = now + self.delay()
+        return opened
+
+    def period(self, freq, now):
+        """Seconds to the next reading: `freq`, or sooner if a retry
+        is due before then."""
+        if not self._failures:
+            return freq
+        return max(.1, min(freq, self._retryat - now))
+
+class SensorHub(HasSensor):
+    """Acquire one reading per sensor per tick and fan it out to
+    every subscriber. Hubs are shared per sensor; the tick period is
+    `freq` if given, otherwise the smallest subscriber `freq`. A
+    `CircuitBreaker` stops a failing sensor from being read every tick
+    and retries it, sooner than the period if need be, until it
+    recovers."""
+    DEFAULT_FREQ = 60
+
+    _hubs     = {}
+    _hubslock = Lock()
+    _drivers  = []
+
+    @classmethod
+    def forSensor(cls, sensor, freq=None):
+        with cls._hubslock:
+            if sensor not in cls._hubs:
+                hub = cls(sensor, freq=freq)
+                for d in cls._drivers:
+                    if d.claims(sensor):
+                        hub._driver = d
+                cls._hubs[sensor] = hub
+            return cls._hubs[sensor]
+
+    @classmethod
+    def addDriver(cls, driver):
+        with cls._hubslock:
+            cls._drivers.append(driver)
+
+    @classmethod
+    def removeDriver(cls, driver):
+        """Forget `driver`; the hubs it acquired for are left to
+        acquire on their own when next started."""
+        with cls._hubslock:
+            if driver in cls._drivers:
+                cls._drivers.remove(driver)
+            for h in cls._hubs.values():
+                if h._driver is driver:
+                    h._driver = None
+
+    @classmethod
+    def hubs(cls):
+        with cls._hubslock:
+            return list(cls._hubs.values())
+
+    def __init__(self, sensor, freq=None):
+        self._sensor  = sensor
+        self._fixed   = freq
+        self._freq    = freq if freq else SensorHub.DEFAULT_FREQ
+        self._subs    = []
+        self._lock    = Lock()
+        self._reader  = None
+        self._driver  = None
+        self._samples = 0
+        self._policy  = None
+        self._bounds  = {}
+        self._breaker = CircuitBreaker()
+
+    @property
+    def freq(self):
+        return self._freq
+
+    @property
+    def tickFreq(self):
+        """Seconds between ticks: the driver's, if it has one."""
+        driver = self._driver
+        return driver.freq if driver is not None else self._freq
+
+    @property
+    def adaptive(self):
+        return self._policy is not None
+
+    def adapt(self, policy):
+        """Let an `AdaptiveSampling` policy set the period, or `None`
+        to return to subscriber periods."""
+        with self._lock:
+            self._policy = policy
+            self._retime()
+        return self
+
+    @property
+    def breaker(self):
+        return self._breaker
+
+    def protect(self, breaker):
+        """Guard acquisition with `breaker`, a `CircuitBreaker`."""
+        self._breaker = breaker
+        return self
+
+    def addBounds(self, owner, minc, maxc):
+        """Register the range `owner`, e.g., an alarm, watches."""
+        with self._lock:
+            self._bounds[owner] = (minc, maxc)
+
+    def removeBounds(self, owner):
+        with self._lock:
+            self._bounds.pop(owner, None)
+
+    @property
+    def bounds(self):
+        with self._lock:
+            return list(self._bounds.values())
+
+    @property
+    def samples(self):
+        """Number of acquisitions performed."""
+        return self._samples
+
+    @property
+    def subscribers(self):
+        with self._lock:
+            return list(self._subs)
+
+    def subscribe(self, fx, every=1, freq=None, onError=None, start=True,
+                  follow=False):
+        sub = Subscription(self, fx, every=every, freq=freq,
+                           onError=onError, follow=follow)
+        with self._lock:
+            self._subs.append(sub)
+            self._retime()
+        if start:
+            self.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+            empty = not self._subs
+            if not empty:
+                self._retime()
+        if empty:
+            self.stop()
+
+    def _retime(self):
+        if self._fixed:
+            return
+        if self._policy is not None:
+            self._freq = self._policy.period
+        else:
+            fs = [s.freq for s in self._subs if s.freq is not None]
+            self._freq = min(fs) if fs else SensorHub.DEFAULT_FREQ
+        if self._reader:
+            self._reader.taskfreq = self._freq
+        elif self._driver is not None:
+            self._driver.retime()
+
+    def due(self, now):
+        """Subscribers due a reading at `now`."""
+        return [s for s in self.subscribers if s.due(now)]
+
+    def publish(self, subs, evt, now):
+        self._samples += 1
+        if "celsius" in evt:
+            metrics.READING.labels(self.name).set(evt["celsius"])
+        if self._policy is not None:
+            self._policy.observe(evt.get("celsius"), now, self.bounds)
+            with self._lock:
+                self._retime()
+        for s in subs:
+            s.deliver(dict(evt), now)
+
+    def fail(self, subs, e, now=None):
+        now = time.time() if now is None else now
+        if not self.sensor.stopped():
+            if self._breaker.failure(now):
+                m = self.fmtMsg("failing ({}); retrying with backoff.".format(e))
+                log.warning(m)
+                self.sensor.alertSys(m)
+            elif not self._breaker.closed():
+                log.info(self.fmtMsg("still failing ({}); retry in {:.1f}s.".format(
+                    e, self._breaker.retryAt - now)))
+        for s in subs:
+            s.fail(e)
+
+    def recovered(self):
+        """Record a reading taken; alert if it ended an outage."""
+        opened = not self._breaker.closed()
+        failures = self._breaker.success()
+        if opened:
+            m = self.fmtMsg("recovered after {} failed readings.".format(failures))
+            log.info(m)
+            self.sensor.alertSys(m)
+
+    def period(self, now):
+        """Seconds to the next tick."""
+        return self._breaker.period(self._freq, now)
+
+    def acquiring(self, now):
+        """Subscribers due a reading at `now`, and whether one should
+        be taken; the breaker may skip one, or retry without any due."""
+        if not self._breaker.allow(now):
+            return [], False
+        due = self.due(now)
+        return due, bool(due) or self._breaker.probing()
+
+    def tick(self):
+        """Acquire once if any subscriber is due and publish."""
+        now = time.time()
+        try:
+            due, acquire = self.acquiring(now)
+            if not acquire:
+                return None
+            try:
+                evt = self.sensor.sample()
+            except Exception as e:
+                self.fail(due, e, now)
+                return None
+            finally:
+                metrics.READ_SECONDS.labels(self.name).observe(
+                    time.time() - now)
+            self.recovered()
+            self.publish(due, evt, now)
+            return evt
+        finally:
+            if self._reader is not None:
+                self._reader.taskfreq = self.period(time.time())
+
+    @property
+    def driver(self):
+        """The `BoardScanner` acquiring for this hub, if any."""
+        return self._driver
+
+    def start(self):
+        if self._driver is not None:
+            self._driver.start()
+        elif not self.running():
+            self._reader = startTask(self.tick, self.freq)
+            ## the first tick may have run, and failed, before the
+            ## reader was assigned.
+            self._reader.taskfreq = self.period(time.time())
+
+    def running(self):
+        if self._driver is not None:
+            return self._driver.running()
+        return self._reader is not None and self._reader.active()
+
+    def stop(self):
+        if self._reader is not None and self._reader.active():
+            self._reader.stop()
+        with SensorHub._hubslock:
+            if SensorHub._hubs.get(self.sensor) is self:
+                del SensorHub._hubs[self.sensor]
+
+class BoardScanner(object):
+    """Acquire for the hubs of every sensor on `dog` with one
+    `ThermoDog.measureAll` per tick, so acquisition time stays flat as
+    thermocouples are added. Ticks at the fastest hub's period."""
+    def __init__(self, dog, nSamples=None, sampleRate=None, freq=None):
+        self._dog        = dog
+        self._nsamples   = nSamples
+        self._samplerate = sampleRate
+        self._fixed      = freq
+        self._reader     = None
+        self._scans      = 0
+        SensorHub.addDriver(self)
+
+    @property
+    def scans(self):
+        return self._scans
+
+    def claims(self, sensor):
+        return getattr(sensor, "parent", None) is self._dog
+
+    def hubs(self):
+        return [h for h in SensorHub.hubs() if h.driver is self]
+
+    @property
+    def freq(self):
+        if self._fixed:
+            return self._fixed
+        fs = [h.freq for h in self.hubs()]
+        return min(fs) if fs else SensorHub.DEFAULT_FREQ
+
+    def period(self, now):
+        """Seconds to the next tick: the fastest hub's period, or
+        sooner for a hub's breaker retry."""
+        if self._fixed:
+            return self._fixed
+        ps = [h.period(now) for h in self.hubs()]
+        return min(ps) if ps else SensorHub.DEFAULT_FREQ
+
+    def retime(self):
+        """Take up a hub's new period at once, if it is shorter."""
+        if self._reader is not None:
+            self._reader.taskfreq = self.period(time.time())
+
+    def tick(self):
+        try:
+            self._scan(time.time())
+        finally:
+            if self._reader is not None:
+                self._reader.taskfreq = self.period(time.time())
+
+    def _scan(self, now):
+        due = {}
+        for h in self.hubs():
+            subs, acquire = h.acquiring(now)
+            if not acquire:
+                continue
+            if h.sensor.stopped():
+                h.fail(subs, StopIteration(
+                    "sensor: {} is not available.".format(h.sensor.pin)))
+            else:
+                due[h.sensor.pin] = (h, subs)
+        if not due:
+            return
+        sensors = [h.sensor for h, subs in due.values()]
+        args = {
+            "nSamples": self._nsamples if self._nsamples else
+                        max(s.nSamples for s in sensors),
+            "sampleRate": self._samplerate if self._samplerate is not None else
+                          max(s.sampleRate for s in sensors),
+            "partial": all(s.partial for s in sensors)
+        }
+        try:
+            res = self._dog.measureAll(sorted(due.keys()), **args)
+            self._scans += 1
+        except Exception as e:
+            for h, subs in due.values():
+                h.fail(subs, e, now)
+            return
+        finally:
+            ## one scan serves every due sensor.
+            dt = time.time() - now
+            for h, subs in due.values():
+                metrics.READ_SECONDS.labels(h.name).observe(dt)
+        for c, (h, subs) in due.items():
+            if isinstance(res[c], Exception):
+                h.fail(subs, res[c], now)
+            else:
+                h.recovered()
+                h.publish(subs, res[c], now)
+
+    def start(self):
+        if not self.running():
+            self._reader = startTask(self.tick, self.freq)
+            self.retime()
+
+    def running(self):
+        return self._reader is not None and self._reader.active()
+
+    def stop(self):
+        if self.running():
+            self._reader.stop()
+        SensorHub.removeDriver(self)
+
 class SensorMonitor(HasSensor):
     def __init__(self, sensor, doMonitor=lambda x: sys.stdout.write(str(x)),
-                 freq=60*5, restarts=4):
+                 freq=60*5, quietAfter=4, follow=False, kind="monitor",
+                 restarts=None):
         self._freq      = freq
         self._mfx       = doMonitor
         self._sensor    = sensor
+        self._failures  = metrics.CONSECUTIVE_FAILURES.labels(self.name, kind)
+        self._span      = "monitor.{}".format(kind)
 
         # `fails` correspond to situations that may resolve
         # themselves, e.g., network issues or hardware initialization
-        # issues.
-        self._maxfails  = restarts
+        # issues. The hub's `CircuitBreaker` retries the sensor, and
+        # alerts, until it recovers; the monitor stays subscribed.
+        # The first `quietAfter` failures in a row are logged as
+        # errors, later ones as warnings.
+        if restarts is not None:
+            warnings.warn("SensorMonitor `restarts` is deprecated: the "
+                          "hub retries a failing sensor; see `quietAfter`.",
+                          DeprecationWarning, stacklevel=2)
+        self._quietafter = quietAfter
         self._consfails = 0
 
-        def domfx():
-            try:
-                sss = self.sensor.sample()
-                self._mfx(sss)
-                self._consfails = 0
-            except Exception as e:
-                if self.sensor.stopped():
-                    self.stop()
-                else:
-                    m = self.fmtMsg(
-                        "encountered unexpected exception: {}".format(e))
-                    log.exception(m)
-                    self._consfails += 1
-                    if self._consfails < self._maxfails:
-                        s = "continuing (attempt {} of {})".format(self._consfails,
-                                                                   self._maxfails)
-                        log.info(self.fmtMsg(s))
-                        time.sleep(self._freq * self._consfails)
-                    else:
-                        s = "maximum allowed fails exceeded ... ending!"
-                        # Send system-level alert
-                        self.sensor.alertSys("{} - root cause: {}".format(m, s))
-                        self.stop()
-
-        ## start the monitoring process.
-        self._reader = TaskThread(domfx, self._freq)
-        self._reader.start()
+        def domfx(evt):
+            with profiling.span(self._span):
+                self._mfx(evt)
+            self._consfails = 0
+            self._failures.set(0)
+
+        def onfail(e):
+            if self.sensor.stopped():
+                self.stop()
+                return
+            self._consfails += 1
+            self._failures.set(self._consfails)
+            m = self.fmtMsg("encountered unexpected exception: {}".format(e))
+            if self._consfails <= self._quietafter:
+                log.error(m)
+            else:
+                log.warning("{} ({} in a row)".format(m, self._consfails))
+
+        ## subscribe to the sensor's shared acquisition hub.
+        self._hub = SensorHub.forSensor(self.sensor)
+        self._sub = self._hub.subscribe(domfx, freq=self._freq,
+                                        onError=onfail, start=False,
+                                        follow=follow)
+        self._hub.start()
+
+    @property
+    def hub(self):
+        return self._hub
 
     def stop(self):
         if self.running():
-            self._reader.stop()
+            self._sub.cancel()
     def running(self):
-        return self._reader.active()
+        return self._sub.active()
 
 class HasMonitor(object):
     @property
@@ -100,15 +694,47 @@ class HasMonitor(object):
     def stop(self):
         self.monitor.stop()
         
-class SensorFileLogger(HasSensor, HasMonitor):
-    def __init__(self, sensor, ofile, **args):
+class HasCompression(object):
+    def _compressed(self, fx, compressor):
+        """`fx` behind `compressor`, a `thermodog.compress.Compressor`,
+        if any."""
+        self._stream = CompressedStream(fx, compressor) if compressor else None
+        return self._stream if self._stream else fx
+
+    @property
+    def compressor(self):
+        return self._stream.compressor if self._stream else None
+
+    def _flush(self):
+        if self._stream:
+            self._stream.flush()
+
+class SensorFileLogger(HasSensor, HasMonitor, HasCompression):
+    def __init__(self, sensor, ofile, compressor=None, **args):
+        """Log to `ofile`, a text file or a `BinaryLog`, optionally
+        only the points a `compressor` keeps."""
         self._sensor = sensor
+        self._ofile  = ofile
         def lfx(evt):
             ofile.write("{}\n".format(
                 self.formatRecord(evt)))
             ofile.flush()
-            
-        self._smon = SensorMonitor(self.sensor, doMonitor=lfx, **args)
+
+        def bfx(evt):
+            ofile.write(evt)
+
+        self._smon = SensorMonitor(
+            self.sensor,
+            doMonitor=self._compressed(
+                bfx if isinstance(ofile, BinaryLog) else lfx, compressor),
+            kind=type(self).__name__,
+            **args)
+
+    def stop(self):
+        HasMonitor.stop(self)
+        self._flush()
+        if isinstance(self._ofile, BinaryLog):
+            self._ofile.close()
 
     def formatRecord(self, evt):
         return "{:<10}\t{}\t{:>8.2f}C".format(
@@ -120,7 +746,8 @@ class SensorRangeAlarm(HasSensor, HasMonitor):
                  graceperiod=2, **args):
         self._sensor     = sensor
         self._grace      = graceperiod
-        self._tempbuf    = []
+        self._evtstats   = RunningStats()
+        self._rolling    = RollingStats()
         self._faultstart = None
         self._args       = args
         self._minc       = minc
@@ -133,8 +760,9 @@ class SensorRangeAlarm(HasSensor, HasMonitor):
         
         def lfx(evt):
             v = evt['celsius']
+            self._rolling.add(v, evt['timestamp'])
             if v < minc or v > maxc:
-                self._tempbuf.append(v)
+                self._evtstats.add(v)
                 if not self._faultstart:
                     ## the *start time* of current out-of-range event.
                     self._faultstart = evt['timestamp']
@@ -144,11 +772,18 @@ class SensorRangeAlarm(HasSensor, HasMonitor):
             else:
                 ## after in-range reading, reset fault timer & buf
                 self._faultstart = None
-                self._tempbuf    = []
+                self._evtstats.reset()
                 self._grace      = graceperiod
                 
-        ## start monitoring
-        self._smon = SensorMonitor(self.sensor, doMonitor=lfx, **self._args)
+        ## start monitoring; on an adaptive hub, every reading counts.
+        self._args.setdefault('follow', True)
+        self._smon = SensorMonitor(self.sensor, doMonitor=lfx,
+                                   kind=type(self).__name__, **self._args)
+        self._smon.hub.addBounds(self, minc, maxc)
+
+    def stop(self):
+        self._smon.hub.removeBounds(self)
+        HasMonitor.stop(self)
 
     @property
     def minc(self):
@@ -156,6 +791,15 @@ class SensorRangeAlarm(HasSensor, HasMonitor):
     @property
     def maxc(self):
         return self._maxc
+    @property
+    def eventStats(self):
+        """RunningStats of the current out-of-range event."""
+        return self._evtstats
+    @property
+    def rollingStats(self):
+        """RollingStats of every reading over the last 5, 15 and 60
+        minutes."""
+        return self._rolling
     
     def cevtdur(self, evt):
         if self._faultstart:
@@ -164,18 +808,22 @@ class SensorRangeAlarm(HasSensor, HasMonitor):
             return 0
 
     def cevtavg(self, evt):
-        return numpy.nanmean(self._tempbuf)
+        return self._evtstats.mean
     
     def fmtAlert(self, evt):
         return self.fmtMsg(
             ("Out of range. Reporting: {}C at {}. " +
              "Ongoing out-of-range event duration: " +
-             "{} minutes (next alert:: {}), avg: {}C, allowed range: ({}, {}).").format(
+             "{} minutes (next alert:: {}), avg: {}C, min/max: {}/{}C, " +
+             "15 min avg: {}C, allowed range: ({}, {}).").format(
                  numpy.round(evt['celsius']),
                  pstIso(evt['timestamp']),
                  numpy.round(self.cevtdur(evt)/60, 1),
                  numpy.round(self._grace, 1),
                  numpy.round(self.cevtavg(evt), 2),
+                 numpy.round(self._evtstats.min, 2),
+                 numpy.round(self._evtstats.max, 2),
+                 numpy.round(self._rolling.window(15*60)['mean'], 2),
                  self.minc,
                  self.maxc))
 
@@ -186,18 +834,19 @@ class SensorRangeAlarm(HasSensor, HasMonitor):
         self._grace += 1.1 * self._grace
 
 
-class CloudWatchHeartbeat(HasSensor, HasMonitor):
+class CloudWatchHeartbeat(HasSensor, HasMonitor, HasCompression):
     @property
     def metric(self):
         return self._cwmetric
     
-    def __init__(self, sensor, **args):
+    def __init__(self, sensor, publisher=None, compressor=None, **args):
         self._sensor   = sensor
         self._args     = args
         self._cwmetric = CloudWatchMetric(namespace="Wholebiome/Thermodog",
                                           metricName="Temperature",
                                           dimName="MonitorName",
-                                          dimValue=self.name)
+                                          dimValue=self.name,
+                                          publisher=publisher)
         def cwp(evt):
             try:
                 self.metric.push(numpy.round(evt['celsius']), evt['timestamp'])
@@ -207,10 +856,20 @@ class CloudWatchHeartbeat(HasSensor, HasMonitor):
 
         ## start monitoring
         self._smon = SensorMonitor(self.sensor,
-                                   doMonitor=cwp, **self._args)
+                                   doMonitor=self._compressed(cwp, compressor),
+                                   kind=type(self).__name__, **self._args)
+
+    def stop(self):
+        HasMonitor.stop(self)
+        self._flush()
         
-    def addAlarm(self, noun="Status", **args):
-        self.metric.addAlarm("{} {}".format(self.name, noun), **args)
+    def addAlarm(self, noun="Status", provisioner=None, **args):
+        """Put the alarm, or with a `Provisioner`, only if changed."""
+        if provisioner:
+            provisioner.ensureAlarm(self.metric,
+                                    "{} {}".format(self.name, noun), **args)
+        else:
+            self.metric.addAlarm("{} {}".format(self.name, noun), **args)
         return self
     
 
@@ -227,7 +886,8 @@ class SensorHeartbeat(HasSensor, HasMonitor):
             except:
                 self.alerter.alertSys("Failed to post heartbeat!")
 
-        self._smon = SensorMonitor(self.sensor, doMonitor=lfx, **args)
+        self._smon = SensorMonitor(self.sensor, doMonitor=lfx,
+                                   kind=type(self).__name__, **args)
 
     def formatRecord(self, rec):
         return "{:<10}, {:>8.2f}C".format(
@@ -236,19 +896,22 @@ class SensorHeartbeat(HasSensor, HasMonitor):
 
 class GasSensorFileLogger(SensorFileLogger):
     def formatRecord(self, evt):
-        return "{} - {}".format(self.sensor.sensorType, evt)
+        return "{:<10}\t{}\t{}\t{:>8.1f}\t{:>8.1f}ppm".format(
+            self.name, pstIso(evt["timestamp"]), self.sensor.sensorType,
+            evt["counts"], evt["PPM"])
 
 class GasSensorHeartbeat(HasSensor, HasMonitor):
     @property
     def metric(self):
         return self._cwmetric
     
-    def __init__(self, sensor, **args):
+    def __init__(self, sensor, publisher=None, **args):
         self._sensor   = sensor
         self._cwmetric = CloudWatchMetric(namespace="Wholebiome/Gasdog",
                                           metricName="PPM",
                                           dimName="MonitorName",
-                                          dimValue=self.name)
+                                          dimValue=self.name,
+                                          publisher=publisher)
         def cwp(evt):
             if numpy.isnan(evt['PPM']):
                 log.info("Metric PPM is NaN - not pushed to CloudWatch.")
@@ -257,8 +920,14 @@ class GasSensorHeartbeat(HasSensor, HasMonitor):
                 log.debug("Pushed PPM: {}".format(evt['PPM']))
 
         ## start monitoring
-        self._smon = SensorMonitor(self.sensor, doMonitor=cwp, **args)
+        self._smon = SensorMonitor(self.sensor, doMonitor=cwp,
+                                   kind=type(self).__name__, **args)
         
-    def addAlarm(self, noun="Status", **args):
-        self.metric.addAlarm("{} {}".format(self.name, noun), **args)
+    def addAlarm(self, noun="Status", provisioner=None, **args):
+        """Put the alarm, or with a `Provisioner`, only if changed."""
+        if provisioner:
+            provisioner.ensureAlarm(self.metric,
+                                    "{} {}".format(self.name, noun), **args)
+        else:
+            self.metric.addAlarm("{} {}".format(self.name, noun), **args)
         return self
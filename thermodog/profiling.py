@@ -0,0 +1,273 @@
+##
+## Timing spans around the hot paths, kept as fixed-memory, log-scale
+## histograms, and an optional sampler of thread stacks. Off by
+## default; a disabled span costs one flag check. In the field,
+## SIGUSR2 toggles profiling and SIGUSR1 dumps what has been collected
+## to the log or a file, without restarting the dog.
+##
+import sys
+import math
+import atexit
+import time
+import signal
+import logging
+import functools
+import threading
+
+from threading import Lock, Thread, Event
+
+log = logging.getLogger("thermodog")
+
+class SpanHistogram(object):
+    """Durations in `perDecade` buckets per decade between `lo` and
+    `hi` seconds, plus count, sum and max; quantiles are estimated to
+    within a bucket."""
+    def __init__(self, lo=1e-6, hi=100.0, perDecade=8):
+        self._lo     = lo
+        self._per    = perDecade
+        self._n      = int(math.ceil(math.log10(hi / lo) * perDecade)) + 1
+        self._counts = [0] * (self._n + 1)
+        self.count   = 0
+        self.total   = 0.0
+        self.max     = 0.0
+
+    def add(self, seconds):
+        if seconds <= self._lo:
+            i = 0
+        else:
+            i = min(self._n, 1 + int(math.log10(seconds / self._lo) * self._per))
+        self._counts[i] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def _upper(self, i):
+        if i == self._n:
+            return float("inf")
+        return self._lo * 10 ** (float(i) / self._per)
+
+    def quantile(self, p):
+        """Upper bound of the bucket holding the `p` quantile."""
+        if not self.count:
+            return float("nan")
+        rank = p * self.count
+        seen = 0
+        for i, c in enumerate(self._counts):
+            seen += c
+            if seen >= rank and c:
+                return min(self._upper(i), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else float("nan")
+
+_enabled = False
+_lock    = Lock()
+_spans   = {}
+_sampler = None
+
+def enabled():
+    return _enabled
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+    if _sampler is not None:
+        if on:
+            _sampler.start()
+        else:
+            _sampler.stop()
+    log.info("Profiling {}.".format("enabled" if on else "disabled"))
+
+def disable():
+    enable(False)
+
+def reset():
+    with _lock:
+        _spans.clear()
+    if _sampler is not None:
+        _sampler.reset()
+
+def histogram(name):
+    h = _spans.get(name)
+    if h is None:
+        with _lock:
+            h = _spans.setdefault(name, SpanHistogram())
+    return h
+
+def observe(name, seconds):
+    """Record a duration measured elsewhere, e.g., by botocore."""
+    if _enabled:
+        histogram(name).add(seconds)
+
+def observeAws(service, operation, seconds, ok):
+    """A `thermodog.aws.ClientRegistry` listener."""
+    if _enabled:
+        histogram("aws.{}.{}".format(service, operation)).add(seconds)
+
+class _Span(object):
+    __slots__ = ("_name", "_t0")
+
+    def __init__(self, name):
+        self._name = name
+
+    def __enter__(self):
+        self._t0 = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        histogram(self._name).add(time.time() - self._t0)
+        return False
+
+class _NoSpan(object):
+    __slots__ = ()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NOSPAN = _NoSpan()
+
+def span(name):
+    """A context timing its body as `name`, when enabled."""
+    return _Span(name) if _enabled else _NOSPAN
+
+def timed(name):
+    """Decorate a function to time its calls as `name`."""
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return f(*args, **kwargs)
+            t0 = time.time()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                histogram(name).add(time.time() - t0)
+        return wrapper
+    return decorate
+
+class StackSampler(object):
+    """Sample the stack of every other thread each `interval` seconds,
+    counting them folded, 'thread;outer;...;inner', as flame graph
+    tools read them. At most `maxStacks` distinct stacks are kept."""
+    def __init__(self, interval=.01, depth=32, maxStacks=2000):
+        self._interval = interval
+        self._depth    = depth
+        self._max      = maxStacks
+        self._stacks   = {}
+        self._samples  = 0
+        self._dropped  = 0
+        self._finished = Event()
+        self._thread   = None
+
+    @property
+    def samples(self):
+        return self._samples
+
+    def reset(self):
+        self._stacks, self._samples, self._dropped = {}, 0, 0
+
+    def _frames(self, frame):
+        names = []
+        while frame is not None and len(names) < self._depth:
+            code = frame.f_code
+            names.append("{} ({}:{})".format(
+                code.co_name, code.co_filename.rsplit("/", 1)[-1],
+                frame.f_lineno))
+            frame = frame.f_back
+        return names
+
+    def sample(self):
+        me = threading.current_thread().ident
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            key = ";".join([names.get(ident, str(ident))] +
+                           list(reversed(self._frames(frame))))
+            if key in self._stacks:
+                self._stacks[key] += 1
+            elif len(self._stacks) < self._max:
+                self._stacks[key] = 1
+            else:
+                self._dropped += 1
+        self._samples += 1
+
+    def run(self):
+        while not self._finished.wait(self._interval):
+            self.sample()
+
+    def start(self):
+        if self._thread is None:
+            self._finished.clear()
+            self._thread = Thread(target=self.run, name="stack-sampler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+
+    def folded(self):
+        """Lines of 'stack count', most frequent first."""
+        stacks = sorted(list(self._stacks.items()), key=lambda kv: -kv[1])
+        return ["{} {}".format(k, v) for k, v in stacks]
+
+def summary():
+    """A table of every span: calls and milliseconds."""
+    with _lock:
+        spans = sorted(_spans.items())
+    lines = ["{:<32} {:>8} {:>9} {:>9} {:>9} {:>9} {:>10}".format(
+        "span", "calls", "mean", "p50", "p99", "max", "total")]
+    for name, h in spans:
+        lines.append(
+            "{:<32} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>10.1f}".format(
+                name, h.count, h.mean*1e3, h.quantile(.5)*1e3,
+                h.quantile(.99)*1e3, h.max*1e3, h.total*1e3))
+    return lines
+
+def dump(path=None, top=20):
+    """Write the span summary, and the most frequent sampled stacks,
+    to the log or, appended, to `path`; all folded stacks go to
+    `path`.stacks."""
+    lines = ["profile at {} ({}):".format(
+        time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "enabled" if _enabled else "disabled")] + summary()
+    if _sampler is not None and _sampler.samples:
+        folded = _sampler.folded()
+        lines.append("{} stack samples, top {}:".format(_sampler.samples, top))
+        lines.extend(folded[:top])
+        if path:
+            with open(path + ".stacks", "w") as f:
+                f.write("\n".join(folded) + "\n")
+    if path:
+        with open(path, "a") as f:
+            f.write("\n".join(lines) + "\n\n")
+        log.info("Wrote profile to {}.".format(path))
+    else:
+        log.info("\n".join(lines))
+
+def installSignals(path=None, sampleInterval=None):
+    """Dump on SIGUSR1 and toggle profiling on SIGUSR2, sampling stacks
+    every `sampleInterval` seconds while enabled. Call from the main
+    thread."""
+    global _sampler
+    if sampleInterval:
+        _sampler = StackSampler(sampleInterval)
+        atexit.register(_sampler.stop)
+        if _enabled:
+            _sampler.start()
+    def onDump(signum, frame):
+        try:
+            dump(path)
+        except Exception as e:
+            log.warning("Failed to dump profile: {}".format(e))
+    def onToggle(signum, frame):
+        enable(not _enabled)
+    signal.signal(signal.SIGUSR1, onDump)
+    signal.signal(signal.SIGUSR2, onToggle)
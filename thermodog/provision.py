@@ -0,0 +1,189 @@
+##
+## AWS resources a dog needs, alarms, topics and subscriptions,
+## reconciled in the background against a desired state cached on
+## disk, so a restart starts sampling at once and only calls AWS for
+## what changed.
+##
+import os
+import json
+import time
+import hashlib
+import logging
+
+from threading import Thread, Lock, Event
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+from . import aws
+
+log = logging.getLogger("thermodog")
+
+class AwsState(object):
+    """The account ID, topic ARNs and the digests of the alarms and
+    subscriptions last applied, in a JSON file replaced atomically."""
+    def __init__(self, path=None):
+        self._path  = path
+        self._lock  = Lock()
+        self._state = {"account": None, "topics": {}, "applied": {}}
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._state.update(json.load(f))
+            except (IOError, OSError, ValueError) as e:
+                log.warning("Ignoring AWS state {}: {}".format(path, e))
+
+    def get(self, section, key=None):
+        with self._lock:
+            v = self._state[section]
+            return v if key is None else v.get(key)
+
+    def set(self, section, value, key=None):
+        with self._lock:
+            if key is None:
+                self._state[section] = value
+            else:
+                self._state[section][key] = value
+            self._save()
+
+    def _save(self):
+        if not self._path:
+            return
+        tmp = self._path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._state, f, indent=1, sort_keys=True)
+        os.rename(tmp, self._path)
+
+def digest(d):
+    return hashlib.sha1(json.dumps(d, sort_keys=True).encode("utf-8")) \
+        .hexdigest()
+
+class Provisioner(object):
+    """Run AWS setup jobs on a background thread, retrying failures
+    with exponential backoff up to `maxDelay` seconds. What has been
+    applied is recorded in `state` and re-applied only when its
+    definition changes or after `ttl` seconds, in case it was changed
+    behind our back."""
+    def __init__(self, state=None, region="us-west-2", ttl=7*24*60*60,
+                 maxDelay=15*60, start=True):
+        self._state    = state if state else AwsState()
+        self._region   = region
+        self._ttl      = ttl
+        self._maxdelay = maxDelay
+        self._queue    = Queue()
+        self._waiting  = []
+        self._finished = Event()
+        self._thread   = None
+        self._stats    = {"applied": 0, "skipped": 0, "failed": 0}
+        if start:
+            self.start()
+
+    @property
+    def state(self):
+        return self._state
+
+    def stats(self):
+        d = dict(self._stats)
+        d["pending"] = self._queue.qsize() + len(self._waiting)
+        return d
+
+    def accountId(self):
+        acct = self._state.get("account")
+        if acct is None:
+            acct = aws.client("sts").get_caller_identity()["Account"]
+            self._state.set("account", acct)
+        return acct
+
+    def topicArn(self, topicName):
+        arn = self._state.get("topics", topicName)
+        if arn is None:
+            arn = aws.client("sns").create_topic(Name=topicName)["TopicArn"]
+            self._state.set("topics", arn, topicName)
+        return arn
+
+    def topicActions(self, topicNames):
+        """Alarm actions notifying `topicNames`."""
+        return ["arn:aws:sns:{}:{}:{}".format(self._region, self.accountId(), t)
+                for t in topicNames]
+
+    def _apply(self, key, definition, f):
+        """Call `f` unless `definition` was applied within `ttl`."""
+        d = digest(definition)
+        last = self._state.get("applied", key)
+        if last and last[0] == d and time.time() - last[1] < self._ttl:
+            self._stats["skipped"] += 1
+            return False
+        f()
+        self._state.set("applied", [d, time.time()], key)
+        self._stats["applied"] += 1
+        return True
+
+    def ensureAlarm(self, metric, alarmName, **args):
+        """Put the alarm `alarmName` on a `CloudWatchMetric` if it is
+        new or changed."""
+        adict = metric.alarmDict(alarmName, **args)
+        def put():
+            metric.client.put_metric_alarm(**adict)
+            log.info("Put alarm {}".format(alarmName))
+        return self._apply("alarm:" + alarmName, adict, put)
+
+    def ensureSubscription(self, topic, protocol, endpoint):
+        """Subscribe `endpoint` to an `SnsTopic` once."""
+        key = "subscription:{}:{}:{}".format(topic.topicName, protocol,
+                                             endpoint)
+        def sub():
+            topic.client.subscribe(TopicArn=topic.pubArn, Protocol=protocol,
+                                   Endpoint=endpoint)
+            log.info("Subscribed {} to {}".format(endpoint, topic))
+        return self._apply(key, [protocol, endpoint], sub)
+
+    def submit(self, f, *args, **kwargs):
+        """Run `f(*args, **kwargs)` in the background until it succeeds."""
+        self._queue.put((f, args, kwargs, 0))
+
+    def run(self):
+        while not self._finished.is_set():
+            now = time.time()
+            due = [w for w in self._waiting if w[0] <= now]
+            self._waiting = [w for w in self._waiting if w[0] > now]
+            for w in due:
+                self._queue.put(w[1])
+            try:
+                job = self._queue.get(timeout=1)
+            except Empty:
+                continue
+            self.runJob(job)
+
+    def runJob(self, job):
+        f, args, kwargs, attempts = job
+        try:
+            f(*args, **kwargs)
+        except Exception as e:
+            self._stats["failed"] += 1
+            delay = min(self._maxdelay, 5 * 2**attempts)
+            log.warning("AWS setup {} failed, retrying in {}s: {}".format(
+                getattr(f, "__name__", f), delay, e))
+            self._waiting.append((time.time() + delay,
+                                  (f, args, kwargs, attempts + 1)))
+
+    def drain(self):
+        """Run queued jobs now, in this thread."""
+        while True:
+            try:
+                self.runJob(self._queue.get_nowait())
+            except Empty:
+                return
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
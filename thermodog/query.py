@@ -0,0 +1,299 @@
+##
+## Time-range queries over the local sensor logs: the TSV files and
+## binary segments `bin/thermodog` writes under its outdir.
+##
+import os
+import re
+import json
+import mmap
+import time
+import bisect
+import logging
+import numpy
+
+from .binlog import readSegment, SUFFIX
+from .common import PDT, UTC, pstIso
+from .cloudwatch import epochSeconds, epochToUtc
+
+from dateutil import parser
+
+log = logging.getLogger("thermodog")
+
+_DURATION = re.compile(r"^(\d+(?:\.\d+)?)([smhdw])$")
+_UNITS    = {"s": 1, "m": 60, "h": 60*60, "d": 24*60*60, "w": 7*24*60*60}
+
+def parseTime(s, now=None):
+    """Epoch seconds of an ISO time, Pacific if it has no zone, of a
+    duration ago such as '90m' or '7d', or of 'now'."""
+    now = time.time() if now is None else now
+    if s == "now":
+        return now
+    m = _DURATION.match(s)
+    if m:
+        return now - float(m.group(1)) * _UNITS[m.group(2)]
+    ts = parser.parse(s)
+    if ts.tzinfo is None:
+        ts = PDT.localize(ts)
+    return epochSeconds(ts.astimezone(UTC)) + ts.microsecond / 1e6
+
+def _tzOffset(z):
+    """Seconds east of UTC of a '+hh:mm' suffix, else 0."""
+    if z[:1] not in (b"+", b"-"):
+        return 0
+    return (-1 if z[:1] == b"-" else 1) * (int(z[1:3])*3600 + int(z[4:6])*60)
+
+def _parseFixed(data):
+    """`_parseTsv` for lines of equal width, the usual case as names,
+    timestamps and readings are padded, as columns of one array."""
+    width = data.find(b"\n") + 1
+    if width < 2 or len(data) % width:
+        return None
+    lines = numpy.frombuffer(data, dtype="S1").reshape(-1, width)
+    if not (lines[:, -1] == b"\n").all():
+        return None
+    first = data[:width]
+    t = first.find(b"\t")
+    v = first.find(b"\t", t + 1)
+    if t < 0 or v - t != 26 or first[-2:-1] != b"C":
+        return None
+    def column(a, b):
+        return numpy.frombuffer(
+            numpy.ascontiguousarray(lines[:, a:b]).tobytes(), "S{}".format(b - a))
+    ts = column(t + 1, t + 20).astype("M8[s]").astype(numpy.float64)
+    zones = column(t + 20, t + 26)
+    for z in numpy.unique(zones):
+        ts[zones == z] -= _tzOffset(z)
+    celsius = column(v + 1, width - 2).astype(numpy.float64)
+    return ts, celsius
+
+def _parseTsv(data):
+    """Timestamps and celsius of TSV log lines in `data`, as written by
+    `SensorFileLogger`; the timestamp is parsed in bulk by numpy."""
+    fixed = _parseFixed(data)
+    if fixed is not None:
+        return fixed
+    fields = [l.split(b"\t") for l in data.split(b"\n")]
+    fields = [f for f in fields if len(f) >= 3]
+    if not fields:
+        return numpy.zeros(0), numpy.zeros(0)
+    isos = [f[1].strip() for f in fields]
+    ts = numpy.array([t[:19] for t in isos], dtype="S19").astype(
+        "M8[s]").astype(numpy.float64)
+    offsets = {}
+    for i, t in enumerate(isos):
+        z = t[-6:]
+        if z not in offsets:
+            offsets[z] = _tzOffset(z)
+        ts[i] -= offsets[z]
+    celsius = numpy.array([float(f[2].strip().rstrip(b"C")) for f in fields])
+    return ts, celsius
+
+class TsvIndex(object):
+    """A sparse index of one TSV log: the offset and time of the first
+    line after every `stride` bytes, found by seeking rather than
+    reading the file. Extended as the file grows. Assumes lines are
+    appended in time order."""
+    def __init__(self, path, stride=64*1024):
+        self._path    = path
+        self._stride  = stride
+        self._size    = 0
+        self._offsets = []
+        self._times   = []
+
+    @property
+    def path(self):
+        return self._path
+
+    def _lineAt(self, m, off):
+        end = m.find(b"\n", off)
+        ts, _ = _parseTsv(m[off:end if end >= 0 else len(m)])
+        return ts[0] if len(ts) else None
+
+    def update(self, m):
+        size = len(m)
+        if size < self._size:
+            ## truncated or replaced.
+            self._size, self._offsets, self._times = 0, [], []
+        pos = self._offsets[-1] + self._stride if self._offsets else 0
+        while pos < size:
+            off = 0 if pos == 0 else m.find(b"\n", pos) + 1
+            if (pos and off <= 0) or off >= size:
+                break
+            t = self._lineAt(m, off)
+            if t is not None:
+                self._offsets.append(off)
+                self._times.append(t)
+            pos = off + self._stride
+        self._size = size
+
+    def read(self, start=None, end=None):
+        """Timestamps and celsius between `start` and `end`, epoch
+        seconds, both inclusive."""
+        if os.path.getsize(self._path) == 0:
+            return numpy.zeros(0), numpy.zeros(0)
+        with open(self._path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.update(m)
+                lo, hi = 0, len(m)
+                if start is not None and self._times:
+                    i = bisect.bisect_right(self._times, start) - 1
+                    lo = self._offsets[i] if i >= 0 else 0
+                if end is not None and self._times:
+                    i = bisect.bisect_right(self._times, end)
+                    hi = self._offsets[i] if i < len(self._offsets) else len(m)
+                ts, celsius = _parseTsv(m[lo:hi])
+            finally:
+                m.close()
+        return _clip(ts, celsius, start, end)
+
+def _clip(ts, values, start, end):
+    keep = numpy.ones(len(ts), dtype=bool)
+    if start is not None:
+        keep &= ts >= start
+    if end is not None:
+        keep &= ts <= end
+    return ts[keep], values[keep]
+
+class LogQuery(object):
+    """Query the logs under `outdir`: `<name>.tsv` files and binary
+    segments in `outdir/binlog`. The time span of each segment is kept
+    in `binlog/index.json`, so closed, gzipped segments are only opened
+    when a query overlaps them."""
+    INDEX = "index.json"
+
+    def __init__(self, outdir):
+        self._outdir  = outdir
+        self._bindir  = os.path.join(outdir, "binlog")
+        self._tsvs    = {}
+        self._spans   = self._loadSpans()
+        self._dirty   = False
+
+    def _loadSpans(self):
+        try:
+            with open(os.path.join(self._bindir, LogQuery.INDEX)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _saveSpans(self):
+        path = os.path.join(self._bindir, LogQuery.INDEX)
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(self._spans, f)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError) as e:
+            log.debug("Not saving log index: {}".format(e))
+
+    def _segments(self, sensor):
+        if not os.path.isdir(self._bindir):
+            return []
+        return sorted(f for f in os.listdir(self._bindir)
+                      if (f.endswith(SUFFIX) or f.endswith(SUFFIX + ".gz")) and
+                      f.rsplit("-", 2)[0] == sensor)
+
+    def sensors(self):
+        """Names of the sensors with logs."""
+        names = set(f[:-4] for f in os.listdir(self._outdir)
+                    if f.endswith(".tsv"))
+        if os.path.isdir(self._bindir):
+            names.update(f.rsplit("-", 2)[0] for f in os.listdir(self._bindir)
+                         if f.endswith(SUFFIX) or f.endswith(SUFFIX + ".gz"))
+        return sorted(names)
+
+    def _span(self, fname, records):
+        size = os.path.getsize(os.path.join(self._bindir, fname))
+        span = self._spans.get(fname)
+        if span is None or span[0] != size:
+            if records is None:
+                records = readSegment(os.path.join(self._bindir, fname))
+            if not len(records):
+                return None, records
+            span = [size, float(records["timestamp"][0]),
+                    float(records["timestamp"][-1])]
+            ## the open segment keeps growing; only closed ones are kept.
+            if fname.endswith(".gz"):
+                self._spans[fname] = span
+                self._dirty = True
+        return span, records
+
+    def _readBinary(self, sensor, start, end):
+        self._dirty = False
+        ts, values = [], []
+        for fname in self._segments(sensor):
+            records = None
+            if not fname.endswith(".gz"):
+                records = readSegment(os.path.join(self._bindir, fname))
+            span, records = self._span(fname, records)
+            if span is None or (start is not None and span[2] < start) or \
+               (end is not None and span[1] > end):
+                continue
+            if records is None:
+                records = readSegment(os.path.join(self._bindir, fname))
+            t = records["timestamp"]
+            lo = 0 if start is None else numpy.searchsorted(t, start, "left")
+            hi = len(t) if end is None else numpy.searchsorted(t, end, "right")
+            ts.append(numpy.array(t[lo:hi], dtype=numpy.float64))
+            values.append(numpy.array(records["celsius"][lo:hi],
+                                      dtype=numpy.float64))
+        if self._dirty:
+            self._saveSpans()
+        return ts, values
+
+    def read(self, sensor, start=None, end=None):
+        """Timestamps, epoch seconds, and celsius of `sensor` between
+        `start` and `end`, in time order."""
+        ts, values = self._readBinary(sensor, start, end)
+        path = os.path.join(self._outdir, "{}.tsv".format(sensor))
+        if os.path.exists(path):
+            if path not in self._tsvs:
+                self._tsvs[path] = TsvIndex(path)
+            t, v = self._tsvs[path].read(start, end)
+            ts.append(t)
+            values.append(v)
+        if not ts:
+            return numpy.zeros(0), numpy.zeros(0)
+        ts = numpy.concatenate(ts)
+        values = numpy.concatenate(values)
+        order = numpy.argsort(ts, kind="mergesort")
+        return ts[order], values[order]
+
+BUCKET = numpy.dtype([("start", "f8"), ("count", "i8"), ("min", "f8"),
+                      ("max", "f8"), ("mean", "f8")])
+
+def downsample(ts, values, bucket):
+    """Per `bucket` seconds: bucket start, count, min, max and mean.
+    NaN readings are ignored."""
+    ok = ~numpy.isnan(values)
+    ts, values = ts[ok], values[ok]
+    out = numpy.zeros(0, dtype=BUCKET)
+    if not len(ts):
+        return out
+    b = numpy.floor(ts / bucket)
+    starts = numpy.flatnonzero(numpy.r_[True, b[1:] != b[:-1]])
+    out = numpy.zeros(len(starts), dtype=BUCKET)
+    out["start"] = b[starts] * bucket
+    out["count"] = numpy.diff(numpy.r_[starts, len(ts)])
+    out["min"]   = numpy.minimum.reduceat(values, starts)
+    out["max"]   = numpy.maximum.reduceat(values, starts)
+    out["mean"]  = numpy.add.reduceat(values, starts) / out["count"]
+    return out
+
+def rows(sensor, ts, values, bucket=None):
+    """Dicts of raw readings, or of `bucket`-second aggregates, rounded
+    to the resolution of the logs."""
+    if bucket:
+        for r in downsample(ts, values, bucket):
+            yield dict(sensor=sensor, start=pstIso(epochToUtc(r["start"])),
+                       count=int(r["count"]), min=round(float(r["min"]), 3),
+                       max=round(float(r["max"]), 3),
+                       mean=round(float(r["mean"]), 3))
+    else:
+        for t, v in zip(ts, values):
+            yield dict(sensor=sensor, timestamp=pstIso(epochToUtc(t)),
+                       celsius=round(float(v), 3))
+
+def columns(bucket=None):
+    if bucket:
+        return ["sensor", "start", "count", "min", "max", "mean"]
+    return ["sensor", "timestamp", "celsius"]
@@ -0,0 +1,425 @@
+##
+## Sensors on an Arduino streaming ADC readings over serial, one line
+## of tab-separated counts per reading (see etc/arduino/analog-bus),
+## or binary frames at a high rate, averaged down on the host (see
+## etc/arduino/analog-bus-binary and `thermodog.framing`). Each port
+## is read by one background thread into per-channel ring buffers, so
+## `sample()` never waits on the port.
+##
+import os
+import time
+import errno
+import select
+import socket
+import logging
+import numpy
+
+from threading import Thread, Lock, Event
+
+from .common import utcNow
+from .coms import SmsAlerter
+from .framing import FrameDecoder, Decimator, FRAME_BAUD, FRAME_RATE
+
+log = logging.getLogger("thermodog")
+
+## MQ sensors: Rs/R0 = (ppm/a)**(1/b), a power law fit to the
+## datasheet sensitivity curve of the main target gas, and Rs/R0 in
+## clean air, used to calibrate R0.
+MQ_CURVES = {
+    "MQ2":   (574.25,  -2.222, 9.83),   ## LPG
+    "MQ3":   (0.3934,  -1.504, 60.0),   ## alcohol, mg/L
+    "MQ4":   (1012.7,  -2.786, 4.4),    ## methane
+    "MQ7":   (99.042,  -1.518, 27.5),   ## carbon monoxide
+    "MQ135": (110.47,  -2.862, 3.6),    ## carbon dioxide
+}
+
+def mqResistance(counts, rl=10.0, vcc=5.0, adcMax=1023):
+    """Sensor resistance Rs, in the units of the load resistor `rl`,
+    of ADC `counts`; NaN where the divider reads 0 or full scale."""
+    counts = numpy.asarray(counts, dtype=numpy.float64)
+    vout = counts * (vcc / adcMax)
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        rs = rl * (vcc - vout) / vout
+    rs[~((vout > 0) & (vout < vcc))] = numpy.nan
+    return rs
+
+def mqPpm(counts, sensorType="MQ4", r0=10.0, rl=10.0, vcc=5.0, adcMax=1023):
+    """PPM of ADC `counts`, any shape, for an MQ `sensorType` with
+    clean-air resistance `r0`."""
+    a, b, _ = MQ_CURVES[sensorType]
+    return a * (mqResistance(counts, rl, vcc, adcMax) / r0) ** b
+
+def mqCalibrate(counts, sensorType="MQ4", rl=10.0, vcc=5.0, adcMax=1023):
+    """R0 of a sensor reading `counts` in clean air."""
+    rs = numpy.nanmean(mqResistance(counts, rl, vcc, adcMax))
+    return rs / MQ_CURVES[sensorType][2]
+
+def openPort(path, baud=9600):
+    """A raw, non-blocking file descriptor on the serial device, or
+    pty, at `path`."""
+    import tty
+    import termios
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        tty.setraw(fd)
+        speed = getattr(termios, "B{}".format(baud))
+        attrs = termios.tcgetattr(fd)
+        attrs[4] = attrs[5] = speed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    except Exception:
+        os.close(fd)
+        raise
+    return fd
+
+class SerialBus(object):
+    """Read lines of up to `maxChannels` tab-separated ADC counts from
+    the serial `port` on a background thread, keeping the last
+    `window` readings of each channel. With a `FrameDecoder` as
+    `framing`, the port carries binary frames instead and every
+    `decimate` frames are averaged into one reading. Reopens the port
+    if it goes away, e.g., when the Arduino is unplugged. Buses are
+    shared per port."""
+    _buses     = {}
+    _buseslock = Lock()
+
+    @classmethod
+    def forPort(cls, port, **args):
+        with cls._buseslock:
+            if port not in cls._buses:
+                cls._buses[port] = cls(port, **args)
+            return cls._buses[port]
+
+    def __init__(self, port, baud=9600, maxChannels=8, window=64,
+                 maxLine=256, reopen=5, framing=None, decimate=1,
+                 start=True):
+        self._port     = port
+        self._baud     = baud
+        self._reopen   = reopen
+        self._fd       = None
+        ## incremental line framing into a fixed buffer; a line longer
+        ## than it is dropped up to the next newline.
+        self._line     = bytearray(maxLine)
+        self._nline    = 0
+        self._overflow = False
+        self._decoder  = framing
+        self._decimate = Decimator(decimate) if framing else None
+        self._times    = numpy.zeros(window)
+        self._values   = numpy.full((window, maxChannels), numpy.nan)
+        self._next     = 0
+        self._count    = 0
+        self._lock     = Lock()
+        self._finished = Event()
+        self._thread   = None
+        self._stats    = {"bytes": 0, "lines": 0, "malformed": 0,
+                          "overflows": 0, "reopens": 0}
+        if start:
+            self.start()
+
+    def __repr__(self):
+        return "serial:{}".format(self._port)
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def window(self):
+        return len(self._times)
+
+    @property
+    def maxChannels(self):
+        return self._values.shape[1]
+
+    def stats(self):
+        with self._lock:
+            d = dict(self._stats)
+            d["buffered"] = self._count
+        if self._decoder:
+            d.update(self._decoder.stats())
+        return d
+
+    def feed(self, data):
+        """Frame `data`, bytes as read from the port, into lines, or
+        decode its binary frames."""
+        self._stats["bytes"] += len(data)
+        if self._decoder:
+            _, samples = self._decoder.decode(data)
+            readings = self._decimate.add(samples)
+            if len(readings):
+                self.extend(readings)
+            return
+        pos = 0
+        while pos < len(data):
+            end = data.find(b"\n", pos)
+            stop = len(data) if end < 0 else end
+            n = stop - pos
+            if not self._overflow:
+                if self._nline + n > len(self._line):
+                    self._overflow = True
+                    self._stats["overflows"] += 1
+                else:
+                    self._line[self._nline:self._nline + n] = data[pos:stop]
+                    self._nline += n
+            if end < 0:
+                return
+            if not self._overflow:
+                self._parse(self._nline)
+            self._nline = 0
+            self._overflow = False
+            pos = end + 1
+
+    def _parse(self, n):
+        fields = bytes(self._line[:n]).split()
+        if not fields or len(fields) > self.maxChannels:
+            self._stats["malformed"] += 1
+            return
+        try:
+            counts = [int(f) for f in fields]
+        except ValueError:
+            self._stats["malformed"] += 1
+            return
+        self.add(counts)
+
+    def add(self, counts, timestamp=None):
+        """Take one reading, ADC counts of channels 1..len(counts)."""
+        with self._lock:
+            i = self._next
+            self._times[i] = time.time() if timestamp is None else timestamp
+            self._values[i, :] = numpy.nan
+            self._values[i, :len(counts)] = counts
+            self._next = (i + 1) % self.window
+            self._count = min(self._count + 1, self.window)
+            self._stats["lines"] += 1
+
+    def extend(self, readings, timestamp=None):
+        """Take readings x channels counts at once."""
+        readings = numpy.asarray(readings, dtype=numpy.float64)
+        readings = readings[-self.window:]
+        k, n = readings.shape
+        with self._lock:
+            idx = (self._next + numpy.arange(k)) % self.window
+            self._times[idx] = time.time() if timestamp is None else timestamp
+            self._values[idx, :] = numpy.nan
+            self._values[idx, :n] = readings
+            self._next = (self._next + k) % self.window
+            self._count = min(self._count + k, self.window)
+            self._stats["lines"] += k
+
+    def latest(self, channel, n=None):
+        """The timestamps and counts of the last `n` readings of
+        `channel`, oldest first."""
+        with self._lock:
+            n = self._count if n is None else min(n, self._count)
+            idx = (self._next - n + numpy.arange(n)) % self.window
+            return self._times[idx], self._values[idx, channel - 1]
+
+    def _open(self):
+        try:
+            self._fd = openPort(self._port, self._baud)
+            self._nline, self._overflow = 0, False
+            log.info("Reading {}.".format(self))
+            return True
+        except (OSError, IOError) as e:
+            log.warning("Failed to open {}: {}".format(self, e))
+            return False
+
+    def _close(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def run(self):
+        while not self._finished.is_set():
+            if self._fd is None and not self._open():
+                self._finished.wait(self._reopen)
+                continue
+            try:
+                r, _, _ = select.select([self._fd], [], [], 1)
+                if not r:
+                    continue
+                data = os.read(self._fd, 4096)
+            except (OSError, IOError, select.error) as e:
+                if getattr(e, "errno", e.args[0]) in (errno.EAGAIN, errno.EINTR):
+                    continue
+                data = b""
+            if not data:
+                ## the device went away, or the other end of a pty closed.
+                log.warning("Lost {}; reopening.".format(self))
+                self._close()
+                self._stats["reopens"] += 1
+                self._finished.wait(self._reopen)
+                continue
+            self.feed(data)
+        self._close()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def connected(self):
+        """True while the port is open; input waiting when it was
+        opened is discarded."""
+        return self._fd is not None
+
+    def stop(self):
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join(2)
+            self._thread = None
+        with SerialBus._buseslock:
+            if SerialBus._buses.get(self._port) is self:
+                del SerialBus._buses[self._port]
+
+class SerialDog(object):
+    """The host of serial sensors, standing in for `ThermoDog` as
+    their parent: a name, an alerter and the buses they are read
+    from."""
+    def __init__(self, name=None, alerter=None):
+        self._name    = name if name else socket.gethostname()
+        self._alerter = alerter if alerter else SmsAlerter()
+        self._sensors = {}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def url(self):
+        return "T://{}".format(self.name)
+
+    @property
+    def alerter(self):
+        return self._alerter
+
+    def formatMsg(self, s):
+        return "[{}] - {}".format(self.url, s)
+
+    def alert(self, msg):
+        """Fire a system-level alert."""
+        self.alerter.alertSys(msg)
+
+    def sensor(self, port, channel, baud=None, frameChannels=None,
+               decimate=None, **args):
+        """Return the sensor on ADC `channel` of the Arduino on `port`;
+        with `frameChannels`, one sending binary frames of that many
+        channels. By default, text lines are read at 9600 baud, and
+        frames at the binary firmware's speed, averaged to one reading
+        a second as the text firmware sends."""
+        key = (port, channel)
+        if key not in self._sensors:
+            framing = FrameDecoder(frameChannels) if frameChannels else None
+            if baud is None:
+                baud = FRAME_BAUD if framing else 9600
+            if decimate is None:
+                decimate = FRAME_RATE if framing else 1
+            bus = SerialBus.forPort(port, baud=baud, framing=framing,
+                                    decimate=decimate)
+            self._sensors[key] = SerialSensor(self, bus, channel, **args)
+        return self._sensors[key]
+
+    def shutdown(self):
+        log.info(self.formatMsg("shutting down."))
+        buses = set()
+        for s in self._sensors.values():
+            s.stop()
+            buses.add(s.bus)
+        for b in buses:
+            b.stop()
+        self._sensors = {}
+
+class SerialSensor(object):
+    """An MQ gas sensor on one channel of a `SerialBus`. `sample`
+    averages the last `nSamples` readings already buffered; it raises
+    if none arrived within `stale` seconds."""
+    def __init__(self, parent, bus, channel, name=None, sensorType="MQ4",
+                 r0=10.0, rl=10.0, vcc=5.0, adcMax=1023, nSamples=5,
+                 stale=30):
+        if sensorType not in MQ_CURVES:
+            raise ValueError("unknown sensor type: {}".format(sensorType))
+        self._parent    = parent
+        self._bus       = bus
+        self._name      = name if name else "GS-{}".format(channel)
+        self.pin        = channel
+        self.sensorType = sensorType
+        self.r0         = r0
+        self.rl         = rl
+        self.vcc        = vcc
+        self.adcMax     = adcMax
+        self.nSamples   = nSamples
+        self.stale      = stale
+        self._stopped   = False
+
+    def __repr__(self):
+        return self.url
+
+    @property
+    def name(self):
+        return self._name
+    @property
+    def parent(self):
+        return self._parent
+    @property
+    def bus(self):
+        return self._bus
+    @property
+    def url(self):
+        return "{}/{}".format(self.parent.url, self.name)
+    @property
+    def alerter(self):
+        return self.parent.alerter
+
+    def alertMon(self, msg):
+        self.alerter.alertMon(msg)
+
+    def alertSys(self, msg):
+        self.alerter.alertSys(msg)
+
+    def alert(self, msg):
+        """Fire a monitoring alert."""
+        self.alertMon(msg)
+
+    def formatMsg(self, msg):
+        return "[{}] - {}".format(self.url, msg)
+
+    def stop(self):
+        self._stopped = True
+
+    def stopped(self):
+        return self._stopped
+
+    def ppm(self, counts):
+        return mqPpm(counts, self.sensorType, self.r0, self.rl, self.vcc,
+                     self.adcMax)
+
+    def calibrate(self, n=None):
+        """Set R0 from the buffered readings, taken in clean air."""
+        _, counts = self.bus.latest(self.pin, n)
+        self.r0 = mqCalibrate(counts, self.sensorType, self.rl, self.vcc,
+                              self.adcMax)
+        log.info(self.formatMsg("calibrated R0: {:.2f}".format(self.r0)))
+        return self.r0
+
+    def sample(self):
+        if self.stopped():
+            raise StopIteration(
+                "sensor: {} is not available.".format(self.pin))
+        ts, counts = self.bus.latest(self.pin, self.nSamples)
+        if not len(ts):
+            raise Exception("no readings from {} yet.".format(self.bus))
+        if time.time() - ts[-1] > self.stale:
+            raise Exception("no readings from {} for {}s.".format(
+                self.bus, self.stale))
+        if numpy.isnan(counts).all():
+            raise Exception("no channel {} on {}.".format(self.pin, self.bus))
+        return dict(timestamp=utcNow(), channel=self.pin,
+                    sensorType=self.sensorType,
+                    counts=numpy.nanmean(counts),
+                    PPM=numpy.nanmean(self.ppm(counts)))
@@ -0,0 +1,224 @@
+##
+## Simulated board for hosts without RPi.GPIO: a stand-in for the
+## GPIO and spidev modules with MAX31855 chips wired to the
+## thermodog board's pins.
+##
+import time
+import random
+import logging
+
+from threading import Lock
+
+from .max31855 import OC, SCG, SCV, encodeFrame
+
+log = logging.getLogger("thermodog")
+
+class _Script(object):
+    """A value that is a constant, a sequence (the last value holds)
+    or a function of seconds since the script started."""
+    def __init__(self, v):
+        self._t0 = time.time()
+        self.set(v)
+
+    def set(self, v):
+        self._v = v
+        self._i = 0
+
+    def __call__(self):
+        v = self._v
+        if callable(v):
+            return v(time.time() - self._t0)
+        if isinstance(v, (list, tuple)):
+            x = v[min(self._i, len(v) - 1)]
+            self._i += 1
+            return x
+        return v
+
+class Max31855Sim(object):
+    """A MAX31855 that latches a frame when chip-select goes low and
+    shifts it out, MSB first, on the data pin; the next bit is
+    presented after each rising clock edge."""
+    def __init__(self, gpio, cs_pin, clock_pin, data_pin, celsius=20.0,
+                 internal=25.0, noise=0.0, fault=0, faultRate=0.0):
+        self._gpio      = gpio
+        self.cs_pin     = cs_pin
+        self.clock_pin  = clock_pin
+        self.data_pin   = data_pin
+        self._celsius   = _Script(celsius)
+        self._internal  = _Script(internal)
+        self.noise      = noise
+        self.fault      = fault
+        self.faultRate  = faultRate
+        self._frame     = 0
+        self._bit       = 32
+        self.conversions = 0
+        gpio.attach(self)
+
+    def script(self, celsius=None, internal=None):
+        """Set the temperatures reported from now on."""
+        if celsius is not None:
+            self._celsius.set(celsius)
+        if internal is not None:
+            self._internal.set(internal)
+
+    def inject(self, fault=OC, rate=None):
+        """Report `fault` on every frame, or on a `rate` fraction."""
+        if rate is None:
+            self.fault, self.faultRate = fault, 0.0
+        else:
+            self.fault, self.faultRate = 0, rate
+            self._rfault = fault
+
+    def clear(self):
+        self.fault, self.faultRate = 0, 0.0
+
+    def frame(self):
+        fault = self.fault
+        if not fault and self.faultRate and random.random() < self.faultRate:
+            fault = self._rfault
+        c = self._celsius()
+        if self.noise:
+            c += random.gauss(0, self.noise)
+        self.conversions += 1
+        return encodeFrame(c, self._internal(), fault)
+
+    def selected(self):
+        return self._gpio.level(self.cs_pin) == 0
+
+    def onOutput(self, pin, v):
+        if pin == self.cs_pin and v == 0:
+            self._frame, self._bit = self.frame(), 31
+        elif pin == self.clock_pin and v == 1 and self.selected():
+            self._bit -= 1
+
+    def dataOut(self):
+        if self._bit < 0 or self._bit > 31:
+            return 1
+        return (self._frame >> self._bit) & 1
+
+class SimGPIO(object):
+    """Enough of the RPi.GPIO interface for ThermoDog."""
+    BOARD    = 10
+    BCM      = 11
+    OUT      = 0
+    IN       = 1
+    LOW      = 0
+    HIGH     = 1
+    PUD_OFF  = 20
+    PUD_DOWN = 21
+    PUD_UP   = 22
+    RISING   = 31
+    FALLING  = 32
+    BOTH     = 33
+
+    def __init__(self):
+        self._levels    = {}
+        self._modes     = {}
+        self._chips     = []
+        self._callbacks = {}
+        self._lock      = Lock()
+        self.mode       = None
+        self.calls      = 0
+
+    def attach(self, chip):
+        self._chips.append(chip)
+
+    @property
+    def chips(self):
+        return list(self._chips)
+
+    def level(self, pin):
+        return self._levels.get(pin, SimGPIO.HIGH)
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=PUD_OFF, initial=None):
+        self.calls += 1
+        self._modes[pin] = mode
+        if pull_up_down == SimGPIO.PUD_UP:
+            self._levels[pin] = SimGPIO.HIGH
+        elif pull_up_down == SimGPIO.PUD_DOWN:
+            self._levels[pin] = SimGPIO.LOW
+        elif initial is not None:
+            self._levels[pin] = initial
+
+    def output(self, pin, v):
+        self.calls += 1
+        v = SimGPIO.HIGH if v else SimGPIO.LOW
+        self._levels[pin] = v
+        for c in self._chips:
+            c.onOutput(pin, v)
+
+    def input(self, pin):
+        self.calls += 1
+        for c in self._chips:
+            if c.data_pin == pin and c.selected():
+                return c.dataOut()
+        return self.level(pin)
+
+    def drive(self, pin, v):
+        """Drive an input pin from outside, e.g., the power sensor,
+        firing any registered edge callback."""
+        old = self.level(pin)
+        self._levels[pin] = SimGPIO.HIGH if v else SimGPIO.LOW
+        cb = self._callbacks.get(pin)
+        if cb and old != self._levels[pin]:
+            edge, callback = cb
+            rising = self._levels[pin] == SimGPIO.HIGH
+            if edge == SimGPIO.BOTH or \
+               (edge == SimGPIO.RISING) == rising:
+                callback(pin)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self._callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self._callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self._callbacks = {}
+
+class _SimSpiDev(object):
+    """spidev.SpiDev reading frames from the chip on CE<device>."""
+    def __init__(self, gpio, cs_pins):
+        self._gpio    = gpio
+        self._cs_pins = cs_pins
+        self._chip    = None
+        self.max_speed_hz = 500000
+        self.mode     = 0
+        self.calls    = 0
+
+    def open(self, bus, device):
+        pin = self._cs_pins[device]
+        self._chip = [c for c in self._gpio.chips if c.cs_pin == pin][0]
+
+    def readbytes(self, n):
+        self.calls += 1
+        f = self._chip.frame()
+        return [(f >> (8*(3-i))) & 0xFF for i in range(n)]
+
+    def xfer2(self, data):
+        return self.readbytes(len(data))
+
+    def close(self):
+        self._chip = None
+
+class SimSpi(object):
+    """Stand-in for the spidev module."""
+    def __init__(self, gpio, cs_pins):
+        self._gpio    = gpio
+        self._cs_pins = cs_pins
+
+    def SpiDev(self):
+        return _SimSpiDev(self._gpio, self._cs_pins)
+
+## wired like the thermodog board: clock 23, data 21, cs 24 and 26
+## (CE0 and CE1), the power sensor reads high.
+GPIO   = SimGPIO()
+GPIO._levels[13] = SimGPIO.HIGH
+chips  = [Max31855Sim(GPIO, cs, 23, 21) for cs in (24, 26)]
+spidev = SimSpi(GPIO, [24, 26])
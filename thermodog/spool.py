@@ -0,0 +1,219 @@
+##
+## Durable, append-only spool for outbound data that could not be
+## delivered, e.g., metric data and SMS while the uplink is down.
+##
+import os
+import json
+import zlib
+import logging
+
+from threading import Lock
+
+log = logging.getLogger("thermodog")
+
+def _jsonDefault(o):
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    return str(o)
+
+class Spool(object):
+    """A bounded, crash-safe queue of records on disk.
+
+    Records are appended as checksummed JSON lines to numbered segment
+    files under `dirname`. A cursor file, replaced atomically, records
+    how far `replay` has delivered; torn or corrupt lines left by a
+    crash are skipped. When the spool grows beyond `maxBytes` the
+    oldest segments are discarded."""
+    CURSOR = "cursor.json"
+    SUFFIX = ".spool"
+
+    def __init__(self, dirname, maxBytes=64*1024*1024,
+                 segmentBytes=1024*1024, sync=True):
+        self._dirname  = dirname
+        self._maxbytes = maxBytes
+        self._segbytes = segmentBytes
+        self._sync     = sync
+        self._lock     = Lock()
+        self._stats    = {"appended": 0, "replayed": 0,
+                          "dropped": 0, "corrupt": 0}
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        self._cursor = self._loadCursor()
+        segs = self.segments()
+        self._current = segs[-1] if segs else self._cursor[0]
+        self._ofile = None
+
+    def __repr__(self):
+        return "Spool('{}')".format(self.dirname)
+
+    @property
+    def dirname(self):
+        return self._dirname
+
+    def stats(self):
+        s = dict(self._stats)
+        s["bytes"] = self.size()
+        return s
+
+    def _segPath(self, n):
+        return os.path.join(self.dirname, "{:010d}{}".format(n, Spool.SUFFIX))
+
+    def segments(self):
+        return sorted(int(f[:-len(Spool.SUFFIX)])
+                      for f in os.listdir(self.dirname)
+                      if f.endswith(Spool.SUFFIX))
+
+    def size(self):
+        return sum(os.path.getsize(self._segPath(n)) for n in self.segments())
+
+    def empty(self):
+        with self._lock:
+            seg, off = self._cursor
+            return not any(n > seg or
+                           (n == seg and os.path.getsize(self._segPath(n)) > off)
+                           for n in self.segments())
+
+    def _loadCursor(self):
+        try:
+            with open(os.path.join(self.dirname, Spool.CURSOR)) as f:
+                c = json.load(f)
+            return (int(c["segment"]), int(c["offset"]))
+        except (IOError, OSError, ValueError, KeyError):
+            segs = self.segments()
+            return (segs[0] if segs else 0, 0)
+
+    def _saveCursor(self, cursor):
+        path = os.path.join(self.dirname, Spool.CURSOR)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"segment": cursor[0], "offset": cursor[1]}, f)
+            f.flush()
+            if self._sync:
+                os.fsync(f.fileno())
+        os.rename(tmp, path)
+        self._cursor = cursor
+
+    def _writer(self):
+        if self._ofile is None:
+            path = self._segPath(self._current)
+            torn = False
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+            self._ofile = open(path, "ab")
+            if torn:
+                ## terminate a partial record left by a crash.
+                self._ofile.write(b"\n")
+        return self._ofile
+
+    def _rotate(self):
+        self._ofile.close()
+        self._ofile = None
+        self._current += 1
+
+    def _enforceBound(self):
+        segs = self.segments()
+        total = sum(os.path.getsize(self._segPath(n)) for n in segs)
+        while total > self._maxbytes and len(segs) > 1:
+            n = segs.pop(0)
+            sz = os.path.getsize(self._segPath(n))
+            os.remove(self._segPath(n))
+            total -= sz
+            self._stats["dropped"] += 1
+            log.warning("{} over {} bytes, dropped segment {}.".format(
+                self, self._maxbytes, n))
+            if self._cursor[0] <= n:
+                self._saveCursor((segs[0], 0))
+
+    def append(self, kind, payload):
+        """Durably append a record of type `kind`."""
+        body = json.dumps({"kind": kind, "payload": payload},
+                          default=_jsonDefault, sort_keys=True)
+        line = "{:08x} {}\n".format(
+            zlib.crc32(body.encode("utf-8")) & 0xffffffff, body)
+        with self._lock:
+            f = self._writer()
+            f.write(line.encode("utf-8"))
+            f.flush()
+            if self._sync:
+                os.fsync(f.fileno())
+            self._stats["appended"] += 1
+            if f.tell() >= self._segbytes:
+                self._rotate()
+                self._enforceBound()
+
+    def _parse(self, line):
+        try:
+            crc, body = line.decode("utf-8").rstrip("\n").split(" ", 1)
+            if int(crc, 16) != (zlib.crc32(body.encode("utf-8")) & 0xffffffff):
+                raise ValueError("checksum mismatch")
+            return json.loads(body)
+        except ValueError:
+            self._stats["corrupt"] += 1
+            return None
+
+    def _read(self, batchSize):
+        """Return (kind, payloads, cursor) for the next run of up to
+        `batchSize` records of the same kind."""
+        seg, off = self._cursor
+        kind, payloads = None, []
+        for n in [s for s in self.segments() if s >= seg]:
+            if n > seg:
+                seg, off = n, 0
+            with open(self._segPath(n), "rb") as f:
+                f.seek(off)
+                while len(payloads) < batchSize:
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        ## end of segment, or a torn write in progress.
+                        break
+                    rec = self._parse(line)
+                    if rec is not None:
+                        if kind is not None and rec["kind"] != kind:
+                            return kind, payloads, (seg, off)
+                        kind = rec["kind"]
+                        payloads.append(rec["payload"])
+                    off += len(line)
+            if len(payloads) >= batchSize:
+                break
+        return kind, payloads, (seg, off)
+
+    def replay(self, handlers, batchSize=20):
+        """Deliver spooled records oldest first, in batches of
+        consecutive records of one kind. `handlers` maps each kind to
+        a function taking a list of payloads and returning True once
+        delivered; replay stops at the first failed batch. Returns the
+        number of records delivered."""
+        delivered = 0
+        while True:
+            with self._lock:
+                kind, payloads, cursor = self._read(batchSize)
+                if cursor == self._cursor:
+                    return delivered
+            ok = True
+            if payloads and kind not in handlers:
+                log.warning("{} has no handler for {}, skipping {}.".format(
+                    self, kind, len(payloads)))
+            elif payloads:
+                try:
+                    ok = handlers[kind](payloads)
+                except Exception as e:
+                    log.warning("{} replay of {} failed: {}".format(
+                        self, kind, e))
+                    ok = False
+            if not ok:
+                return delivered
+            with self._lock:
+                self._saveCursor(cursor)
+                self._stats["replayed"] += len(payloads)
+                delivered += len(payloads)
+                for n in self.segments():
+                    if n < cursor[0] and n != self._current:
+                        os.remove(self._segPath(n))
+
+    def close(self):
+        with self._lock:
+            if self._ofile is not None:
+                self._ofile.close()
+                self._ofile = None
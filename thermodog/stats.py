@@ -0,0 +1,202 @@
+##
+## Streaming statistics in constant memory: the running statistics of
+## one event and time-bucketed rolling windows.
+##
+import math
+import calendar
+
+from collections import deque
+from threading import Lock
+
+def _seconds(ts):
+    """Epoch seconds of a datetime, or `ts` if already a number."""
+    if hasattr(ts, "utctimetuple"):
+        return calendar.timegm(ts.utctimetuple()) + ts.microsecond / 1e6
+    return float(ts)
+
+class P2Quantile(object):
+    """Estimate the `p` quantile of a stream with the P-square
+    algorithm (Jain & Chlamtac, 1985): five markers, no samples kept."""
+    def __init__(self, p):
+        self._p   = p
+        self._q   = []
+        self._n   = [0, 1, 2, 3, 4]
+        self._np  = [0, 2*p, 4*p, 2 + 2*p, 4]
+        self._dn  = [0, p/2., p, (1 + p)/2., 1]
+
+    @property
+    def p(self):
+        return self._p
+
+    def add(self, x):
+        q, n = self._q, self._n
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._np[i] += self._dn[i]
+        for i in (1, 2, 3):
+            d = self._np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or \
+               (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = self._parabolic(i, d)
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self._q, self._n
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1]))
+
+    def value(self):
+        q = self._q
+        if not q:
+            return float("nan")
+        if len(q) < 5:
+            ## exact while there are fewer samples than markers.
+            return q[min(len(q) - 1, int(round(self._p * (len(q) - 1))))]
+        return q[2]
+
+class RunningStats(object):
+    """Count, mean, variance (Welford), min, max and approximate
+    `quantiles` of a stream. NaNs are ignored."""
+    def __init__(self, quantiles=(.5, .9, .99)):
+        self._quantiles = quantiles
+        self.reset()
+
+    def reset(self):
+        self._n    = 0
+        self._mean = 0.0
+        self._m2   = 0.0
+        self._min  = float("nan")
+        self._max  = float("nan")
+        self._p2   = [P2Quantile(p) for p in self._quantiles]
+
+    def add(self, x):
+        x = float(x)
+        if math.isnan(x):
+            return
+        self._n += 1
+        d = x - self._mean
+        self._mean += d / self._n
+        self._m2 += d * (x - self._mean)
+        if self._n == 1:
+            self._min = self._max = x
+        else:
+            self._min = min(self._min, x)
+            self._max = max(self._max, x)
+        for p in self._p2:
+            p.add(x)
+
+    @property
+    def count(self):
+        return self._n
+    @property
+    def mean(self):
+        return self._mean if self._n else float("nan")
+    @property
+    def variance(self):
+        return self._m2 / (self._n - 1) if self._n > 1 else float("nan")
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+    @property
+    def min(self):
+        return self._min
+    @property
+    def max(self):
+        return self._max
+
+    def quantile(self, p):
+        for q in self._p2:
+            if q.p == p:
+                return q.value()
+        raise KeyError("quantile {} is not tracked".format(p))
+
+    def summary(self):
+        d = {"count": self.count, "mean": self.mean, "stdev": self.stdev,
+             "min": self.min, "max": self.max}
+        for q in self._p2:
+            d["p{:g}".format(100*q.p)] = q.value()
+        return d
+
+class RollingStats(object):
+    """Count, mean, variance, min and max over the last `windows`
+    seconds, kept as `bucket`-second summaries; memory is bounded by
+    the longest window. Safe to share between monitors."""
+    def __init__(self, windows=(5*60, 15*60, 60*60), bucket=60):
+        self._windows = tuple(sorted(windows))
+        self._bucket  = bucket
+        self._buckets = deque(maxlen=int(math.ceil(
+            self._windows[-1] / float(bucket))) + 1)
+        self._lock    = Lock()
+
+    @property
+    def windows(self):
+        return self._windows
+
+    @staticmethod
+    def _empty():
+        nan = float("nan")
+        return {"count": 0, "mean": nan, "stdev": nan, "min": nan, "max": nan}
+
+    def add(self, x, timestamp):
+        x = float(x)
+        if math.isnan(x):
+            return
+        b = int(_seconds(timestamp) // self._bucket)
+        with self._lock:
+            if self._buckets and self._buckets[-1][0] == b:
+                s = self._buckets[-1]
+                s[1] += 1
+                s[2] += x
+                s[3] += x*x
+                s[4] = min(s[4], x)
+                s[5] = max(s[5], x)
+            elif not self._buckets or self._buckets[-1][0] < b:
+                self._buckets.append([b, 1, x, x*x, x, x])
+
+    def window(self, seconds, now=None):
+        """Summary of the `seconds` up to `now`, by default the last
+        reading."""
+        with self._lock:
+            if not self._buckets:
+                return RollingStats._empty()
+            last = self._buckets[-1][0] if now is None \
+                else int(_seconds(now) // self._bucket)
+            first = last - int(math.ceil(seconds / float(self._bucket))) + 1
+            n, s, ss = 0, 0.0, 0.0
+            lo, hi = float("inf"), float("-inf")
+            for b, bn, bs, bss, bmin, bmax in self._buckets:
+                if first <= b <= last:
+                    n += bn
+                    s += bs
+                    ss += bss
+                    lo = min(lo, bmin)
+                    hi = max(hi, bmax)
+        if not n:
+            return RollingStats._empty()
+        mean = s / n
+        var = max(0.0, (ss - n*mean*mean) / (n - 1)) if n > 1 else float("nan")
+        return {"count": n, "mean": mean, "stdev": math.sqrt(var),
+                "min": lo, "max": hi}
+
+    def summary(self, now=None):
+        return dict((w, self.window(w, now)) for w in self._windows)
@@ -13,11 +13,11 @@ from threading import Thread, Lock, Event
 from dateutil import parser
 from datetime import timedelta, datetime
 
-if os.uname()[4].startswith("arm"):
-    import RPi.GPIO as GPIO
-else:
-    pass ## need the mock.
-
+from . import max31855
+from . import metrics
+from . import profiling
+from .bus import GPIO, Bus, makeBus
+from .leds import LedController
 from .common import Singleton, utcNow
 from .coms import SmsAlerter
 
@@ -35,7 +35,7 @@ class ThermoDog(object):
     power     = 13
     internet  = 32
     
-    def __init__(self, name=None, alerter=None):
+    def __init__(self, name=None, alerter=None, bus="bitbang", **busargs):
         if not name:
             self._name = socket.gethostname()
         else:
@@ -53,19 +53,25 @@ class ThermoDog(object):
         GPIO.setup(ThermoDog.power, GPIO.IN)
         GPIO.setup(ThermoDog.internet, GPIO.IN)
         
-        # Initialize clock and data pin
-        GPIO.setup(ThermoDog.clock_pin, GPIO.OUT)
-        GPIO.setup(ThermoDog.data_pin, GPIO.IN)
-        # Initialize thermocouple pins
-        for p in ThermoDog.cs_pins:
-            GPIO.setup(p, GPIO.OUT)        
-            GPIO.output(p, GPIO.HIGH)
+        # Initialize the thermocouple bus
+        if isinstance(bus, Bus):
+            self._bus = bus
+        else:
+            self._bus = makeBus(bus, ThermoDog.cs_pins, ThermoDog.clock_pin,
+                                ThermoDog.data_pin, **busargs)
+        self._bus.setup()
+        log.info(self.formatMsg("reading thermocouples over {}".format(
+            self._bus)))
         self.lock = Lock()
 
         # Setup sensors dict
         self._sensors = {}
         
-        # Setup status lights
+        # Setup status lights, all driven by one controller
+        def setLevel(pin, level):
+            GPIO.setup(pin, GPIO.IN,
+                       GPIO.PUD_UP if level else GPIO.PUD_DOWN)
+        self._leds = LedController(setLevel)
         self._LEDS = {}
         self.powerLed = self.LED(1)
         self.internetLed = self.LED(2)
@@ -78,18 +84,10 @@ class ThermoDog(object):
         else:
             self.powerLed.off
             
-        def powerAlert(c):
-            ## Make sure to wait a bit after being triggered, as race
-            ## has been witnessed.
-            time.sleep(.2)
-
+        def checkPower():
             if GPIO.input(ThermoDog.power):
                 log.info(self.formatMsg("Has power."))
-                ## if you get power, you could have been blinking (the
-                ## LED should probably have a thread, not be a
-                ## thread).
-                self.powerLed.stop()
-                self.powerLed = self.LED(1)
+                ## replaces any blinking without waiting on it.
                 self.powerLed.on
             else:
                 msg = self.formatMsg("Has lost power.")
@@ -97,10 +95,16 @@ class ThermoDog(object):
                 self.powerLed.blink(.5, .15)
                 ## Alert service monitors of power loss.
                 self.alert(msg)
+
+        def powerAlert(c):
+            ## Make sure to wait a bit after being triggered, as race
+            ## has been witnessed; on the LED loop, so as not to hold
+            ## up the GPIO callback thread.
+            self._leds.after(.2, checkPower)
         
         try:
             ## run it once at first start.
-            powerAlert(ThermoDog.power)
+            checkPower()
             GPIO.remove_event_detect(ThermoDog.power)
             GPIO.add_event_detect(ThermoDog.power, GPIO.BOTH,
                                   callback=powerAlert,
@@ -120,6 +124,10 @@ class ThermoDog(object):
     def alerter(self):
         return self._alerter
 
+    @property
+    def bus(self):
+        return self._bus
+
     def formatMsg(self, s):
         return "[{}] - {}".format(self.url, s)
 
@@ -134,6 +142,8 @@ class ThermoDog(object):
         self.stopSensors()
         log.info(self.formatMsg("stopping LEDs."))
         self.stopLeds()
+        self._leds.shutdown()
+        self.bus.close()
         try:
             GPIO.cleanup()
             log.info(self.formatMsg("restarted GPIO."))
@@ -148,50 +158,40 @@ class ThermoDog(object):
             v.stop()
 
     class _LED(object):
-        def __init__(s, p):
-            s.running = False
+        def __init__(s, p, controller):
             s.pin = p
-            s.done = False
+            s._controller = controller
 
         def __del__(s):
             try:
                 s.stop()
             except:
                 pass
-            
+
+        @property
+        def running(s):
+            return s._controller.running(s.pin)
+
         @property
         def on(s):
-            return GPIO.setup(s.pin, GPIO.IN, GPIO.PUD_UP)
+            return s._controller.play(s.pin, LedController.ON)
         @property
         def off(s):
-            return GPIO.setup(s.pin, GPIO.IN, GPIO.PUD_DOWN)
+            return s._controller.play(s.pin, LedController.OFF)
 
         def flash(s, duration=.1):
-            s.on
-            time.sleep(duration)
-            s.off
-
-        def blink(s, f=1, d=.1):            
-            def bb():
-                s.running = True
-                while s.running:
-                    s.flash(d)
-                    time.sleep(f)
-                s.done = True
+            s._controller.play(s.pin, LedController.flashing(duration))
+
+        def blink(s, f=1, d=.1):
             if not s.running:
-                s.th = Thread(target=bb)
-                s.th.start()
-            
+                s._controller.play(s.pin, LedController.blinking(f, d),
+                                   repeat=True)
+
+        def heartbeat(s):
+            s._controller.play(s.pin, LedController.HEARTBEAT, repeat=True)
+
         def stop(s):
-            if s.running:
-                s.running = False
-                while not s.done:
-                    time.sleep(.2)
-                    s.off
-                return True
-            else:
-                s.off
-                return False
+            return s._controller.stop(s.pin)
 
         def stopOn(s):
             if s.stop():
@@ -204,114 +204,132 @@ class ThermoDog(object):
     def LED(self, i):
         pinNo = ThermoDog.leds[i-1]
         if pinNo not in self._LEDS:
-            self._LEDS[pinNo] = ThermoDog._LED(pinNo)
+            self._LEDS[pinNo] = ThermoDog._LED(pinNo, self._leds)
         return self._LEDS[pinNo]
 
     ##
     ## The interface to the MAX31855 was adapted from:
     ##  github.com/Tuckie/max31855/blob/master/max31855.py
     ##
-    def read(self, n):
-        cs_pin = self.cs_pins[n-1]
-        def validate(data_32):
-            '''
-            Checks error bits to see if there are 
-            any SCV, SCG, or OC faults
-            '''
-            anyErrors = (data_32 & 0x10000) != 0    # Fault bit, D16
-            noConnection = (data_32 & 1) != 0       # OC bit, D0
-            shortToGround = (data_32 & 2) != 0      # SCG bit, D1
-            shortToVCC = (data_32 & 4) != 0         # SCV bit, D2
-            if anyErrors:
-                if noConnection:
-                    raise Exception("No Connection")
-                elif shortToGround:
-                    raise Exception("Thermocouple short to ground")
-                elif shortToVCC:
-                    raise Exception("Thermocouple short to VCC")
-                else:
-                    # Perhaps another SPI device is trying to send data?
-                    # Did you remember to initialize all other SPI devices?
-                    raise Exception("Unknown Error")
-            else:
-                return data_32
-
-        def tcpart(data_32):
-            tc_data = ((data_32 >> 18) & 0x3FFF)
-            if tc_data & 0x2000:
-                # two's compliment
-                without_resolution = ~tc_data & 0x1FFF
-                without_resolution += 1
-                without_resolution *= -1
-            else:
-                without_resolution = tc_data & 0x1FFF
-            return without_resolution * 0.25
-
-        def rjpart(data_32):
-            rj_data = ((data_32 >> 4) & 0xFFF)
-            if rj_data & 0x800:
-                without_resolution = ~rj_data & 0x7FF
-                without_resolution += 1
-                without_resolution *= -1
-            else:
-                without_resolution = rj_data & 0x7FF
-            return without_resolution * 0.0625
+    def readRaw(self, n):
+        """Raw 32-bit frame of thermocouple `n`."""
+        with self.lock, profiling.span("thermodog.readFrame"):
+            return self.bus.readFrame(n)
 
-        released=True
-        try:
-            self.lock.acquire()
-            released=False
-            bytesin = 0
-            # Select the chip
-            GPIO.output(cs_pin, GPIO.LOW)
-            # Read in 32 bits
-            for i in range(32):
-                GPIO.output(ThermoDog.clock_pin, GPIO.LOW)
-                bytesin = bytesin << 1
-                if (GPIO.input(ThermoDog.data_pin)):
-                    bytesin = bytesin | 1
-                GPIO.output(ThermoDog.clock_pin, GPIO.HIGH)
-            # Unselect the chip
-            GPIO.output(cs_pin, GPIO.HIGH)
-            v = validate(bytesin)
-            self.lock.release()
-            released=True
-            # Return tuple of current thermocouple amplifier readings.
-            return (tcpart(v), rjpart(v))
-        except:
-            if not released:
-                self.lock.release()
-            raise
-                  
-    def avg(self, tcn, nSamples=4, sampleRate=.05, calibration=(0,1)):
-        def adjust(xvv):
-	    return [(calibration[0] + vv*calibration[1]) for vv in xvv]
-        v = []
-        for e in xrange(nSamples):
-            v.append(adjust(self.read(tcn)))
+    def read(self, n):
+        v = self.readRaw(n)
+        f = max31855.faultCode(v)
+        if f:
+            raise max31855.fault(f, n)
+        # Return tuple of current thermocouple amplifier readings.
+        return (max31855.tcpart(v), max31855.rjpart(v))
+
+    @profiling.timed("thermodog.avg")
+    def avg(self, tcn, nSamples=4, sampleRate=.05, calibration=(0,1),
+            partial=False):
+        """Mean thermocouple and cold-junction celsius of `nSamples`
+        frames. A faulted frame raises its fault; with `partial`, only
+        every frame faulting does, and the others are averaged."""
+        frames = []
+        for e in range(nSamples):
+            frames.append(self.readRaw(tcn))
             time.sleep(sampleRate)
-        v = numpy.array(v)
-        return (numpy.nanmean(v[0:,0]),
-                numpy.nanmean(v[0:,1]))
-
-    def measure(self, tcn, **args):
+        tc, rj, faults = max31855.decodeFrames(frames)
+        metrics.countFaults(tcn, faults)
+        e = self._fault(tcn, faults, partial)
+        if e:
+            raise e
+        tc = calibration[0] + tc*calibration[1]
+        rj = calibration[0] + rj*calibration[1]
+        return (numpy.nanmean(tc), numpy.nanmean(rj))
+
+    @profiling.timed("thermodog.scan")
+    def scan(self, channels=None, nSamples=4, sampleRate=.05,
+             calibrations=None):
+        """Read every channel back-to-back, `nSamples` times, holding
+        the lock once; one settle delay per cycle serves all chips.
+        Returns channels x samples arrays of calibrated thermocouple
+        and cold-junction celsius (NaN where faulted) and fault codes.
+        Calibrations default to those of the registered sensors."""
+        if channels is None:
+            channels = range(1, len(self.cs_pins) + 1)
+        channels = list(channels)
+        calibrations = calibrations if calibrations else {}
+        frames = numpy.empty((len(channels), nSamples), dtype=numpy.uint32)
+        with self.lock:
+            for j in range(nSamples):
+                t0 = time.time()
+                for i, c in enumerate(channels):
+                    with profiling.span("thermodog.readFrame"):
+                        frames[i, j] = self.bus.readFrame(c)
+                if j < nSamples - 1:
+                    time.sleep(max(0, sampleRate - (time.time() - t0)))
+        tc, rj, faults = max31855.decodeFrames(frames)
+        for i, c in enumerate(channels):
+            metrics.countFaults(c, faults[i])
+            if c in calibrations:
+                a, b = calibrations[c]
+            elif c in self._sensors:
+                a, b = self._sensors[c].calibration
+            else:
+                a, b = (0, 1)
+            tc[i] = a + tc[i]*b
+            rj[i] = a + rj[i]*b
+        return tc, rj, faults
+
+    @staticmethod
+    def _fault(tcn, faults, partial):
+        """The exception of the first faulted frame, if any; with
+        `partial`, only if every frame faulted."""
+        bad = faults.nonzero()[0]
+        if len(bad) and (not partial or len(bad) == len(faults)):
+            return max31855.fault(faults[bad[0]], tcn)
+        return None
+
+    @staticmethod
+    def toMeasurement(tcn, v, rj, timestamp=None):
         def F(x):
             return x*9.0/5.0 + 32.0
+        return dict(timestamp=timestamp if timestamp else utcNow(),
+                    celsius=v, farenheit=F(v), internal=rj, channel=tcn)
+
+    @profiling.timed("thermodog.measure")
+    def measure(self, tcn, **args):
         v, rj = self.avg(tcn, **args)
-        return dict(timestamp=utcNow(), celsius=v,
-                    farenheit=F(v), internal=rj, channel=tcn)
+        return self.toMeasurement(tcn, v, rj)
+
+    def measureAll(self, channels=None, partial=False, **args):
+        """Measure channels with one `scan`. Returns a dict of channel
+        to measurement, or to the exception of a faulted channel, as
+        `avg` would raise it."""
+        if channels is None:
+            channels = range(1, len(self.cs_pins) + 1)
+        channels = list(channels)
+        tc, rj, faults = self.scan(channels, **args)
+        now = utcNow()
+        res = {}
+        for i, c in enumerate(channels):
+            e = self._fault(c, faults[i], partial)
+            if e:
+                res[c] = e
+            else:
+                res[c] = self.toMeasurement(c, numpy.nanmean(tc[i]),
+                                            numpy.nanmean(rj[i]), now)
+        return res
 
     ## handle to a thermocouple and corresponding LED
     class _Sensor(object):
         def __init__(self, parent, tcn, name=None,
                      calibration=(0, 1),
-                     nSamples=5, sampleRate=.1):            
+                     nSamples=5, sampleRate=.1, partial=False):
             self._parent     = parent
             self._name       = name if name else "TS-{}".format(tcn)
             self.pin         = tcn
             self.calibration = calibration
             self.nSamples    = nSamples
             self.sampleRate  = sampleRate
+            ## average over faulted frames unless all of them fault.
+            self.partial     = partial
             self.led         = self.parent.LED(self.pin)
             self._stopped    = False
             # turn the led on.
@@ -359,7 +377,8 @@ class ThermoDog(object):
                 return self.parent.measure(self.pin,
                                            calibration=self.calibration,
                                            nSamples=self.nSamples,
-                                           sampleRate=self.sampleRate)
+                                           sampleRate=self.sampleRate,
+                                           partial=self.partial)
             else:
                 raise StopIteration(
                     "sensor: {} is not available.".format(self.pin))